@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Compliance audit of device configs against a set of rules, evaluated in parallel worker processes.
+
+Rules are compiled once per worker, configs are parsed into indexed trees (see pyIOSXR.config.ConfigTree) so a rule
+only looks at the commands starting with its keyword, and the configs which did not change since the previous audit
+are not evaluated again.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import re
+import time
+import hashlib
+import itertools
+import multiprocessing
+
+# third party lib
+from six import PY2
+from six.moves import queue
+
+# local modules
+from pyIOSXR.config import ConfigTree
+
+
+# leading literal word of an anchored regex, e.g. ^ntp server, ^service-policy\s+input
+_KEYWORD_RE = re.compile(r'^\^([A-Za-z0-9_-]+)(?:$| |\\s)')
+
+
+def _keyword(pattern):
+    """Return the first word of all the commands the pattern can match, or None if it cannot be determined."""
+    match = _KEYWORD_RE.match(pattern)
+    if match is None or '|' in pattern:
+        return None
+    return match.group(1)
+
+
+class Rule(object):
+
+    """
+    One compliance rule.
+
+    Without section, the config must (present=True) or must not (present=False) contain a command matching `match`.
+    With section, the rule applies to each top level section matching `section`, e.g. every interface: the section
+    must or must not contain a command matching `match`. Sections containing a command matching `unless` are skipped.
+
+    Patterns are regular expressions searched in the commands, without indentation. Anchor them with ^ and start them
+    with a literal word (e.g. '^ntp server ') so only the commands starting with this word are evaluated.
+    """
+
+    def __init__(self, name, match, section=None, present=True, unless=None):
+        self.name = name
+        self.present = present
+        self.match = re.compile(match)
+        self.match_keyword = _keyword(match)
+        self.section = re.compile(section) if section is not None else None
+        self.section_keyword = _keyword(section) if section is not None else None
+        self.unless = re.compile(unless) if unless is not None else None
+        self.unless_keyword = _keyword(unless) if unless is not None else None
+
+    def __repr__(self):
+        return 'Rule(%r)' % self.name
+
+    def evaluate(self, tree):
+        """
+        Evaluate the rule against a config tree.
+
+        :return: list of violations, dicts {'rule': name, 'section': str or None, 'command': str or None}
+        """
+        matches = tree.match(self.match, self.match_keyword)
+        if self.section is None:
+            if self.present:
+                return [] if matches else [self._violation()]
+            return [self._violation(command=node.text) for node in matches]
+
+        sections = [node for node in tree.match(self.section, self.section_keyword) if node.parent is tree.root]
+        if self.unless is not None:
+            skipped = set(id(tree.section(node)) for node in tree.match(self.unless, self.unless_keyword)
+                          if node.parent is not tree.root)
+            sections = [section for section in sections if id(section) not in skipped]
+        matching = {}
+        for node in matches:
+            if node.parent is not tree.root:
+                matching.setdefault(id(tree.section(node)), []).append(node)
+        violations = []
+        for section in sections:
+            found = matching.get(id(section), [])
+            if self.present and not found:
+                violations.append(self._violation(section=section.text))
+            elif not self.present:
+                violations.extend(self._violation(section=section.text, command=node.text) for node in found)
+        return violations
+
+    def _violation(self, section=None, command=None):
+        return {'rule': self.name, 'section': section, 'command': command}
+
+
+def audit(rules, config):
+    """
+    Evaluate the rules against one config.
+
+    :param rules:  (list) Rule objects
+    :param config: (str or ConfigTree) Config, e.g. as displayed by show running-config
+    :return: (list) Violations, see Rule.evaluate
+    """
+    tree = config if isinstance(config, ConfigTree) else ConfigTree(config)
+    violations = []
+    for rule in rules:
+        violations.extend(rule.evaluate(tree))
+    return violations
+
+
+def config_digest(config):
+    return hashlib.sha1(config.encode('utf-8')).hexdigest()
+
+
+_worker_rules = None  # rules of the worker process, set once by the pool initializer
+
+
+def _init_worker(rules):
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _audit_host(args):
+    host, digest, config = args
+    try:
+        return host, digest, audit(_worker_rules, config), None
+    except Exception as err:  # reported per host, the others go on
+        return host, digest, None, '%s: %s' % (err.__class__.__name__, err)
+
+
+class AuditEngine(object):
+
+    """
+    Audits many configs in parallel worker processes, streaming the results per device as they are ready.
+
+    The engine remembers the config digest and violations of each host, so that auditing the fleet again only
+    evaluates the configs which changed. Usable as a context manager, like pyIOSXR.offload.ResultProcessor.
+    """
+
+    def __init__(self, rules, processes=None, max_pending=None, task_timeout=None):
+        """
+        :param rules:        (list) Rule objects, compiled once and sent once to each worker
+        :param processes:    (int) Number of worker processes (default: number of CPUs)
+        :param max_pending:  (int) Configs handed over to the workers and not audited yet, the next configs are not
+                             consumed above (default: twice the number of processes)
+        :param task_timeout: (float) Seconds after which a config not audited yet is reported as failed, e.g. when
+                             its worker died (default: wait forever)
+        """
+        self.rules = list(rules)
+        self.processes = processes
+        self.max_pending = max_pending or 2 * (processes or multiprocessing.cpu_count())
+        self.task_timeout = task_timeout
+        self._pool = None
+        self._results = {}  # host -> (config digest, violations)
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes, _init_worker, (self.rules, ))
+        return self._pool
+
+    def run(self, configs):
+        """
+        Audit the configs, yielding one result per host as soon as it is ready.
+
+        The configs are consumed lazily and each one is handed over to the workers as soon as it is retrieved,
+        max_pending at most at a time. Hosts whose config did not change since their previous audit are yielded right
+        away, from the previous result.
+
+        :param configs: Iterable of tuples (host, config)
+        :return: generator of dicts {'host': str, 'violations': list, 'changed': bool, 'error': str or None}
+        """
+        done = queue.Queue()
+        in_flight = {}  # task ID -> (host, digest, submission time)
+        task_ids = itertools.count()
+        for host, config in configs:
+            digest = config_digest(config)
+            previous = self._results.get(host)
+            if previous is not None and previous[0] == digest:
+                yield {'host': host, 'violations': previous[1], 'changed': False, 'error': None}
+                continue
+            while len(in_flight) >= self.max_pending:
+                for result in self._collect(done, in_flight, block=True):
+                    yield result
+            task_id = next(task_ids)
+            self._submit(task_id, host, digest, config, done)
+            in_flight[task_id] = (host, digest, time.time())
+            for result in self._collect(done, in_flight, block=False):
+                yield result
+        while in_flight:
+            for result in self._collect(done, in_flight, block=True):
+                yield result
+
+    def _submit(self, task_id, host, digest, config, done):
+        kwargs = {}
+        if not PY2:
+            # e.g. the result cannot be pickled: reported as the error of the host
+            kwargs['error_callback'] = lambda err: done.put(
+                (task_id, (host, digest, None, '%s: %s' % (err.__class__.__name__, err))))
+        self.pool.apply_async(_audit_host, ((host, digest, config), ),
+                              callback=lambda result: done.put((task_id, result)), **kwargs)
+
+    def _collect(self, done, in_flight, block):
+        """Return the results ready, waiting for one if block. Tasks older than task_timeout are reported as failed."""
+        results = []
+        while in_flight:
+            timeout = None
+            if self.task_timeout is not None:
+                oldest = min(submitted for _, _, submitted in in_flight.values())
+                timeout = max(oldest + self.task_timeout - time.time(), 0)
+            try:
+                if block and not results:
+                    task_id, result = done.get(timeout=timeout)
+                else:
+                    task_id, result = done.get_nowait()
+            except queue.Empty:
+                if not block or results:
+                    break
+                now = time.time()
+                for task_id, (host, digest, submitted) in list(in_flight.items()):
+                    if now - submitted >= self.task_timeout:
+                        del in_flight[task_id]
+                        results.append(self._result(host, digest, None, 'Audit not completed within %ss, the worker '
+                                                    'may have died.' % self.task_timeout))
+                continue
+            if in_flight.pop(task_id, None) is not None:  # not reported as timed out meanwhile
+                results.append(self._result(*result))
+        return results
+
+    def _result(self, host, digest, violations, error):
+        if error is None:
+            self._results[host] = (digest, violations)
+        return {'host': host, 'violations': violations, 'changed': True, 'error': error}
+
+    def audit_devices(self, devices, refresh=False):
+        """
+        Audit open IOSXR devices, retrieving their running config with get_running_config().
+
+        With a persistent store on the devices, configs which did not change are not retrieved again either.
+        """
+        return self.run((device.hostname, device.get_running_config(refresh=refresh)) for device in devices)
+
+    def forget(self, host=None):
+        """Drop the previous result of the host, or all of them, to audit again."""
+        if host is None:
+            self._results.clear()
+        else:
+            self._results.pop(host, None)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
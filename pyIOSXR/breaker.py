@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Per device circuit breaker, failing fast on the devices which keep failing instead of waiting for their timeouts.
+
+Closed: the requests go through, the failures are counted. Open: after too many failures in a row, the requests fail
+right away with CircuitOpenError. Half-open: once reset_timeout elapsed, one request goes through as a probe;
+the circuit closes again if it succeeds, and opens again if it fails.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import time
+from threading import Lock
+
+# local modules
+from pyIOSXR.exceptions import XMLCLIError
+from pyIOSXR.exceptions import ConnectError
+from pyIOSXR.exceptions import TimeoutError
+from pyIOSXR.exceptions import DeadlineError
+from pyIOSXR.exceptions import CircuitOpenError
+from pyIOSXR.exceptions import InvalidXMLResponse
+
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half-open'
+
+
+class _Circuit(object):
+
+    def __init__(self):
+        self.state = STATE_CLOSED
+        self.failures = 0  # connection failures and timeouts in a row
+        self.xml_errors = 0  # XML agent errors in a row
+        self.opened = 0.0
+        self.probing = False
+        self.last_error = None
+        self.rejected = 0
+        self.trips = 0
+
+
+class CircuitBreaker(object):
+
+    """
+    Tracks the failures per host and fails fast on the hosts whose circuit is open.
+
+    One instance is meant to be shared by all the IOSXR objects of a fleet, like pyIOSXR.ratelimit.RateLimiter,
+    so all the workers of a fleet run skip a dead device once it tripped.
+    """
+
+    def __init__(self, failure_threshold=3, xml_error_threshold=10, reset_timeout=60):
+        """
+        :param failure_threshold:   (int) ConnectError or TimeoutError in a row opening the circuit
+        :param xml_error_threshold: (int) XML agent errors in a row opening the circuit, e.g. invalid replies.
+                                    Higher than failure_threshold: most of them are caused by the request
+        :param reset_timeout:       (float) Seconds the circuit stays open before a probe request is let through
+        """
+        self.failure_threshold = failure_threshold
+        self.xml_error_threshold = xml_error_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits = {}
+        self._locker = Lock()
+
+    def _circuit(self, host):
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            circuit = self._circuits[host] = _Circuit()
+        return circuit
+
+    def before_call(self, host):
+        """
+        Raise CircuitOpenError if the request must not be sent to the host.
+
+        :return: (bool) True when the request is the probe of a half-open circuit
+        """
+        with self._locker:
+            circuit = self._circuit(host)
+            if circuit.state == STATE_CLOSED:
+                return False
+            retry_in = circuit.opened + self.reset_timeout - time.time()
+            if circuit.state == STATE_OPEN and retry_in <= 0:
+                circuit.state = STATE_HALF_OPEN
+            if circuit.state == STATE_HALF_OPEN and not circuit.probing:
+                circuit.probing = True
+                return True
+            circuit.rejected += 1
+            raise CircuitOpenError('Circuit open for {host} after: {error}. Next attempt in {retry_in:.0f}s.'.format(
+                host=host, error=circuit.last_error, retry_in=max(retry_in, 0)))
+
+    def record_success(self, host):
+        with self._locker:
+            circuit = self._circuit(host)
+            circuit.state = STATE_CLOSED
+            circuit.failures = circuit.xml_errors = 0
+            circuit.probing = False
+
+    def record_failure(self, host, error):
+        """Count the error if it tells the device is unhealthy, and open the circuit above the thresholds."""
+        if isinstance(error, (CircuitOpenError, DeadlineError)):
+            return  # the request was not sent
+        with self._locker:
+            circuit = self._circuit(host)
+            if isinstance(error, (ConnectError, TimeoutError)):
+                circuit.failures += 1
+            elif isinstance(error, (XMLCLIError, InvalidXMLResponse)):
+                circuit.xml_errors += 1
+            else:
+                # the device answered: the request was wrong, not the device
+                circuit.failures = circuit.xml_errors = 0
+                circuit.probing = False
+                if circuit.state == STATE_HALF_OPEN:
+                    circuit.state = STATE_CLOSED
+                return
+            circuit.last_error = '%s: %s' % (error.__class__.__name__, error)
+            if (circuit.state == STATE_HALF_OPEN or circuit.failures >= self.failure_threshold or
+                    circuit.xml_errors >= self.xml_error_threshold):
+                if circuit.state != STATE_OPEN:
+                    circuit.trips += 1
+                circuit.state = STATE_OPEN
+                circuit.opened = time.time()
+                circuit.probing = False
+
+    def call(self, host, function, *args, **kwargs):
+        """Execute function(*args, **kwargs) through the circuit of the host."""
+        probe = self.before_call(host)
+        recorded = False
+        try:
+            try:
+                result = function(*args, **kwargs)
+            except Exception as err:
+                recorded = not isinstance(err, DeadlineError)  # otherwise the probe did not reach the device
+                self.record_failure(host, err)
+                raise
+            recorded = True
+            self.record_success(host)
+            return result
+        finally:
+            if probe and not recorded:
+                # e.g. KeyboardInterrupt: the device did not answer, the next request is the probe
+                self._release_probe(host)
+
+    def _release_probe(self, host):
+        with self._locker:
+            self._circuit(host).probing = False
+
+    def state(self, host):
+        """Return the state of the circuit of the host: 'closed', 'open' or 'half-open'."""
+        with self._locker:
+            circuit = self._circuits.get(host)
+            if circuit is None:
+                return STATE_CLOSED
+            if circuit.state == STATE_OPEN and time.time() >= circuit.opened + self.reset_timeout:
+                return STATE_HALF_OPEN  # the next request is the probe
+            return circuit.state
+
+    def reset(self, host=None):
+        """Close the circuit of the host, or all of them."""
+        with self._locker:
+            if host is None:
+                self._circuits.clear()
+            else:
+                self._circuits.pop(host, None)
+
+    def stats(self):
+        """
+        Return the state of the circuits which are not closed, or which failed.
+
+        :return: dict {host: {'state': str, 'failures': int, 'xml_errors': int, 'rejected': int, 'trips': int,
+                              'last_error': str}}
+        """
+        with self._locker:
+            circuits = [(host, circuit) for host, circuit in self._circuits.items()
+                        if circuit.state != STATE_CLOSED or circuit.failures or circuit.xml_errors or circuit.trips]
+        stats = {}
+        for host, circuit in circuits:
+            stats[host] = {'state': self.state(host), 'failures': circuit.failures, 'xml_errors': circuit.xml_errors,
+                           'rejected': circuit.rejected, 'trips': circuit.trips, 'last_error': circuit.last_error}
+        return stats
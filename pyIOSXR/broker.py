@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Local connection broker, keeping the XML agent session to a device open between short-lived processes.
+
+The broker runs as a background process per device, listening on a UNIX socket.
+Clients (e.g. the Ansible module, executed once per task) send requests as JSON lines.
+The broker exits after being idle for a while.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import socket
+import hashlib
+import subprocess
+
+# local modules
+from pyIOSXR import exceptions
+from pyIOSXR.iosxr import IOSXR
+from pyIOSXR.iosxr import config_diff
+from pyIOSXR.exceptions import ConnectError
+from pyIOSXR.exceptions import IOSXRException
+
+
+DEFAULT_SOCKET_DIR = os.path.join(os.path.expanduser('~'), '.pyiosxr', 'brokers')
+DEFAULT_IDLE_TIMEOUT = 300
+
+
+def socket_path(hostname, port=22, username='', socket_dir=None):
+    """Return the path of the UNIX socket of the broker serving this device and user."""
+    key = '{username}@{hostname}:{port}'.format(username=username, hostname=hostname, port=port)
+    return os.path.join(socket_dir or DEFAULT_SOCKET_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.sock')
+
+
+class Broker(object):
+
+    """
+    Serves the requests of the local clients over one long-lived session with the device.
+
+    The config DB is locked when a candidate config is loaded and unlocked on commit or discard,
+    so the session does not keep other users out between tasks. A candidate config left by a client which
+    disconnected without committing nor discarding it is discarded, so it is not merged in the next task.
+    The running config is cached to compute merge diffs with a single config transfer, as long as the ID of the last
+    commit does not change: a commit from another session invalidates it.
+    """
+
+    _METHODS = (
+        'load_candidate_config',
+        'compare_config',
+        'compare_replace_config',
+        'commit_config',
+        'commit_replace_config',
+        'discard_config',
+        'rollback',
+        'get_running_config',
+        'ping',
+    )
+
+    def __init__(self, device, path, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.device = device
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self._running_config = None
+        self._running_commit_id = None  # last commit when the running config was retrieved
+        self._pending = False  # candidate config loaded by the current client, not committed nor discarded yet
+        self._socket = None
+
+    # ~~~ request handlers ~~~
+
+    def ping(self):
+        return True
+
+    def get_running_config(self, refresh=False):
+        commit_id = self.device.get_commit_id()
+        if refresh or self._running_config is None or commit_id != self._running_commit_id:
+            self._running_config = self.device._execute_config_show('show running-config')
+            self._running_commit_id = commit_id
+        return self._running_config
+
+    def load_candidate_config(self, config=None):
+        self.device.lock()
+        try:
+            self.device.load_candidate_config(config=config)
+            self._pending = True
+        except Exception:
+            # do not keep the other sessions out until the broker exits
+            try:
+                self.device.discard_config()
+            finally:
+                self.device.unlock()
+            raise
+
+    def compare_config(self):
+        _show_merge = self.device._execute_config_show('show configuration merge')
+        return config_diff(self.get_running_config(), _show_merge)
+
+    def compare_replace_config(self):
+        return self.device.compare_replace_config()
+
+    def _release(self, method, **kwargs):
+        try:
+            result = getattr(self.device, method)(**kwargs)
+            self._pending = False
+            return result
+        finally:
+            self._running_config = None
+            self.device.unlock()
+
+    def commit_config(self, **kwargs):
+        return self._release('commit_config', **kwargs)
+
+    def commit_replace_config(self, **kwargs):
+        return self._release('commit_replace_config', **kwargs)
+
+    def rollback(self, **kwargs):
+        self._running_config = None
+        return self.device.rollback(**kwargs)
+
+    def discard_config(self):
+        try:
+            self.device.discard_config()
+            self._pending = False
+        finally:
+            self.device.unlock()
+
+    def _end_session(self):
+        """Discard the candidate config of a client which went away, e.g. a task failing after the load."""
+        if not self._pending:
+            return
+        try:
+            self.discard_config()
+        except Exception:
+            self._pending = False  # the session is reopened on the next request if it is dead
+
+    # ~~~ server ~~~
+
+    def handle(self, request):
+        """
+        Execute one request and build the reply.
+
+        :param request: (dict) {'method': str, 'kwargs': dict}
+        :return: (dict) {'result': ...} or {'error': str, 'error_type': str}
+        """
+        method = request.get('method')
+        if method not in self._METHODS:
+            return {'error': 'Unknown method: %s' % method, 'error_type': 'InvalidInputError'}
+        try:
+            if not self.device.is_alive():
+                self.device.close()  # force close for safety
+                self.device.open()  # reopen
+                self._running_config = None
+            return {'result': getattr(self, method)(**request.get('kwargs', {}))}
+        except IOSXRException as err:
+            return {'error': str(err), 'error_type': err.__class__.__name__}
+        except Exception as err:  # keep serving the other clients
+            return {'error': str(err), 'error_type': 'IOSXRException'}
+
+    def _socket_lock(self):
+        """Return the lock file serialising the brokers of the same device while they bind or remove the socket."""
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        lock_file = open(self.path + '.lock', 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when closed
+        return lock_file
+
+    def _bind(self):
+        """Bind the socket. Return False when another broker already serves the device."""
+        with self._socket_lock():
+            if os.path.exists(self.path):
+                if _listening(self.path):
+                    return False  # spawned at the same time by another client
+                os.remove(self.path)  # stale socket left behind by a previous broker
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            umask = os.umask(0o177)  # socket accessible to the owner only
+            try:
+                self._socket.bind(self.path)
+            finally:
+                os.umask(umask)
+            self._socket.listen(16)
+        self._socket.settimeout(self.idle_timeout)
+        return True
+
+    def serve(self):
+        """Serve the clients, one request at a time, until idle for more than idle_timeout seconds."""
+        if not self._bind():
+            self.device.close()
+            return
+        try:
+            while True:
+                try:
+                    conn, _ = self._socket.accept()
+                except socket.timeout:
+                    break  # idle for too long
+                try:
+                    conn.settimeout(None)
+                    stream = conn.makefile('rwb')
+                    for line in stream:
+                        reply = self.handle(json.loads(line.decode('utf-8')))
+                        stream.write(json.dumps(reply).encode('utf-8') + b'\n')
+                        stream.flush()
+                except (IOError, ValueError):
+                    pass  # client went away or sent garbage
+                finally:
+                    conn.close()
+                    self._end_session()
+        finally:
+            with self._socket_lock():
+                self._socket.close()
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+            self.device.close()
+
+
+def _listening(path):
+    """Tell if a broker accepts connections on the socket."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+class BrokerClient(object):
+
+    """
+    Client of the broker serving a device, with the same interface as IOSXR for the config workflow.
+
+    Starts the broker in the background when there is none running for this device.
+    """
+
+    def __init__(self,
+                 hostname,
+                 username,
+                 password,
+                 port=22,
+                 timeout=60,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 socket_dir=None):
+        """
+        Broker client constructor.
+
+        :param hostname:     (str) IP or FQDN of the target device
+        :param username:     (str) Username
+        :param password:     (str) Password
+        :param port:         (int) SSH Port (default: 22)
+        :param timeout:      (int) Timeout (default: 60 sec)
+        :param idle_timeout: (int) Seconds after which an unused broker closes the session and exits (default: 300)
+        :param socket_dir:   (str) Directory of the broker sockets (default: ~/.pyiosxr/brokers)
+        """
+        self.hostname = str(hostname)
+        self.username = str(username)
+        self.password = str(password)
+        self.port = int(port)
+        self.timeout = int(timeout)
+        self.idle_timeout = int(idle_timeout)
+        self.path = socket_path(self.hostname, port=self.port, username=self.username, socket_dir=socket_dir)
+        self._socket = None
+        self._stream = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        self._socket = sock
+        self._stream = sock.makefile('rwb')
+
+    def _spawn(self):
+        settings = {
+            'hostname': self.hostname,
+            'username': self.username,
+            'password': self.password,
+            'port': self.port,
+            'timeout': self.timeout,
+            'idle_timeout': self.idle_timeout,
+            'path': self.path,
+        }
+        # the credentials go through stdin, never through the command line
+        # and the output goes nowhere: the callers, e.g. Ansible modules, read their stdout until EOF
+        with open(os.devnull, 'wb') as devnull:
+            process = subprocess.Popen([sys.executable, '-m', 'pyIOSXR.broker'],
+                                       stdin=subprocess.PIPE,
+                                       stdout=devnull,
+                                       stderr=devnull,
+                                       close_fds=True,
+                                       preexec_fn=os.setsid)  # survives the process that spawned it
+        process.stdin.write(json.dumps(settings).encode('utf-8'))
+        process.stdin.close()
+        return process
+
+    def open(self):
+        """Connect to the broker of the device, starting it if necessary."""
+        try:
+            self._connect()
+            return
+        except socket.error as sock_err:
+            if sock_err.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise ConnectError('Unable to reach the broker: %s' % sock_err)
+        process = self._spawn()
+        start = time.time()
+        while time.time() - start < self.timeout:
+            exited = process.poll() is not None  # failed, or another broker serves the device
+            try:
+                self._connect()
+                return
+            except socket.error:
+                if exited:
+                    raise ConnectError('Broker for %s exited while connecting to the device.' % self.hostname)
+                time.sleep(.1)
+        raise ConnectError('Timed out waiting for the broker of %s.' % self.hostname)
+
+    def close(self):
+        """Disconnect from the broker. The broker and its session with the device stay up."""
+        if self._socket is not None:
+            self._stream.close()
+            self._socket.close()
+            self._socket = self._stream = None
+
+    def call(self, method, **kwargs):
+        """
+        Execute a request through the broker.
+
+        Errors raised on the broker side are re-raised locally with the same exception type.
+        """
+        self._stream.write(json.dumps({'method': method, 'kwargs': kwargs}).encode('utf-8') + b'\n')
+        self._stream.flush()
+        line = self._stream.readline()
+        if not line:
+            raise ConnectError('Connection with the broker of %s lost.' % self.hostname)
+        reply = json.loads(line.decode('utf-8'))
+        if 'error' in reply:
+            raise getattr(exceptions, reply['error_type'], IOSXRException)(reply['error'])
+        return reply['result']
+
+    def load_candidate_config(self, filename=None, config=None):
+        if filename is not None:
+            with open(filename) as f:
+                config = f.read()
+        return self.call('load_candidate_config', config=config)
+
+    def compare_config(self):
+        """Return the merge diff, computed against the running config cached by the broker."""
+        return self.call('compare_config')
+
+    def compare_replace_config(self):
+        return self.call('compare_replace_config')
+
+    def commit_config(self, label=None, comment=None, confirmed=None):
+        return self.call('commit_config', label=label, comment=comment, confirmed=confirmed)
+
+    def commit_replace_config(self, label=None, comment=None, confirmed=None):
+        return self.call('commit_replace_config', label=label, comment=comment, confirmed=confirmed)
+
+    def discard_config(self):
+        return self.call('discard_config')
+
+    def rollback(self, rb_id=1):
+        return self.call('rollback', rb_id=rb_id)
+
+    def get_running_config(self, refresh=False):
+        return self.call('get_running_config', refresh=refresh)
+
+
+def main():
+    settings = json.loads(sys.stdin.read())
+    device = IOSXR(settings['hostname'],
+                   settings['username'],
+                   settings['password'],
+                   port=settings['port'],
+                   timeout=settings['timeout'],
+                   lock=False)
+    device.open()
+    Broker(device, settings['path'], idle_timeout=settings['idle_timeout']).serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Builds the XML requests sent to the XML agent of devices running IOS-XR."""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import re
+from threading import Lock
+from xml.sax.saxutils import escape as escape_xml
+
+# third party lib
+from six import text_type
+from six import string_types
+from six import integer_types
+
+# local modules
+from pyIOSXR.exceptions import InvalidInputError
+
+
+XML_REQUEST_HEADER = '<?xml version="1.0" encoding="UTF-8"?><Request MajorVersion="1" MinorVersion="0">'
+XML_REQUEST_FOOTER = '</Request>'
+
+CONFIG_SOURCES = ('CurrentConfig', 'ChangedConfig', 'MergedConfig', 'CommitChanges')
+
+_TAG_RE = re.compile(r'^[A-Za-z_][\w.-]*$')
+_ATTR_ESCAPE = {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'}
+_MAX_TEMPLATES = 1024
+
+_templates = {}
+_templates_locker = Lock()
+
+
+def wrap_request(command_xml):
+    """Wrap one or more operations into the Request document expected by the XML agent."""
+    return XML_REQUEST_HEADER + command_xml + XML_REQUEST_FOOTER
+
+
+def escape_attr(value):
+    """Escape a value to be used between the double quotes of an XML attribute."""
+    return escape_xml(value if isinstance(value, string_types) else text_type(value), _ATTR_ESCAPE)
+
+
+def _check_tag(tag):
+    if not isinstance(tag, string_types) or not _TAG_RE.match(tag):
+        raise InvalidInputError('Invalid XML element name: {tag!r}'.format(tag=tag))
+    return tag
+
+
+def serialize(data):
+    """
+    Serialize a configuration subtree into XML.
+
+    :param data: (dict) Element name -> value, where value is:
+                        - a dict for nested elements
+                        - a list to repeat the element, once for each item
+                        - None for an empty element (e.g. to select a leaf in a Get or Delete)
+                        - a bool, rendered as true / false
+                        - anything else, rendered as escaped text
+                 Use an OrderedDict where the order of the elements matters.
+    :return: (str) XML
+    """
+    parts = []
+    _serialize(data, parts)
+    return ''.join(parts)
+
+
+def _serialize(data, parts):
+    for tag, value in data.items():
+        _check_tag(tag)
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if item is None:
+                parts.append('<%s/>' % tag)
+                continue
+            parts.append('<%s>' % tag)
+            if isinstance(item, dict):
+                _serialize(item, parts)
+            elif isinstance(item, bool):
+                parts.append('true' if item else 'false')
+            elif isinstance(item, integer_types + (float,)):
+                parts.append(str(item))
+            else:
+                parts.append(escape_xml(item if isinstance(item, string_types) else str(item)))
+            parts.append('</%s>' % tag)
+
+
+def _template(operation, path, source=None):
+    """
+    Return the opening and closing strings wrapping the payload at `path`.
+
+    Templates are serialized once and cached, so a request only costs the serialization of its payload.
+    """
+    key = (operation, source, path)
+    template = _templates.get(key)
+    if template is not None:
+        return template
+    if source is not None and source not in CONFIG_SOURCES:
+        raise InvalidInputError('source must be one of: {sources}'.format(sources=', '.join(CONFIG_SOURCES)))
+    for tag in path:
+        _check_tag(tag)
+    configuration = '<Configuration Source="%s">' % source if source else '<Configuration>'
+    template = (
+        '<%s>%s%s' % (operation, configuration, ''.join('<%s>' % tag for tag in path)),
+        '%s</Configuration></%s>' % (''.join('</%s>' % tag for tag in reversed(path)), operation)
+    )
+    with _templates_locker:
+        if len(_templates) >= _MAX_TEMPLATES:
+            _templates.clear()
+        _templates[key] = template
+    return template
+
+
+def _build(operation, path, data=None, source=None):
+    if isinstance(path, string_types):
+        path = (path,)
+    prefix, suffix = _template(operation, tuple(path), source=source)
+    return prefix + (serialize(data) if data else '') + suffix
+
+
+def build_get_config(path=(), data=None, source=None):
+    """
+    Build a <Get><Configuration> request.
+
+    :param path:   (tuple) Element names from <Configuration> down to the subtree, e.g. ('NTP', )
+    :param data:   (dict) Optional filter under the path, see serialize()
+    :param source: (str) Optional configuration source: CurrentConfig, ChangedConfig, MergedConfig or CommitChanges
+    """
+    return _build('Get', path, data=data, source=source)
+
+
+def build_set_config(path, data):
+    """
+    Build a <Set><Configuration> request.
+
+    :param path: (tuple) Element names from <Configuration> down to the subtree
+    :param data: (dict) Naming and leaves to set under the path, see serialize()
+    """
+    if not data:
+        raise InvalidInputError('Nothing to set.')
+    return _build('Set', path, data=data)
+
+
+def build_delete_config(path, data=None):
+    """
+    Build a <Delete><Configuration> request.
+
+    :param path: (tuple) Element names from <Configuration> down to the subtree
+    :param data: (dict) Optional naming and leaves under the path, see serialize()
+    """
+    if not path:
+        raise InvalidInputError('Refusing to delete the entire configuration.')
+    return _build('Delete', path, data=data)
+
+
+def build_commit(replace=False, label=None, comment=None, confirmed=None):
+    """
+    Build a <Commit> request.
+
+    :param replace:   (bool) Replace the running config with the candidate
+    :param label:     (str) Commit label
+    :param comment:   (str) Commit comment
+    :param confirmed: (int) Auto-rollback if not confirmed within 30 to 300 seconds
+    """
+    rpc_command = '<Commit'
+    if replace:
+        rpc_command += ' Replace="true"'
+    if label:
+        rpc_command += ' Label="%s"' % escape_attr(label)
+    if comment:
+        rpc_command += ' Comment="%s"' % escape_attr(comment)
+    if confirmed:
+        if 30 <= int(confirmed) <= 300:
+            rpc_command += ' Confirmed="%d"' % int(confirmed)
+        else:
+            raise InvalidInputError('confirmed needs to be between 30 and 300 seconds')
+    return rpc_command + '/>'
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Command line tool running pyIOSXR operations across many devices."""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import os
+import sys
+import json
+import time
+import getpass
+import argparse
+import threading
+
+# third party lib
+from six import binary_type
+from six.moves import queue
+
+# local modules
+from pyIOSXR.iosxr import IOSXR
+from pyIOSXR.breaker import CircuitBreaker
+
+
+_DONE = object()  # tells the workers there are no more hosts
+
+
+def parse_inventory(lines):
+    """
+    Parse the inventory, one device per line: hostname followed by optional key=value settings, e.g.:
+
+        edge01.bjm01 port=22 timeout=30
+        edge01.yyz01 username=admin
+
+    Empty lines and lines starting with # are ignored. Lines are consumed lazily, one device at a time.
+
+    :param lines: Iterable of lines, e.g. a file object
+    :return: generator of dicts {'hostname': str, ...}
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        host = {'hostname': fields[0]}
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            host[key] = value
+        yield host
+
+
+def run_operation(device, args):
+    """Execute the requested operation on an open device and return a JSON serializable result."""
+    if args.operation == 'show':
+        return device._execute_show(' '.join(args.command))
+    if args.operation == 'rpc':
+        result = device.make_rpc_call(args.rpc)
+        return result.decode('utf-8') if isinstance(result, binary_type) else result
+    # load
+    device.lock()
+    try:
+        device.load_candidate_config(filename=args.filename)
+        diff = device.compare_replace_config() if args.replace else device.compare_config()
+        committed = False
+        if args.commit and diff:
+            commit = device.commit_replace_config if args.replace else device.commit_config
+            commit(label=args.label, comment=args.comment)
+            committed = True
+        else:
+            device.discard_config()
+        return {'diff': diff, 'committed': committed}
+    finally:
+        device.unlock()
+
+
+def _process_host(host, args, device_class, breaker=None):
+    record = {'host': host['hostname']}
+    start = time.time()
+    device = None
+    try:
+        device = device_class(host['hostname'],
+                              host.get('username', args.username),
+                              host.get('password', args.password),
+                              port=int(host.get('port', args.port)),
+                              timeout=int(host.get('timeout', args.timeout)),
+                              lock=False,
+                              breaker=breaker)
+        device.open()
+        record['connect_latency'] = round(time.time() - start, 3)
+        record['result'] = run_operation(device, args)
+        record['ok'] = True
+    except Exception as err:  # one device must not stop the others
+        record['ok'] = False
+        record['error'] = str(err)
+        record['error_type'] = err.__class__.__name__
+    finally:
+        if device is not None and hasattr(device, 'device'):
+            try:
+                device.close()
+            except Exception:
+                pass  # nothing else to do for this host
+    record['latency'] = round(time.time() - start, 3)
+    return record
+
+
+def execute(hosts, args, output, device_class=IOSXR, breaker=None):
+    """
+    Run the operation on all the hosts, with at most args.concurrency in flight.
+
+    Hosts are pulled from the iterable only as workers become available and each result is written to `output`
+    as one JSON line when the host completes, so memory does not grow with the size of the inventory.
+    The workers share the circuit breaker: the hosts listed again after failing repeatedly fail fast.
+
+    :return: dict summary {'hosts': int, 'failed': int, 'latency_max': float, 'latency_total': float}
+    """
+    pending = queue.Queue(maxsize=args.concurrency)
+    output_locker = threading.Lock()
+    summary = {'hosts': 0, 'failed': 0, 'latency_max': 0.0, 'latency_total': 0.0}
+
+    def _worker():
+        while True:
+            host = pending.get()
+            if host is _DONE:
+                return
+            record = _process_host(host, args, device_class, breaker=breaker)
+            line = json.dumps(record, sort_keys=True)
+            with output_locker:
+                output.write(line + '\n')
+                output.flush()
+                summary['hosts'] += 1
+                summary['failed'] += 0 if record['ok'] else 1
+                summary['latency_total'] += record['latency']
+                summary['latency_max'] = max(summary['latency_max'], record['latency'])
+
+    workers = [threading.Thread(target=_worker) for _ in range(args.concurrency)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for host in hosts:
+        pending.put(host)  # blocks while all the workers are busy
+    for _ in workers:
+        pending.put(_DONE)
+    for worker in workers:
+        worker.join()
+    return summary
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pyiosxr', description='Run pyIOSXR operations across many devices.')
+    parser.add_argument('-i', '--inventory', required=True,
+                        help='inventory file, one device per line: hostname [key=value ...], - for stdin')
+    parser.add_argument('-u', '--username', default=getpass.getuser(), help='default username')
+    parser.add_argument('--password-env', default='PYIOSXR_PASSWORD',
+                        help='environment variable holding the default password (prompted if not set)')
+    parser.add_argument('--port', type=int, default=22, help='default SSH port')
+    parser.add_argument('-t', '--timeout', type=int, default=60, help='default timeout, in seconds')
+    parser.add_argument('-c', '--concurrency', type=int, default=20, help='number of devices handled in parallel')
+    parser.add_argument('-o', '--output', default='-', help='JSON Lines output file, - for stdout')
+    parser.add_argument('--failure-threshold', type=int, default=3,
+                        help='connection failures or timeouts in a row after which a host fails fast')
+    parser.add_argument('--reset-timeout', type=float, default=60,
+                        help='seconds a failing host fails fast before being tried again')
+    operations = parser.add_subparsers(dest='operation')
+    operations.required = True
+    show = operations.add_parser('show', help='execute a show command')
+    show.add_argument('command', nargs='+', help='show command, e.g.: show ntp associations')
+    rpc = operations.add_parser('rpc', help='execute an XML request')
+    rpc.add_argument('rpc', help='XML request, e.g.: <Get><Operational><SystemTime/></Operational></Get>')
+    load = operations.add_parser('load', help='load a candidate config and return the diff, optionally commit it')
+    load.add_argument('filename', help='file containing the config')
+    load.add_argument('--replace', action='store_true', help='replace the running config instead of merging')
+    load.add_argument('--commit', action='store_true', help='commit the changes, discarded otherwise')
+    load.add_argument('--label', help='commit label')
+    load.add_argument('--comment', help='commit comment')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.concurrency < 1:
+        args.concurrency = 1
+    args.password = os.environ.get(args.password_env) or getpass.getpass('Password: ')
+    inventory = sys.stdin if args.inventory == '-' else open(args.inventory)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        breaker = CircuitBreaker(failure_threshold=args.failure_threshold, reset_timeout=args.reset_timeout)
+        summary = execute(parse_inventory(inventory), args, output, breaker=breaker)
+    finally:
+        if inventory is not sys.stdin:
+            inventory.close()
+        if output is not sys.stdout:
+            output.close()
+    sys.stderr.write('{hosts} hosts, {failed} failed, max latency {latency_max:.3f}s, '
+                     'avg latency {avg:.3f}s\n'.format(avg=summary['latency_total'] / (summary['hosts'] or 1),
+                                                       **summary))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
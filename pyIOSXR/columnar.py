@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Columnar export of operational tables (ARP, routes, L2VPN MAC addresses).
+
+The reply is parsed incrementally and each row is decoded straight into typed columns, stdlib arrays of integers
+and floats, the strings being dictionary encoded: no dict per row, and the parsed rows are dropped as soon as they
+are decoded. The columns convert to NumPy arrays without copy when NumPy is installed.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+from array import array
+from collections import OrderedDict
+
+# third party lib
+from lxml import etree as ET
+from six import text_type
+from six import string_types
+
+try:
+    import numpy
+except ImportError:  # optional, for to_numpy()
+    numpy = None
+
+# local modules
+from pyIOSXR.exceptions import XMLCLIError
+from pyIOSXR.exceptions import IteratorIDError
+from pyIOSXR.exceptions import InvalidXMLResponse
+from pyIOSXR.prefixindex import _Naming
+from pyIOSXR.prefixindex import parse_address
+from pyIOSXR.prefixindex import format_address
+
+
+def _typecode(*typecodes):
+    # first typecode of at least 4 bytes: the sizes of the C types depend on the platform
+    for typecode in typecodes:
+        try:
+            if array(typecode).itemsize >= 4:
+                return typecode
+        except ValueError:  # e.g. 'q' on Python 2
+            continue
+    raise ValueError('No array typecode among %r' % (typecodes, ))
+
+
+_UINT32 = _typecode('I', 'L')
+_INT64 = _typecode('q', 'l')
+
+KIND_STR = 'str'
+KIND_INT = 'int'
+KIND_FLOAT = 'float'
+KIND_BOOL = 'bool'
+KIND_IPV4 = 'ipv4'
+KIND_MAC = 'mac'
+
+
+def _parse_int(text):
+    return int(text)
+
+
+def _parse_bool(text):
+    return 1 if text == 'true' else 0
+
+
+def _parse_mac(text):
+    digits = text.replace('.', '').replace(':', '').replace('-', '')
+    if len(digits) != 12:
+        raise ValueError('Invalid MAC address: %r' % text)
+    return int(digits, 16)
+
+
+def _format_mac(value):
+    digits = '%012x' % value
+    return '.'.join((digits[0:4], digits[4:8], digits[8:12]))  # as IOS-XR
+
+
+# kind: (typecode, parse(text) -> stored value, value of the missing and invalid fields, format(stored) -> value)
+_KINDS = {
+    KIND_STR: (_UINT32, None, '', None),
+    KIND_INT: (_INT64, _parse_int, 0, None),
+    KIND_FLOAT: ('d', float, float('nan'), None),
+    KIND_BOOL: ('b', _parse_bool, 0, bool),
+    KIND_IPV4: (_UINT32, parse_address, 0, format_address),
+    KIND_MAC: (_INT64, _parse_mac, 0, _format_mac),
+}
+
+
+class Field(object):
+
+    """
+    Column of a table: where its value is found in each row, and its type.
+    """
+
+    def __init__(self, name, path, kind=KIND_STR, inherited=False):
+        """
+        :param name:      (str) Name of the column
+        :param path:      (str) Path of the value relative to the row element, tags separated by /,
+                          e.g. 'Naming/Address'; the first match is used. When inherited, name of the naming key
+                          of an ancestor of the row, e.g. 'VRFName'
+        :param kind:      (str) 'str' (dictionary encoded), 'int', 'float', 'bool', 'ipv4' or 'mac'
+        :param inherited: (bool) The value is a naming key of the elements containing the row
+        """
+        if kind not in _KINDS:
+            raise ValueError('Invalid column kind: %r' % kind)
+        if not path or any(not tag or tag[0] in '.@*[' for tag in path.split('/')):
+            raise ValueError('Invalid path: %r, expected tags separated by /' % path)
+        self.name = name
+        self.path = path
+        self.kind = kind
+        self.inherited = inherited
+
+
+class TableSchema(object):
+
+    """
+    Operational table: the request retrieving it, the rows in the reply and their columns.
+    """
+
+    def __init__(self, name, request, row, fields):
+        """
+        :param name:    (str) Name of the table
+        :param request: (str) XML request, as passed to make_rpc_call
+        :param row:     (str) Tag of the row elements, optionally with the tag of their parent, e.g. 'EntryTable/Entry'
+        :param fields:  (list) Field of each column
+        """
+        self.name = name
+        self.request = request
+        self.parent_tag, _, self.row_tag = row.rpartition('/')
+        self.fields = list(fields)
+        self._paths = _compile_paths(self.fields)
+
+
+def _compile_paths(fields):
+    """Tree of the paths of the fields: {tag: ([position of the fields ending at this tag], {child tag: ...})}"""
+    paths = {}
+    for position, field in enumerate(fields):
+        if field.inherited:
+            continue
+        node = paths
+        tags = field.path.split('/')
+        for tag in tags[:-1]:
+            node = node.setdefault(tag, ([], {}))[1]
+        node.setdefault(tags[-1], ([], {}))[0].append(position)
+    return paths
+
+
+def _collect(element, paths, texts):
+    # one pass over the children instead of one findtext per field, which parses the path each time
+    for child in element:
+        target = paths.get(child.tag)
+        if target is None:
+            continue
+        positions, children = target
+        for position in positions:
+            if position not in texts:
+                texts[position] = child.text
+        if children:
+            _collect(child, children, texts)
+
+
+ARP_TABLE = TableSchema(
+    'arp',
+    '<Get><Operational><ARP></ARP></Operational></Get>',
+    'EntryTable/Entry',
+    [
+        Field('node', 'NodeName', inherited=True),
+        Field('interface', 'Naming/InterfaceName'),
+        Field('address', 'Naming/Address', KIND_IPV4),
+        Field('mac', 'HardwareAddress', KIND_MAC),
+        Field('state', 'State'),
+        Field('age', 'Age', KIND_INT),
+    ]
+)
+
+ROUTE_TABLE = TableSchema(
+    'routes',
+    '<Get><Operational><RIB><VRFTable><VRF><AFTable><AF><Naming><AFName>IPv4</AFName></Naming><SAFTable><SAF>'
+    '<Naming><SAFName>Unicast</SAFName></Naming><IP_RIBRouteTable><IP_RIBRoute><RouteTable></RouteTable>'
+    '</IP_RIBRoute></IP_RIBRouteTable></SAF></SAFTable></AF></AFTable></VRF></VRFTable></RIB></Operational></Get>',
+    'RouteTable/Route',
+    [
+        Field('vrf', 'VRFName', inherited=True),
+        Field('prefix', 'Naming/Address', KIND_IPV4),
+        Field('length', 'Naming/PrefixLength', KIND_INT),
+        Field('protocol', 'ProtocolName'),
+        Field('distance', 'Distance', KIND_INT),
+        Field('metric', 'Metric', KIND_INT),
+        Field('age', 'RouteAge', KIND_INT),
+        Field('next_hop', 'RoutePath/Entry/Address', KIND_IPV4),
+        Field('interface', 'RoutePath/Entry/InterfaceName'),
+    ]
+)
+
+MAC_TABLE = TableSchema(
+    'mac',
+    '<Get><Operational><L2VPNForwarding></L2VPNForwarding></Operational></Get>',
+    'L2FIBMACDetailTable/L2FIBMACDetail',
+    [
+        Field('mac', 'Naming/Address', KIND_MAC),
+        Field('bridge_domain', 'Naming/Name'),
+        Field('interface', 'Segment/AC/InterfaceHandle'),
+    ]
+)
+
+_ITERATOR_ID_ERROR_MSG = 'Partial reply: turn iteration off on the XML agent to retrieve whole tables.'
+
+TABLES = dict((schema.name, schema) for schema in (ARP_TABLE, ROUTE_TABLE, MAC_TABLE))
+
+
+class Column(object):
+
+    """
+    Values of one column: `values` is an array.array; for the 'str' columns it holds the index of each value in
+    `categories`, the distinct values.
+    """
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        typecode, self._parse, self._missing, self._format = _KINDS[kind]
+        self.values = array(typecode)
+        self.categories = []
+        self._codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def _code(self, text):
+        code = self._codes.get(text)
+        if code is None:
+            code = self._codes[text] = len(self.categories)
+            self.categories.append(text)
+        return code
+
+    def append(self, text):
+        """Append the value of a row, as found in the reply: None or invalid are stored as the missing value."""
+        if self._parse is None:
+            self.values.append(self._code(text or ''))
+            return
+        try:
+            self.values.append(self._parse(text) if text else self._missing)
+        except ValueError:
+            self.values.append(self._missing)  # e.g. an IPv6 address
+
+    def repeat(self, text, count):
+        """Append the same value to `count` rows."""
+        self.values.extend(array(self.values.typecode, [self._parse(text) if self._parse else self._code(text)]) *
+                           count)
+
+    def _decode(self, value):
+        if self._parse is None:
+            return self.categories[value]
+        return self._format(value) if self._format is not None else value
+
+    def __getitem__(self, position):
+        return self._decode(self.values[position])
+
+    def __iter__(self):
+        if self._parse is None:
+            categories = self.categories
+            return (categories[code] for code in self.values)
+        if self._format is None:
+            return iter(self.values)
+        return (self._format(value) for value in self.values)
+
+    def value_counts(self):
+        """Return the number of rows of each value: dict {value: count}."""
+        counts = {}
+        for value in self.values:
+            counts[value] = counts.get(value, 0) + 1
+        return dict((self._decode(value), count) for value, count in counts.items())
+
+    def to_numpy(self):
+        """
+        Return the column as a NumPy array, sharing the memory of `values`: the codes for the 'str' columns,
+        see categories. Requires NumPy.
+        """
+        if numpy is None:
+            raise ImportError('NumPy is required to convert the columns into NumPy arrays.')
+        return numpy.frombuffer(self.values, dtype=self.values.typecode)
+
+    def _take(self, positions):
+        column = Column(self.name, self.kind)
+        values = self.values
+        column.values = array(values.typecode, [values[position] for position in positions])
+        column.categories = list(self.categories)
+        column._codes = dict(self._codes)
+        return column
+
+    def _extend(self, other):
+        if self._parse is not None:
+            self.values.extend(other.values)
+            return
+        codes = [self._code(value) for value in other.categories]
+        self.values.extend(array(self.values.typecode, [codes[code] for code in other.values]))
+
+
+class ColumnarTable(object):
+
+    """
+    Rows of an operational table, stored column by column.
+
+        >>> table = decode_table(raw, ROUTE_TABLE)
+        >>> table['protocol'].value_counts()
+        {'bgp': 812345, 'connected': 12, 'local': 12, 'static': 3}
+        >>> table.filter('protocol', lambda protocol: protocol == 'static').rows()
+    """
+
+    def __init__(self, schema, constants=()):
+        """
+        :param schema:    (TableSchema) Table
+        :param constants: (list) Names of the columns holding the same value for all the rows of a reply, e.g. host
+        """
+        self.schema = schema
+        self.constants = tuple(constants)
+        self.columns = OrderedDict()
+        for name in self.constants:
+            self.columns[name] = Column(name, KIND_STR)
+        for field in schema.fields:
+            self.columns[field.name] = Column(field.name, field.kind)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def names(self):
+        return list(self.columns)
+
+    def rows(self):
+        """Yield the rows as dicts, e.g. to display a few of them."""
+        names = list(self.columns)
+        for values in zip(*self.columns.values()):
+            yield dict(zip(names, values))
+
+    def filter(self, name, predicate):
+        """
+        Return a new table with the rows whose value in the column satisfies predicate(value).
+        The predicate is evaluated once per distinct value.
+        """
+        column = self.columns[name]
+        selected = {}
+        positions = []
+        for position, value in enumerate(column.values):
+            keep = selected.get(value)
+            if keep is None:
+                keep = selected[value] = bool(predicate(column._decode(value)))
+            if keep:
+                positions.append(position)
+        table = ColumnarTable(self.schema, self.constants)
+        for name, column in self.columns.items():
+            table.columns[name] = column._take(positions)
+        return table
+
+    def extend(self, other):
+        """Append the rows of another table of the same schema, e.g. retrieved from another device."""
+        if other.names() != self.names():
+            raise ValueError('Cannot merge tables with different columns: %r and %r' % (self.names(), other.names()))
+        for name, column in self.columns.items():
+            column._extend(other.columns[name])
+
+    def to_numpy(self):
+        """Return the columns as NumPy arrays: dict {name: array}, see Column.to_numpy."""
+        return OrderedDict((name, column.to_numpy()) for name, column in self.columns.items())
+
+
+def decode_table(reply, schema, table=None, constants=None):
+    """
+    Decode the rows of an operational reply into columns, parsing it incrementally.
+
+    :param reply:     Raw reply, as returned by make_rpc_call(schema.request, raw=True), or iterable of chunks of it
+    :param schema:    (TableSchema) Table, e.g. ARP_TABLE, ROUTE_TABLE, MAC_TABLE
+    :param table:     (ColumnarTable) Append the rows to this table, e.g. to gather the tables of a fleet
+    :param constants: (dict) Value of the constant columns for the rows of this reply, e.g. {'host': 'edge01'}
+    :return: (ColumnarTable)
+    """
+    constants = constants or {}
+    if table is None:
+        table = ColumnarTable(schema, sorted(constants))
+    elif sorted(constants) != sorted(table.constants):
+        raise ValueError('Expected the constant columns %r, got %r' % (table.constants, sorted(constants)))
+    columns = [(field, table.columns[field.name]) for field in schema.fields]
+    count = len(table)
+    try:
+        _decode_rows(reply, schema, columns)
+    except Exception:
+        for column in table.columns.values():
+            del column.values[count:]  # the rows of a failed reply are not kept
+        raise
+    for name, value in constants.items():
+        table.columns[name].repeat(value, len(columns[0][1]) - count)
+    return table
+
+
+def _decode_rows(reply, schema, columns):
+    chunks = [reply] if isinstance(reply, (string_types, bytes)) else reply
+    parser = ET.XMLPullParser(events=('end', ), tag=schema.row_tag, huge_tree=True)
+    naming = _Naming()
+    head = b''  # start of the reply, holding the attributes of Response
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, text_type):
+                chunk = chunk.encode('utf-8')
+            if len(head) < 1024:
+                head += chunk[:1024]
+            parser.feed(chunk)
+            for _, row in parser.read_events():
+                parent = row.getparent()
+                if schema.parent_tag and (parent is None or parent.tag != schema.parent_tag):
+                    continue  # e.g. an Entry inside a row
+                texts = {}
+                _collect(row, schema._paths, texts)
+                for position, (field, column) in enumerate(columns):
+                    if field.inherited:
+                        column.append(naming.inherited(parent).get(field.path))
+                    else:
+                        column.append(texts.get(position))
+                # row decoded: drop it
+                row.clear()
+                while row.getprevious() is not None:
+                    del parent[0]
+        root = parser.close()
+    except ET.XMLSyntaxError as xml_err:
+        if b'IteratorID="' in head:
+            raise IteratorIDError(_ITERATOR_ID_ERROR_MSG)
+        raise InvalidXMLResponse('Unable to process the XML Response from the device: %s' % xml_err)
+    if root.get('IteratorID') is not None:
+        raise IteratorIDError(_ITERATOR_ID_ERROR_MSG)
+    result_summary = root.find('ResultSummary')
+    if result_summary is not None and int(result_summary.get('ErrorCount', 0)) > 0:
+        raise XMLCLIError('\n'.join(element.get('ErrorMsg') for element in root.xpath('//*[@ErrorMsg]')) or
+                          'The device reported errors.')
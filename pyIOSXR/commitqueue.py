@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Per device commit queue, coalescing the small config changes of many producers into one commit.
+
+Producers submit config fragments from any thread and wait for their ticket. A worker thread collects the fragments
+arriving within a short window, loads them into one candidate config and commits them together, then reports the
+outcome to each submitter: the commit ID, or the error caused by its own fragment.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import time
+from threading import Event
+from threading import Thread
+from threading import Condition
+
+# local modules
+from pyIOSXR.exceptions import CommitError
+from pyIOSXR.exceptions import XMLCLIError
+from pyIOSXR.exceptions import TimeoutError
+from pyIOSXR.exceptions import InvalidInputError
+from pyIOSXR.exceptions import CommitConflictError
+
+
+class CommitTicket(object):
+
+    """
+    Outcome of one submitted fragment.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.submitted = time.time()
+        self.commit_id = None
+        self.batch = 0  # number of fragments committed together
+        self.error = None
+        self._done = Event()
+
+    def _resolve(self, commit_id=None, batch=0, error=None):
+        self.commit_id = commit_id
+        self.batch = batch
+        self.error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the fragment to be committed or rejected.
+
+        :return: (bool) False if the timeout expired first
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Wait for the outcome and return the ID of the commit including the fragment (None if it is unknown).
+        Raises the error which rejected the fragment.
+        """
+        if not self.wait(timeout):
+            raise TimeoutError('Waiting for the commit queue!')
+        if self.error is not None:
+            raise self.error
+        return self.commit_id
+
+
+class CommitQueue(object):
+
+    """
+    Batches the config fragments submitted to one device into one candidate config and one commit.
+
+    The queue is the only user of the candidate config of the device: do not load or commit anything else
+    through the same IOSXR object while it runs. Usable as a context manager.
+
+        >>> with CommitQueue(device, window=.5) as commits:
+        ...     ticket = commits.submit('ntp peer 172.17.17.1')
+        ...     ticket.result(timeout=60)
+    """
+
+    def __init__(self, device, window=0.5, max_batch=100, comment=None, label=None, lock=True):
+        """
+        :param device:    (IOSXR) Open device
+        :param window:    (float) Seconds to collect fragments after the first one is submitted
+        :param max_batch: (int) Fragments committed together at most, the next ones wait for the next commit
+        :param comment:   (str) Comment of the commits
+        :param label:     (str) Label of the commits
+        :param lock:      (bool) Lock the config for the duration of each batch, unless the device is locked already
+        """
+        self.device = device
+        self.window = window
+        self.max_batch = max(int(max_batch), 1)
+        self.comment = comment
+        self.label = label
+        self.lock = lock
+        self._pending = []
+        self._condition = Condition()
+        self._closed = False
+        self._stats = {'submitted': 0, 'committed': 0, 'rejected': 0, 'batches': 0, 'commits': 0}
+        self._worker = Thread(target=self._work_loop, name='pyIOSXR-commit-queue-%s' % device.hostname)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def submit(self, config):
+        """
+        Queue a config fragment, as passed to load_candidate_config.
+
+        :return: (CommitTicket)
+        """
+        ticket = CommitTicket(config)
+        with self._condition:
+            if self._closed:
+                raise CommitError('The commit queue is closed!')
+            self._pending.append(ticket)
+            self._stats['submitted'] += 1
+            self._condition.notify()
+        return ticket
+
+    def commit(self, config, timeout=None):
+        """Submit a config fragment and wait until it is committed. Returns the commit ID, see CommitTicket.result."""
+        return self.submit(config).result(timeout=timeout)
+
+    def _next_batch(self):
+        """Wait for the first fragment, then for the window or a full batch. Return [] once closed and drained."""
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return []
+            end = self._pending[0].submitted + self.window
+            while len(self._pending) < self.max_batch and not self._closed and time.time() < end:
+                self._condition.wait(end - time.time())
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            return batch
+
+    def _work_loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                self._process(batch)
+            except Exception as err:  # e.g. connection lost: reported to the submitters, the queue goes on
+                for ticket in batch:
+                    if not ticket.done():
+                        self._reject(ticket, err)
+
+    def _process(self, batch):
+        self._stats['batches'] += 1
+        lock = self.lock and not self.device.locked
+        if lock:
+            self.device.lock()
+        try:
+            accepted = self._load(batch)
+            if not accepted:
+                return
+            try:
+                self._commit(accepted)
+            except CommitConflictError:
+                raise  # the device already retried, the fragments would conflict one by one as well
+            except (CommitError, XMLCLIError, InvalidInputError):
+                if len(accepted) == 1:
+                    raise
+                # one of the fragments is refused at commit time: commit them one by one,
+                # so that only its submitter gets the error
+                self.device.discard_config()
+                for ticket in accepted:
+                    try:
+                        self.device.load_candidate_config(config=ticket.config)
+                        self._commit([ticket])
+                    except (CommitError, XMLCLIError, InvalidInputError) as err:
+                        self._discard()
+                        self._reject(ticket, err)
+        except Exception:
+            self._discard()
+            raise
+        finally:
+            if lock and self.device.locked:
+                self.device.unlock()
+
+    def _load(self, batch):
+        """Load the fragments into the candidate config, rejecting the invalid ones. Return the accepted tickets."""
+        accepted = []
+        for ticket in batch:
+            try:
+                self.device.load_candidate_config(config=ticket.config)
+            except InvalidInputError as err:
+                # the device discarded the whole candidate config: load again the fragments accepted so far,
+                # one by one as they were validated, each from the config root
+                self._reject(ticket, err)
+                for accepted_ticket in accepted:
+                    self.device.load_candidate_config(config=accepted_ticket.config)
+                continue
+            accepted.append(ticket)
+        return accepted
+
+    def _commit(self, tickets):
+        self.device.commit_config(label=self.label, comment=self.comment)
+        self._stats['commits'] += 1
+        try:
+            commit_id = self.device.get_commit_id()
+        except Exception:
+            commit_id = None  # committed anyway
+        for ticket in tickets:
+            ticket._resolve(commit_id=commit_id, batch=len(tickets))
+        self._stats['committed'] += len(tickets)
+
+    def _discard(self):
+        try:
+            self.device.discard_config()
+        except Exception:
+            pass  # nothing more to do, the next batch discards again on failure
+
+    def _reject(self, ticket, error):
+        ticket._resolve(error=error)
+        self._stats['rejected'] += 1
+
+    def stats(self):
+        """
+        Return the queue counters.
+
+        :return: dict {'submitted': int, 'committed': int, 'rejected': int, 'batches': int, 'commits': int,
+                       'pending': int}
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        return stats
+
+    def close(self, timeout=None):
+        """Stop accepting fragments, commit the pending ones and stop the worker."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Offline processing of IOS-XR configurations.
+
+Simulates merging a candidate config onto a running config, as the device does on commit,
+to predict the output of compare_config without loading anything on the device,
+and indexes configs for fast lookups of sections and commands.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# local modules
+from pyIOSXR.iosxr import config_diff
+
+
+# RPL objects are defined as a whole and replaced as a whole
+_RPL_OPENERS = (
+    'route-policy ',
+    'prefix-set ',
+    'as-path-set ',
+    'community-set ',
+    'extcommunity-set ',
+    'large-community-set ',
+    'rd-set ',
+    'tag-set ',
+    'policy-global',
+)
+_RPL_CLOSERS = ('end-policy', 'end-set', 'end-global')
+
+# leaf commands taking a single value: setting them again replaces the previous value
+_SINGLE_VALUE_COMMANDS = (
+    'description',
+    'hostname',
+    'mtu',
+    'bandwidth',
+    'load-interval',
+    'encapsulation',
+    'ipv4 address',
+    'remote-as',
+    'update-source',
+    'router-id',
+    'vrf',
+    'service-policy input',
+    'service-policy output',
+    'password',
+    'secret',
+    'domain name',
+    'clock timezone',
+)
+
+# single-value commands at the top level, where most childless commands open a block, e.g. `vrf BLUE`
+_TOP_LEVEL_SINGLE_VALUE_COMMANDS = (
+    'hostname',
+    'domain name',
+    'clock timezone',
+)
+
+# commands entered on a single line, but displayed as a block in the running config, e.g.:
+# `ntp peer 172.17.17.1` is displayed as `ntp` / ` peer 172.17.17.1`
+_FLAT_BLOCKS = (
+    'ntp',
+)
+
+_HEADER_PREFIXES = ('Building configuration', '!!')
+
+
+class ConfigNode(object):
+
+    """
+    One command of the config, with the commands of its submode.
+
+    RPL objects (route-policy, prefix-set etc.) keep their body verbatim in `body`.
+    """
+
+    __slots__ = ('text', 'children', 'body', 'parent', 'raw', 'prefix')
+
+    def __init__(self, text, children=None, body=None):
+        self.text = text
+        self.children = children if children is not None else []
+        self.body = body
+        self.parent = None  # set by ConfigTree only
+        self.raw = None  # line as displayed, set by ConfigTree only
+        self.prefix = None  # lines preceding the command and not part of any other command (!, exit etc.)
+
+    def find(self, text):
+        for child in self.children:
+            if child.text == text:
+                return child
+        return None
+
+    def __repr__(self):
+        return 'ConfigNode(%r, %d children)' % (self.text, len(self.children))
+
+
+def _header_length(lines):
+    index = 0
+    while index < len(lines) and lines[index].strip().startswith(_HEADER_PREFIXES):
+        index += 1
+    if index and index < len(lines) and lines[index].strip() == '!':
+        index += 1  # closes the header
+    return index
+
+
+def split_header(config):
+    """
+    Split the lines of the config into the header (Building configuration..., !! comments, then !) and the rest.
+
+    :return: tuple (header lines, config lines)
+    """
+    lines = config.splitlines()
+    index = _header_length(lines)
+    return lines[:index], lines[index:]
+
+
+def parse_config(lines):
+    """
+    Parse the config into a tree, following the indentation of the lines.
+
+    `!` closes the blocks indented at least as much, `exit` closes the current block, `root` closes all the blocks.
+    Parsing stops at `end`.
+
+    :param lines: (str or list) Config, e.g. as displayed by show running-config
+    :return: (ConfigNode) root node, with text None
+    """
+    if not isinstance(lines, list):
+        lines = split_header(lines)[1]
+    root = ConfigNode(None)
+    stack = [(-1, root)]
+    lines = iter(lines)
+    for line in lines:
+        line = line.rstrip()
+        stripped = line.lstrip()
+        if not stripped:
+            continue
+        indent = len(line) - len(stripped)
+        if stripped.startswith('!'):
+            while stack[-1][0] >= indent:
+                stack.pop()
+            continue
+        if stripped == 'end':
+            break
+        if stripped == 'exit':
+            if len(stack) > 1:
+                stack.pop()
+            continue
+        if stripped == 'root':
+            del stack[1:]
+            continue
+        while stack[-1][0] >= indent:
+            stack.pop()
+        node = ConfigNode(stripped)
+        if len(stack) == 1 and stripped.startswith(_RPL_OPENERS):
+            node.body = []
+            for body_line in lines:
+                node.body.append(body_line.rstrip())
+                if body_line.strip() in _RPL_CLOSERS:
+                    break
+        stack[-1][1].children.append(node)
+        stack.append((indent, node))
+    return root
+
+
+def render_config(node, depth=0):
+    """
+    Render a config tree as displayed by show running-config: one space indentation per level,
+    blocks closed by `!`.
+
+    :return: (list) lines
+    """
+    lines = []
+    for child in node.children:
+        lines.append(' ' * depth + child.text)
+        if child.body is not None:
+            lines.extend(child.body)
+            lines.append(' ' * depth + '!')
+        elif child.children:
+            lines.extend(render_config(child, depth + 1))
+            lines.append(' ' * depth + '!')
+    return lines
+
+
+def _single_value_key(text, top_level=False):
+    for command in (_TOP_LEVEL_SINGLE_VALUE_COMMANDS if top_level else _SINGLE_VALUE_COMMANDS):
+        if (text == command or text.startswith(command + ' ')) and not text.endswith(' secondary'):
+            return command
+    return None
+
+
+def _insert(target, node):
+    """Add the node after the last block of target, keeping the trailing single-line commands last."""
+    index = len(target.children)
+    while index and not (target.children[index - 1].children or target.children[index - 1].body is not None):
+        index -= 1
+    target.children.insert(index or len(target.children), node)
+
+
+def _flat_block(target, text):
+    """Return the block of target in which the single-line command should be nested, and the nested command."""
+    for child in target.children:
+        if child.children and text.startswith(child.text + ' '):
+            return child, text[len(child.text) + 1:]
+    for prefix in _FLAT_BLOCKS:
+        if text.startswith(prefix + ' '):
+            block = ConfigNode(prefix)
+            _insert(target, block)
+            return block, text[len(prefix) + 1:]
+    return None, None
+
+
+def _remove(target, text):
+    node = target.find(text)
+    if node is not None:
+        target.children.remove(node)
+        return
+    # `no description` removes `description <anything>`
+    matching = [child for child in target.children if child.text.startswith(text + ' ')]
+    if matching:
+        for child in matching:
+            target.children.remove(child)
+        return
+    for child in target.children:
+        if child.children and text.startswith(child.text + ' '):
+            _remove(child, text[len(child.text) + 1:])
+            if not child.children:
+                target.children.remove(child)  # the device removes the empty blocks
+            return
+
+
+def _merge(target, source):
+    for node in source.children:
+        if node.text.startswith('no '):
+            _remove(target, node.text[3:])
+            continue
+        existing = target.find(node.text)
+        if node.body is not None:
+            replacement = ConfigNode(node.text, body=list(node.body))
+            if existing is not None:
+                target.children[target.children.index(existing)] = replacement
+            else:
+                _insert(target, replacement)
+            continue
+        if existing is not None:
+            _merge(existing, node)
+            continue
+        block, nested = _flat_block(target, node.text)
+        if block is not None:
+            _merge(block, ConfigNode(None, [ConfigNode(nested, node.children)]))
+            continue
+        new = ConfigNode(node.text)
+        top_level = target.text is None
+        key = _single_value_key(node.text, top_level)
+        if key is not None and not node.children:
+            replaced = [index for index, sibling in enumerate(target.children)
+                        if not sibling.children and sibling.body is None and
+                        _single_value_key(sibling.text, top_level) == key]
+            if replaced:
+                # the device replaces the value in place
+                target.children[replaced[0]] = new
+                for index in reversed(replaced[1:]):
+                    del target.children[index]
+                continue
+        _insert(target, new)
+        _merge(new, node)
+
+
+def merge_config(running_config, candidate_config):
+    """
+    Merge the candidate config onto the running config, without the device.
+
+    Applies the IOS-XR merge semantics: the commands are added to their blocks, `no` commands remove
+    commands or blocks, single-value commands (description, mtu etc.) replace the previous value
+    and RPL objects are replaced as a whole. The candidate must be indented as displayed by show running-config.
+    New commands are added after the last block of their parent, while the device may display them elsewhere.
+
+    :param running_config:   (str) Output of show running-config
+    :param candidate_config: (str) Config to merge
+    :return: (str) The config, as returned by show configuration merge
+    """
+    header, lines = split_header(running_config.replace('\r', ''))
+    running = parse_config(lines)
+    _merge(running, parse_config(candidate_config))
+    return '\n'.join(header + render_config(running) + ['end'])
+
+
+def simulate_compare_config(running_config, candidate_config):
+    """
+    Predict the output of compare_config for the candidate config, without the device.
+
+    :param running_config:   (str) Output of show running-config, e.g. retrieved earlier and cached
+    :param candidate_config: (str) Config to merge
+    :return: (str) Config diff, in the format of compare_config
+    """
+    running_config = running_config.replace('\r', '')
+    return config_diff(running_config, merge_config(running_config, candidate_config))
+
+
+class ConfigTree(object):
+
+    """
+    Config parsed into a tree of ConfigNode, indexed by section path and by keyword.
+
+    The nodes keep the lines as displayed, so str(tree) returns the original config, byte for byte.
+    Lookups do not scan the config:
+
+        >>> tree = ConfigTree(device.show_running_config())
+        >>> tree.get(('router bgp 13335', 'neighbor 172.17.17.1'))
+        >>> tree.keyword('interface')  # all the interface sections
+        >>> tree.sections_with('interface', 'service-policy input QOS-IN')
+    """
+
+    def __init__(self, config):
+        """
+        Parse and index the config.
+
+        :param config: (str) Config, e.g. as displayed by show running-config
+        """
+        lines = config.splitlines(True)
+        index = _header_length(lines)
+        self.header = lines[:index]
+        self.footer = []  # end and anything after it
+        self.root = ConfigNode(None)
+        self._paths = {}
+        self._keywords = {}
+        self._commands = {}
+        self._parse(lines, index)
+
+    def _parse(self, lines, index):
+        paths = self._paths
+        keywords = self._keywords
+        commands = self._commands
+        stack = [(-1, self.root, ())]
+        pending = []  # lines attached to the next command
+        count = len(lines)
+        while index < count:
+            raw = lines[index]
+            index += 1
+            stripped = raw.strip()
+            if not stripped or stripped[0] == '!':
+                if stripped:
+                    indent = len(raw) - len(raw.lstrip())
+                    while stack[-1][0] >= indent:
+                        stack.pop()
+                pending.append(raw)
+                continue
+            if stripped == 'end':
+                self.footer = pending + lines[index - 1:]
+                return
+            if stripped == 'exit' or stripped == 'root':
+                if stripped == 'root':
+                    del stack[1:]
+                elif len(stack) > 1:
+                    stack.pop()
+                pending.append(raw)
+                continue
+            indent = len(raw) - len(raw.lstrip())
+            while stack[-1][0] >= indent:
+                stack.pop()
+            parent = stack[-1][1]
+            node = ConfigNode(stripped)
+            node.raw = raw
+            node.parent = parent
+            if pending:
+                node.prefix = pending
+                pending = []
+            if parent is self.root and stripped.startswith(_RPL_OPENERS):
+                node.body = []
+                while index < count:
+                    body_line = lines[index]
+                    index += 1
+                    node.body.append(body_line)
+                    if body_line.strip() in _RPL_CLOSERS:
+                        break
+            parent.children.append(node)
+            path = stack[-1][2] + (stripped, )
+            paths.setdefault(path, node)
+            keywords.setdefault(stripped.split(None, 1)[0], []).append(node)
+            commands.setdefault(stripped, []).append(node)
+            stack.append((indent, node, path))
+        self.footer = pending
+
+    def __str__(self):
+        return self.serialize()
+
+    def serialize(self):
+        """Return the config as text, as it was parsed."""
+        lines = list(self.header)
+        stack = list(reversed(self.root.children))
+        while stack:
+            node = stack.pop()
+            if node.prefix:
+                lines.extend(node.prefix)
+            lines.append(node.raw)
+            if node.body is not None:
+                lines.extend(node.body)
+            stack.extend(reversed(node.children))
+        lines.extend(self.footer)
+        return ''.join(lines)
+
+    def get(self, path):
+        """
+        Return the node at the section path, or None.
+
+        :param path: (tuple) Commands from the top level, e.g. ('router bgp 13335', 'neighbor 172.17.17.1')
+        """
+        return self._paths.get(tuple(path))
+
+    def keyword(self, keyword, top_level=True):
+        """
+        Return the nodes starting with the keyword, in config order.
+
+        :param keyword:   (str) First word of the command, e.g. 'interface', 'route-policy', 'neighbor'
+        :param top_level: (bool) Only the top level sections, or the commands at any depth
+        """
+        nodes = self._keywords.get(keyword, [])
+        if top_level:
+            return [node for node in nodes if node.parent is self.root]
+        return list(nodes)
+
+    def command(self, text):
+        """Return the nodes of the command, at any depth, in config order."""
+        return list(self._commands.get(text.strip(), []))
+
+    def find_commands(self, prefix):
+        """Return the nodes of the commands starting with the prefix, at any depth, in config order."""
+        prefix = prefix.strip()
+        return [node for node in self._keywords.get(prefix.split(None, 1)[0], [])
+                if node.text == prefix or node.text.startswith(prefix + ' ')]
+
+    def match(self, regex, keyword=None):
+        """
+        Return the nodes of the commands matching the regex, at any depth, grouped by command.
+
+        Each distinct command is matched once, however many times it is in the config.
+
+        :param regex:   Compiled regular expression, searched in the command
+        :param keyword: (str) First word of all the commands the regex can match, to look only at these
+        """
+        if keyword is not None:
+            nodes = self._keywords.get(keyword, [])
+            return [node for node in nodes if regex.search(node.text)]
+        return [node for text, nodes in self._commands.items() if regex.search(text) for node in nodes]
+
+    def sections_with(self, keyword, prefix):
+        """
+        Return the top level sections starting with the keyword, containing a command starting with the prefix.
+
+        e.g. sections_with('interface', 'service-policy input QOS-IN')
+        """
+        sections = []
+        seen = set()
+        for node in self.find_commands(prefix):
+            section = self.section(node)
+            if section is not node and section.text.split(None, 1)[0] == keyword and id(section) not in seen:
+                seen.add(id(section))
+                sections.append(section)
+        return sections
+
+    def section(self, node):
+        """Return the top level section of the node."""
+        while node.parent is not self.root:
+            node = node.parent
+        return node
+
+    def path(self, node):
+        """Return the section path of the node, see get()."""
+        path = []
+        while node is not self.root:
+            path.append(node.text)
+            node = node.parent
+        return tuple(reversed(path))
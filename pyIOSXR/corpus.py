@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+In-memory corpus of the running configs of a fleet, each distinct line stored once.
+
+Most lines of the configs of a fleet are identical from one device to the other (AAA, NTP, logging, ACLs...): the
+lines are interned, and each config is an array of line IDs, 4 bytes per line. Memory depends on the distinct
+content, not on the number of devices. An inverted index maps each line to the devices having it.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import re
+from array import array
+from bisect import bisect_left
+from threading import Lock
+
+# third party lib
+from six import text_type
+
+
+_ID = 'I' if array('I').itemsize >= 4 else 'L'  # unsigned, 4 bytes at least
+
+
+class ConfigCorpus(object):
+
+    """
+    Configs of many hosts, deduplicated line by line.
+
+    Lines are compared as they are, indentation included: ' shutdown' is a different line from 'shutdown'.
+    Use search() to match them with a regular expression. Safe to use from several threads.
+
+        >>> corpus = ConfigCorpus()
+        >>> corpus.add('edge01', device.get_running_config())
+        >>> corpus.hosts_with('ntp server 172.17.17.1')
+        ['edge01', 'edge02']
+    """
+
+    def __init__(self):
+        self._lines = []  # line ID -> text, None once unused
+        self._line_ids = {}  # text -> line ID
+        self._postings = []  # line ID -> array of the IDs of the hosts having the line, sorted
+        self._free = []  # line IDs to reuse
+        self._hosts = []  # host ID -> host, None once removed
+        self._host_ids = {}  # host -> host ID
+        self._configs = {}  # host ID -> array of line IDs
+        self._locker = Lock()
+
+    def __len__(self):
+        return len(self._configs)
+
+    def __contains__(self, host):
+        return host in self._host_ids
+
+    def _intern(self, line):
+        line_id = self._line_ids.get(line)
+        if line_id is None:
+            if self._free:
+                line_id = self._free.pop()
+                self._lines[line_id] = line
+                self._postings[line_id] = array(_ID)
+            else:
+                line_id = len(self._lines)
+                self._lines.append(line)
+                self._postings.append(array(_ID))
+            self._line_ids[line] = line_id
+        return line_id
+
+    def _release(self, line_id, host_id):
+        posting = self._postings[line_id]
+        del posting[bisect_left(posting, host_id)]
+        if not posting:
+            # no host has the line anymore
+            del self._line_ids[self._lines[line_id]]
+            self._lines[line_id] = None
+            self._postings[line_id] = None
+            self._free.append(line_id)
+
+    def add(self, host, config):
+        """
+        Add the config of the host, replacing the previous one.
+
+        :param host:   (str) Hostname
+        :param config: (str) Config, e.g. as returned by get_running_config() or show_running_config()
+        """
+        if not isinstance(config, text_type):
+            config = config.decode('utf-8')
+        with self._locker:
+            host_id = self._host_ids.get(host)
+            if host_id is None:
+                host_id = self._host_ids[host] = len(self._hosts)
+                self._hosts.append(host)
+            intern = self._intern
+            config_ids = array(_ID, [intern(line) for line in config.split('\n')])
+            previous = self._configs.get(host_id)
+            self._configs[host_id] = config_ids
+            new_ids = set(config_ids)
+            old_ids = set(previous) if previous is not None else set()
+            for line_id in new_ids - old_ids:
+                posting = self._postings[line_id]
+                if not posting or posting[-1] < host_id:
+                    posting.append(host_id)
+                else:
+                    posting.insert(bisect_left(posting, host_id), host_id)
+            for line_id in old_ids - new_ids:
+                self._release(line_id, host_id)
+
+    def add_devices(self, devices, refresh=False):
+        """Add the running configs of open IOSXR devices, retrieved with get_running_config()."""
+        for device in devices:
+            self.add(device.hostname, device.get_running_config(refresh=refresh))
+
+    def remove(self, host):
+        """Remove the config of the host, KeyError if missing."""
+        with self._locker:
+            host_id = self._host_ids.pop(host)
+            self._hosts[host_id] = None
+            for line_id in set(self._configs.pop(host_id)):
+                self._release(line_id, host_id)
+
+    def get(self, host):
+        """Return the config of the host, as added, or None."""
+        with self._locker:
+            host_id = self._host_ids.get(host)
+            if host_id is None:
+                return None
+            lines = self._lines
+            return '\n'.join([lines[line_id] for line_id in self._configs[host_id]])
+
+    def hosts(self):
+        """Return the hosts, in the order they were first added."""
+        with self._locker:
+            return [host for host in self._hosts if host is not None]
+
+    def hosts_with(self, line, section=None):
+        """
+        Return the hosts having the line, in the order they were first added.
+
+        :param line:    (str) Line, e.g. 'ntp server 172.17.17.1', or ' shutdown' inside a section
+        :param section: (str) First line of the section the line must be in, e.g. 'interface Bundle-Ether1'
+        """
+        with self._locker:
+            line_id = self._line_ids.get(line)
+            if line_id is None:
+                return []
+            host_ids = self._postings[line_id]
+            if section is not None:
+                section_id = self._line_ids.get(section)
+                if section_id is None:
+                    return []
+                candidates = set(self._postings[section_id])
+                host_ids = [host_id for host_id in host_ids if host_id in candidates and
+                            self._in_section(self._configs[host_id], section_id, line_id)]
+            return [self._hosts[host_id] for host_id in host_ids]
+
+    def _in_section(self, config_ids, section_id, line_id):
+        lines = self._lines
+        inside = False
+        for current in config_ids:
+            if current == section_id:
+                inside = True
+            elif inside:
+                if current == line_id:
+                    return True
+                if not lines[current][:1].isspace() and not lines[current].startswith('!'):
+                    inside = False  # next top level command
+        return False
+
+    def count(self, line):
+        """Return the number of hosts having the line."""
+        with self._locker:
+            line_id = self._line_ids.get(line)
+            return len(self._postings[line_id]) if line_id is not None else 0
+
+    def search(self, pattern):
+        """
+        Find the lines matching a regular expression, evaluated once per distinct line.
+
+        :param pattern: (str) Regular expression searched in the lines, e.g. r'^\\s*ntp server '
+        :return: dict {line: [hosts having it]}
+        """
+        regex = re.compile(pattern)
+        with self._locker:
+            hosts = self._hosts
+            return dict((line, [hosts[host_id] for host_id in self._postings[line_id]])
+                        for line, line_id in self._line_ids.items() if regex.search(line))
+
+    def stats(self):
+        """
+        Return the size of the corpus.
+
+        :return: dict {'hosts': int, 'lines': lines of all the configs, 'distinct_lines': int,
+                       'distinct_bytes': length of the distinct lines, 'index_bytes': size of the line ID arrays
+                       and of the inverted index}
+        """
+        with self._locker:
+            configs = list(self._configs.values())
+            lines = sum(len(config_ids) for config_ids in configs)
+            postings = sum(len(posting) for posting in self._postings if posting is not None)
+            return {
+                'hosts': len(configs),
+                'lines': lines,
+                'distinct_lines': len(self._line_ids),
+                'distinct_bytes': sum(len(line) for line in self._line_ids),
+                'index_bytes': (lines + postings) * array(_ID).itemsize,
+            }
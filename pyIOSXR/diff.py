@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Streaming unified diff of two configs.
+
+The configs are consumed as line iterators, one top level section at a time: identical sections are skipped
+keeping only the context lines, changed sections are diffed on their own, and each hunk is yielded as soon as it is
+complete. Memory depends on the size of the sections and of the changes, not on the size of the configs.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import difflib
+from collections import deque
+
+# third party lib
+from six import StringIO
+from six import string_types
+
+
+CONTEXT = 3  # lines of context around the changes, as difflib.unified_diff
+LOOKAHEAD = 1000  # sections buffered on each side to find where two configs meet again after a change
+
+_EQUAL = ' '
+_DELETE = '-'
+_INSERT = '+'
+
+
+def config_lines(config, skip_head=2, skip_tail=2):
+    """
+    Iterate over the lines of a config as compared by compare_config: without the first and last lines of the
+    output (header and footer) and without carriage returns.
+
+    :param config: (str or iterable of lines) Output of show running-config or show configuration merge
+    """
+    lines = StringIO(config) if isinstance(config, string_types) else iter(config)
+    tail = deque()
+    for index, line in enumerate(lines):
+        if index < skip_head:
+            continue
+        tail.append(line.replace('\r', ''))
+        if len(tail) > skip_tail:
+            yield tail.popleft()
+
+
+def _sections(lines):
+    """Group the lines into top level sections: first line, indented lines, then the closing ! lines."""
+    section = []
+    closed = False
+    for line in lines:
+        top_level = not line[:1].isspace()
+        if section and top_level and (closed or not line.startswith('!')):
+            yield section
+            section = []
+            closed = False
+        section.append(line)
+        if top_level and line.startswith('!'):
+            closed = True
+    if section:
+        yield section
+
+
+def _events(running_lines, merged_lines, lookahead=LOOKAHEAD):
+    """Yield the (operation, line) of the diff, aligning the configs section by section."""
+    running = _sections(running_lines)
+    merged = _sections(merged_lines)
+    pending_running = deque()
+    pending_merged = deque()
+
+    def _next(sections, pending):
+        if pending:
+            return pending.popleft()
+        return next(sections, None)
+
+    section_a = _next(running, pending_running)
+    section_b = _next(merged, pending_merged)
+    while section_a is not None and section_b is not None:
+        if section_a == section_b:
+            for line in section_a:
+                yield _EQUAL, line
+        elif section_a[0] == section_b[0]:
+            for operation in _diff_sections(section_a, section_b):
+                yield operation
+        else:
+            # one side has sections the other does not: look ahead for a section header present on both sides
+            buffer_a, buffer_b = [section_a], [section_b]
+            match = _resync(running, merged, pending_running, pending_merged, buffer_a, buffer_b, lookahead)
+            index_a, index_b = match if match is not None else (1, 1)
+            lines_a = [line for section in buffer_a[:index_a] for line in section]
+            lines_b = [line for section in buffer_b[:index_b] for line in section]
+            for operation in _diff_sections(lines_a, lines_b):
+                yield operation
+            pending_running.extendleft(reversed(buffer_a[index_a:]))
+            pending_merged.extendleft(reversed(buffer_b[index_b:]))
+        section_a = _next(running, pending_running)
+        section_b = _next(merged, pending_merged)
+    while section_a is not None:
+        for line in section_a:
+            yield _DELETE, line
+        section_a = _next(running, pending_running)
+    while section_b is not None:
+        for line in section_b:
+            yield _INSERT, line
+        section_b = _next(merged, pending_merged)
+
+
+def _resync(running, merged, pending_running, pending_merged, buffer_a, buffer_b, lookahead):
+    """
+    Extend the buffers one section at a time until a section header is found on both sides.
+
+    :return: tuple (index in buffer_a, index in buffer_b) of the first common header, or None
+    """
+    headers_a = {buffer_a[0][0]: 0}
+    headers_b = {buffer_b[0][0]: 0}
+    exhausted_a = exhausted_b = False
+    while len(buffer_a) + len(buffer_b) < 2 * lookahead and not (exhausted_a and exhausted_b):
+        for buffer, headers, other_headers, sections, pending in (
+                (buffer_a, headers_a, headers_b, running, pending_running),
+                (buffer_b, headers_b, headers_a, merged, pending_merged)):
+            if (exhausted_a if buffer is buffer_a else exhausted_b):
+                continue
+            section = pending.popleft() if pending else next(sections, None)
+            if section is None:
+                if buffer is buffer_a:
+                    exhausted_a = True
+                else:
+                    exhausted_b = True
+                continue
+            buffer.append(section)
+            headers.setdefault(section[0], len(buffer) - 1)
+            if section[0] in other_headers:
+                if buffer is buffer_a:
+                    return len(buffer_a) - 1, other_headers[section[0]]
+                return other_headers[section[0]], len(buffer_b) - 1
+    if exhausted_a and exhausted_b:
+        return len(buffer_a), len(buffer_b)  # nothing in common until the end
+    return None
+
+
+def _diff_sections(section_a, section_b):
+    matcher = difflib.SequenceMatcher(None, section_a, section_b)
+    for tag, start_a, end_a, start_b, end_b in matcher.get_opcodes():
+        if tag == 'equal':
+            for line in section_a[start_a:end_a]:
+                yield _EQUAL, line
+            continue
+        for line in section_a[start_a:end_a]:
+            yield _DELETE, line
+        for line in section_b[start_b:end_b]:
+            yield _INSERT, line
+
+
+def _format_range(start, stop):
+    # same format as difflib.unified_diff
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '{0}'.format(beginning)
+    if not length:
+        beginning -= 1
+    return '{0},{1}'.format(beginning, length)
+
+
+def _format_hunk(start_a, start_b, lines):
+    length_a = sum(1 for line in lines if line[0] != _INSERT)
+    length_b = sum(1 for line in lines if line[0] != _DELETE)
+    header = '@@ -{0} +{1} @@\n'.format(_format_range(start_a, start_a + length_a),
+                                        _format_range(start_b, start_b + length_b))
+    return header + ''.join(lines)
+
+
+def iter_config_diff(running_config, merged_config, context=CONTEXT, lookahead=LOOKAHEAD):
+    """
+    Generate the diff between two configs, in the unified format of compare_config, one hunk at a time.
+
+    The first item is the header ('--- \\n+++ \\n'), followed by the hunks, each as one string.
+    Nothing is generated when the configs are identical.
+
+    :param running_config: (str or iterable of lines) Output of show running-config
+    :param merged_config:  (str or iterable of lines) Output of show configuration merge
+    :param context:        (int) Lines of context around the changes
+    :param lookahead:      (int) Sections buffered on each side to realign the configs after a change
+    """
+    recent = deque(maxlen=context)  # last equal lines, context of the next hunk
+    hunk = None  # [start in running, start in merged, lines]
+    trailing = []  # equal lines after the last change of the hunk
+    position_a = position_b = 0
+    started = False
+    for operation, line in _events(config_lines(running_config), config_lines(merged_config), lookahead):
+        if operation == _EQUAL:
+            if hunk is not None:
+                trailing.append(line)
+                if len(trailing) > 2 * context:
+                    hunk[2].extend(_EQUAL + equal for equal in trailing[:context])
+                    if not started:
+                        started = True
+                        yield '--- \n+++ \n'
+                    yield _format_hunk(*hunk)
+                    hunk = None
+                    trailing = []
+            recent.append(line)
+            position_a += 1
+            position_b += 1
+            continue
+        if hunk is None:
+            hunk = [position_a - len(recent), position_b - len(recent), [_EQUAL + equal for equal in recent]]
+        else:
+            hunk[2].extend(_EQUAL + equal for equal in trailing)
+        trailing = []
+        recent.clear()
+        hunk[2].append(operation + line)
+        if operation == _DELETE:
+            position_a += 1
+        else:
+            position_b += 1
+    if hunk is not None:
+        hunk[2].extend(_EQUAL + equal for equal in trailing[:context])
+        if not started:
+            yield '--- \n+++ \n'
+        yield _format_hunk(*hunk)
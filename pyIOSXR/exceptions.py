@@ -41,6 +41,12 @@ class ConnectError(IOSXRException):
             self._xr._xml_agent_alive = False
 
 
+class CircuitOpenError(ConnectError):
+    """Raised without contacting the device while its circuit breaker is open."""
+
+    pass
+
+
 class CommitError(IOSXRException):
 
     """Raised when unable to commit. Mostly due to ERROR 0x41866c00"""
@@ -48,6 +54,13 @@ class CommitError(IOSXRException):
     pass
 
 
+class CommitConflictError(CommitError):
+
+    """Raised on ERROR 0x41866c00: other sessions committed since this session started or last committed."""
+
+    pass
+
+
 class LockError(IOSXRException):
     """Throw this exception when unable to lock the config DB."""
 
@@ -100,6 +113,12 @@ class TimeoutError(IOSXRException):
             self._xr._xml_agent_alive = False
 
 
+class DeadlineError(TimeoutError):
+    """Raised when the deadline expires before the request reaches the device: the device is not at fault."""
+
+    pass
+
+
 class EOFError(IOSXRException):
     """EOFError Exception."""
 
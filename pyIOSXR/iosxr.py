@@ -18,9 +18,16 @@
 
 # stdlib
 import re
+import copy
 import time
 import difflib
+import itertools
+from contextlib import contextmanager
 from threading import Lock
+from threading import Event
+from threading import Thread
+from threading import local
+from threading import current_thread
 from xml.sax.saxutils import escape as escape_xml
 
 # third party lib
@@ -34,12 +41,51 @@ from pyIOSXR.exceptions import LockError
 from pyIOSXR.exceptions import UnlockError
 from pyIOSXR.exceptions import XMLCLIError
 from pyIOSXR.exceptions import CommitError
+from pyIOSXR.exceptions import CommitConflictError
 from pyIOSXR.exceptions import ConnectError
 from pyIOSXR.exceptions import TimeoutError
+from pyIOSXR.exceptions import DeadlineError
 from pyIOSXR.exceptions import IteratorIDError
 from pyIOSXR.exceptions import InvalidInputError
 from pyIOSXR.exceptions import CompareConfigError
 from pyIOSXR.exceptions import InvalidXMLResponse
+from pyIOSXR.builder import wrap_request
+from pyIOSXR.builder import build_commit
+from pyIOSXR.builder import build_get_config
+from pyIOSXR.builder import build_set_config
+from pyIOSXR.builder import build_delete_config
+from pyIOSXR.diff import iter_config_diff
+from pyIOSXR.columnar import TABLES
+from pyIOSXR.columnar import decode_table
+from pyIOSXR.ratelimit import CLASS_GET
+from pyIOSXR.ratelimit import CLASS_SHOW
+from pyIOSXR.ratelimit import CLASS_CONFIG
+from pyIOSXR.singleflight import SingleFlight
+from pyIOSXR.transcript import for_target
+from pyIOSXR.transcript import DIRECTION_SENT
+from pyIOSXR.transcript import DIRECTION_RECEIVED
+from pyIOSXR.locking import DeviceQueue
+from pyIOSXR.locking import PriorityLock
+from pyIOSXR.locking import backoff_delays
+from pyIOSXR.locking import PRIORITY_BULK
+from pyIOSXR.locking import PRIORITY_CONFIG
+from pyIOSXR.locking import PRIORITY_INTERACTIVE
+
+
+def _copy_reply(reply):
+    """Copy a reply shared by deduplicated reads: the strings are immutable, the XML trees are not."""
+    return copy.deepcopy(reply) if ET.iselement(reply) else reply
+
+
+def config_diff(running_config, merged_config):
+    """
+    Return the unified diff between the running config and the merged config, as returned by compare_config.
+
+    :param running_config: (str) Output of `show running-config`
+    :param merged_config:  (str) Output of `show configuration merge`
+    """
+    diff = difflib.unified_diff(running_config.splitlines(1)[2:-2], merged_config.splitlines(1)[2:-2])
+    return ''.join([x.replace('\r', '') for x in diff])
 
 
 class IOSXR(object):
@@ -52,6 +98,20 @@ class IOSXR(object):
     _XML_MODE_PROMPT = r'XML>'
     _READ_DELAY = 0.1  # at least 0.1, corresponding to 600 max loops (60s timeout)
     _XML_MODE_DELAY = 1  # should be able to read within one second
+    _PRIORITY_AGING = 5  # a request waiting for the XML agent is promoted one lane every 5 seconds
+    _KEEPALIVE_RPC = '<GetVersion/>'  # cheapest request the XML agent answers
+    _LOCK_BACKOFF = 1  # first delay before retrying to lock the config, doubled on each retry
+    _LOCK_BACKOFF_MAX = 30
+    _FAST_POLL = 0.01  # seconds between reads while waiting for the XML prompt, with fast_connect
+    _PIPELINED_LOCK_WAIT = 1  # seconds waiting for the reply to the pipelined <Lock/>, then lock() is sent again
+    _COMMIT_BACKOFF = 1  # delay before the second retry of a commit after ERROR 0x41866c00, doubled on each retry
+    _COMMIT_BACKOFF_MAX = 10
+
+    _prompts = {}  # hostname -> CLI prompt, reused by the next connections with fast_connect
+
+    PRIORITY_CONFIG = PRIORITY_CONFIG
+    PRIORITY_INTERACTIVE = PRIORITY_INTERACTIVE
+    PRIORITY_BULK = PRIORITY_BULK
 
     _ITERATOR_ID_ERROR_MSG = (
         'Non supported IteratorID in Response object.'
@@ -69,6 +129,18 @@ class IOSXR(object):
                  timeout=60,
                  logfile=None,
                  lock=True,
+                 sessions=1,
+                 config_cache_ttl=None,
+                 keepalive=None,
+                 dedup_reads=None,
+                 rate_limiter=None,
+                 site=None,
+                 store=None,
+                 lock_wait=None,
+                 lock_queue=None,
+                 fast_connect=False,
+                 commit_retries=1,
+                 breaker=None,
                  **netmiko_kwargs):
         """
         IOS-XR device constructor.
@@ -78,9 +150,38 @@ class IOSXR(object):
         :param password:  (str) Password
         :param port:      (int) SSH Port (default: 22)
         :param timeout:   (int) Timeout (default: 60 sec)
-        :param logfile:   File-like object to save device communication to or None to disable logging
+        :param logfile:   File path or file-like object to save the transcript of the device communication to,
+                          as JSON lines written in the background, or None to disable logging. The devices logging
+                          to the same file share one writer. Pass a pyIOSXR.transcript.Transcript for rotation
+                          and compression.
         :param lock:      (bool) Auto-lock config upon open() if set to True, connect without locking if False
                           (default: True)
+        :param sessions:  (int) Number of XML agent sessions to open towards the device (default: 1).
+                          Config operations are pinned to the first session, read-only requests are
+                          spread across the others.
+        :param config_cache_ttl: (int) Seconds to keep the running config sections in cache, None to keep them until
+                          the next commit from this session (default: None)
+        :param keepalive: (int) Probe the XML agent after this many idle seconds and recover it in the background,
+                          None to disable (default: None)
+        :param dedup_reads: (float) Identical concurrent read-only requests share one call to the device. With a value
+                          greater than 0, results are also reused for that many seconds. None to disable (default: None)
+        :param rate_limiter: (pyIOSXR.ratelimit.RateLimiter) Limits the rate of the requests sent to the device,
+                          usually shared by all the devices of a fleet (default: None)
+        :param site:      (str) Site of the device, for the per site rate limits (default: None)
+        :param store:     (pyIOSXR.store.ConfigStore) Persistent store of the running configs, consulted before
+                          retrieving them from the device, as long as the commit ID did not change (default: None)
+        :param lock_wait: (float) Seconds lock() keeps retrying while the config is locked by another session,
+                          None to try once (default: None)
+        :param lock_queue: (bool or str) Serialize the config locks of the processes of this host for this device,
+                          through a lock file in the given directory, or in the default one if True (default: None)
+        :param fast_connect: (bool) Enter XML mode as soon as the XML prompt is received, reuse the CLI prompt seen
+                          by the previous connections to the same host, and send the <Lock/> of lock=True together
+                          with the xml command (default: False)
+        :param commit_retries: (int) Times a commit is retried after ERROR 0x41866c00 (commits made by other sessions
+                          meanwhile), replaying the changes loaded by this session in a new XML agent session.
+                          0 to raise CommitConflictError right away (default: 1)
+        :param breaker:   (pyIOSXR.breaker.CircuitBreaker) Fails open() and the requests fast with CircuitOpenError
+                          while the device keeps failing, usually shared by all the devices of a fleet (default: None)
         :netmiko_kwargs   (kwargs) Key-value args to forward to Netmiko.
         """
         self.hostname = str(hostname)
@@ -89,12 +190,44 @@ class IOSXR(object):
         self.port = int(port)
         self.timeout = int(timeout)
         self.logfile = logfile
+        self.transcript = for_target(logfile)
+        self._request_ids = itertools.count(1)
         self.lock_on_connect = lock
         self.locked = False
         self.netmiko_kwargs = netmiko_kwargs
         self._cli_prompt = None
-        self._xml_agent_locker = Lock()
+        self._xml_agent_locker = PriorityLock(aging=self._PRIORITY_AGING)
         self._xml_agent_alive = False
+        self.sessions = max(int(sessions), 1)
+        self._read_sessions = []
+        self._read_sessions_locker = Lock()
+        self._next_read_session = 0
+        self.config_cache_ttl = config_cache_ttl
+        self._config_cache = {}
+        self._config_cache_locker = Lock()
+        self.keepalive = keepalive
+        self._keepalive_thread = None
+        self._keepalive_stop = Event()
+        self._last_activity = time.time()
+        self._single_flight = None
+        if dedup_reads is not None:
+            self._single_flight = SingleFlight(freshness=dedup_reads, copy_result=_copy_reply)
+        self.rate_limiter = rate_limiter
+        self.site = site
+        self.store = store
+        self._deadlines = local()  # deadline of the calls of each thread, see deadline()
+        self._xml_agent_dirty = False  # a cancelled request may still have its reply in flight
+        self.lock_wait = lock_wait
+        self.lock_queue = None
+        if lock_queue:
+            self.lock_queue = DeviceQueue(self.hostname, directory=lock_queue if lock_queue is not True else None)
+        self.fast_connect = fast_connect
+        self.commit_retries = max(int(commit_retries), 0)
+        self.breaker = breaker
+        self._guarded = local()  # set while the current thread is in a call guarded by the breaker
+        self._candidate_changes = []  # requests loaded since the last commit or discard, replayed on 0x41866c00
+        self._commit_stats = {'conflicts': 0, 'recovered': 0, 'failed': 0, 'replayed': 0, 'replayed_bytes': 0,
+                              'recovery_time': 0.0}
 
     def __getattr__(self, item):
         """
@@ -112,6 +245,10 @@ class IOSXR(object):
         keyword params for show command:
           config=True/False :   set True to run show command in config mode
           eg: .show_configuration_merge(config=True)
+          priority=<int> :      lane of the request, e.g. IOSXR.PRIORITY_BULK for polling
+          eg: .show_interfaces(priority=IOSXR.PRIORITY_BULK)
+          timeout=<float> :     seconds the call must complete in, see deadline()
+          eg: .show_interfaces(timeout=5)
 
         """
         def _getattr(*args, **kwargs):
@@ -120,10 +257,11 @@ class IOSXR(object):
             for arg in args:
                 cmd += " %s" % arg
 
-            if kwargs.get("config"):
-                response = self._execute_config_show(cmd)
-            else:
-                response = self._execute_show(cmd)
+            with self.deadline(kwargs.get("timeout")):
+                if kwargs.get("config"):
+                    response = self._execute_config_show(cmd, priority=kwargs.get("priority"))
+                else:
+                    response = self._execute_show(cmd, priority=kwargs.get("priority"))
 
             match = re.search(".*(!! IOS XR Configuration.*)</Exec>", response, re.DOTALL)
 
@@ -136,27 +274,62 @@ class IOSXR(object):
         else:
             raise AttributeError("type object '%s' has no attribute '%s'" % (self.__class__.__name__, item))
 
-    def make_rpc_call(self, rpc_command):
+    def make_rpc_call(self, rpc_command, priority=None, raw=False, timeout=None):
         """
         Allow a user to query a device directly using XML-requests.
 
         :param rpc_command: (str) rpc command such as:
                                   <Get><Operational><LLDP><NodeTable></NodeTable></LLDP></Operational></Get>
+        :param priority:    (int) Lane of the request: IOSXR.PRIORITY_CONFIG, IOSXR.PRIORITY_INTERACTIVE or
+                                  IOSXR.PRIORITY_BULK. By default the changes (load, commit...) use the config lane
+                                  and the reads (show commands, gets) the interactive lane.
+        :param raw:         (bool) Return the reply as received, without parsing nor checking it for errors,
+                                  e.g. to process it in pyIOSXR.offload.ResultProcessor
+        :param timeout:     (float) Seconds the call must complete in, reconnecting included, see deadline()
         """
-        # ~~~ hack: ~~~
-        if not self.is_alive():
-            self.close()  # force close for safety
-            self.open()  # reopen
-        # ~~~ end hack ~~~
-        result = self._execute_rpc(rpc_command)
+        with self.deadline(timeout):
+            # ~~~ hack: ~~~
+            if not self.is_alive():
+                self.close()  # force close for safety
+                self.open()  # reopen
+            # ~~~ end hack ~~~
+            result = self._execute_rpc(rpc_command, priority=priority, raw=raw)
+        if raw:
+            return result.encode('utf-8')
         return ET.tostring(result)
 
+    def export_table(self, schema, table=None, timeout=None):
+        """
+        Retrieve an operational table into columns, see pyIOSXR.columnar.
+
+        :param schema:  (str or TableSchema) 'arp', 'routes', 'mac', or a pyIOSXR.columnar.TableSchema
+        :param table:   (ColumnarTable) Append the rows to this table, e.g. to gather the tables of a fleet
+        :param timeout: (float) Seconds the call must complete in, see deadline()
+        :return: (ColumnarTable) with a 'host' column
+        """
+        schema = TABLES.get(schema, schema)
+        reply = self.make_rpc_call(schema.request, priority=PRIORITY_BULK, raw=True, timeout=timeout)
+        return decode_table(reply, schema, table=table, constants={'host': self.hostname})
+
     def open(self):
         """
         Open a connection to an IOS-XR device.
 
         Connects to the device using SSH and drops into XML mode.
         """
+        self._candidate_changes = []  # loaded in a previous session, gone with it
+        self._guard(self._connect)
+        try:
+            self._open_read_sessions()
+        except Exception:
+            try:
+                self.close()  # do not leak the session opened above
+            except Exception:
+                pass  # raising the original error
+            raise
+        self._start_keepalive()
+
+    def _connect(self):
         try:
             self.device = ConnectHandler(device_type='cisco_xr',
                                          ip=self.hostname,
@@ -166,14 +339,160 @@ class IOSXR(object):
                                          **self.netmiko_kwargs)
             self.device.timeout = self.timeout
             self._xml_agent_alive = True  # successfully open thus alive
+            self._xml_agent_dirty = False  # new channel, no reply in flight
         except NetMikoTimeoutException as t_err:
             raise ConnectError(t_err.args[0])
         except NetMikoAuthenticationException as au_err:
             raise ConnectError(au_err.args[0])
 
-        self._cli_prompt = self.device.find_prompt()  # get the prompt
+        self._cli_prompt = self._find_prompt()
         self._enter_xml_mode()
 
+    def _find_prompt(self):
+        prompt = self._prompts.get(self.hostname) if self.fast_connect else None
+        if prompt is None:
+            prompt = self._prompts[self.hostname] = self.device.find_prompt()  # get the prompt
+        return prompt
+
+    def _open_read_sessions(self):
+        """
+        Open the additional XML agent sessions used for read-only requests.
+
+        Stops opening sessions as soon as the device refuses a new one, e.g. when the XML agent session limit is hit.
+        """
+        self._read_sessions = []
+        for _ in range(self.sessions - 1):
+            session = self.__class__(self.hostname,
+                                     self.username,
+                                     self.password,
+                                     port=self.port,
+                                     timeout=self.timeout,
+                                     logfile=self.logfile,
+                                     lock=False,
+                                     keepalive=self.keepalive,
+                                     **self.netmiko_kwargs)
+            try:
+                session.open()
+            except ConnectError:
+                self._close_session(session)
+                break  # reached the limit of sessions the device accepts
+            except Exception:
+                self._close_session(session)
+                self._close_read_sessions()
+                raise
+            self._read_sessions.append(session)
+
+    @staticmethod
+    def _close_session(session):
+        """Close a session which failed to open, whatever it got to."""
+        try:
+            session.device.remote_conn.close()
+        except Exception:
+            pass  # not connected
+
+    def _close_read_sessions(self):
+        for session in self._read_sessions:
+            session.close()
+        self._read_sessions = []
+
+    @staticmethod
+    def _is_read_only_rpc(command_xml):
+        """
+        Tells if the request can be served by any session.
+
+        Only single show commands, operational gets and gets of the running config qualify:
+        everything else depends on the config session (candidate config, lock) and must stay on the main session.
+        """
+        command_xml = command_xml.strip()
+        if command_xml.startswith('<CLI><Exec>'):
+            return command_xml.endswith('</CLI>') and command_xml.count('</CLI>') == 1
+        if command_xml.startswith(('<Get><Operational>', '<Get><Configuration Source="CurrentConfig">')):
+            return command_xml.endswith('</Get>') and command_xml.count('</Get>') == 1
+        return False
+
+    @staticmethod
+    def _default_priority(command_xml):
+        """
+        Lane of the request by operation: the reads (show commands, config mode show commands, gets)
+        use the interactive lane, the changes (load, set, delete, commit, lock...) use the config lane.
+        """
+        command_xml = command_xml.strip()
+        if command_xml.startswith('<CLI><Configuration>'):
+            show = command_xml[len('<CLI><Configuration>'):].lstrip()
+            if show.startswith('show ') and command_xml.count('</CLI>') == 1:
+                return PRIORITY_INTERACTIVE
+            return PRIORITY_CONFIG
+        if command_xml.startswith(('<CLI><Exec>', '<Get>')):
+            return PRIORITY_INTERACTIVE
+        return PRIORITY_CONFIG
+
+    def _select_session(self, command_xml):
+        """
+        Returns the session that should execute the request: an idle read session if possible, round robin otherwise.
+        """
+        if not self._read_sessions or not self._is_read_only_rpc(command_xml):
+            return self
+        with self._read_sessions_locker:
+            count = len(self._read_sessions)
+            session = self._read_sessions[self._next_read_session % count]
+            for offset in range(count):
+                candidate = self._read_sessions[(self._next_read_session + offset) % count]
+                if not candidate._xml_agent_locker.locked():
+                    session = candidate
+                    break
+            self._next_read_session = (self._read_sessions.index(session) + 1) % count
+        return session
+
+    def _start_keepalive(self):
+        if not self.keepalive or (self._keepalive_thread and self._keepalive_thread.is_alive()):
+            return
+        self._keepalive_stop.clear()
+        self._keepalive_thread = Thread(target=self._keepalive_loop, name='pyIOSXR-keepalive-%s' % self.hostname)
+        self._keepalive_thread.daemon = True
+        self._keepalive_thread.start()
+
+    def _stop_keepalive(self):
+        self._keepalive_stop.set()
+        if self._keepalive_thread and self._keepalive_thread is not current_thread():
+            self._keepalive_thread.join()
+        self._keepalive_thread = None
+
+    def _keepalive_loop(self):
+        while not self._keepalive_stop.wait(self.keepalive):
+            if time.time() - self._last_activity < self.keepalive or self._xml_agent_locker.locked():
+                continue  # recently used or busy: alive
+            try:
+                self._keepalive_probe()
+            except Exception:
+                pass  # could not recover now, will retry on the next round or on the next request
+
+    def _keepalive_probe(self):
+        """
+        Check the XML agent with a minimal request and bring it back if needed.
+
+        When the session fell back to CLI mode, _send_command re-enters XML mode itself.
+        When the transport is gone or the agent does not answer, reconnects.
+        """
+        if self.is_alive():
+            try:
+                self._execute_rpc(self._KEEPALIVE_RPC, priority=PRIORITY_BULK)
+                return
+            except XMLCLIError:
+                return  # XML mode re-entered already
+            except TimeoutError:
+                pass  # the agent does not answer anymore
+        self._reconnect()
+
+    def _reconnect(self):
+        if hasattr(self, 'device') and hasattr(self.device, 'remote_conn'):
+            try:
+                self.device.remote_conn.close()
+            except Exception:
+                pass  # already closed
+        self.locked = False  # the config lock is released together with the session
+        self._candidate_changes = []  # and so is the candidate config
+        self._connect()
+
     def is_alive(self):
         """
         Returns the XML agent connection state (and SSH connection state).
@@ -182,33 +501,154 @@ class IOSXR(object):
             return self.device.remote_conn.transport.is_active() and self._xml_agent_alive
         return False  # remote_conn not there => connection not init => not alive
 
+    @contextmanager
+    def deadline(self, seconds):
+        """
+        Context manager bounding the duration of all the calls made in the block by the current thread.
+
+        The deadline applies to the whole operation: waiting for the rate limiter and for the XML agent, sending,
+        reading, retries and recoveries, e.g. re-entering XML mode or reloading the config on ERROR 0x41866c00.
+        When it expires, TimeoutError is raised and the session stays usable: the reply of a cancelled request
+        is discarded before the next request. Nested deadlines cannot extend the outer one.
+
+            >>> with device.deadline(5):
+            ...     device.load_candidate_config(config='ntp peer 172.17.17.1')
+            ...     device.commit_config()
+
+        :param seconds: (float) Seconds from now, None for no deadline
+        """
+        with self._deadline_scope(time.time() + seconds if seconds is not None else None):
+            yield
+
+    @contextmanager
+    def _deadline_scope(self, deadline):
+        previous = self._deadline()
+        if previous is not None and (deadline is None or previous < deadline):
+            deadline = previous
+        self._deadlines.value = deadline
+        try:
+            yield
+        finally:
+            self._deadlines.value = previous
+
+    def _deadline(self):
+        return getattr(self._deadlines, 'value', None)
+
+    def _remaining(self, start=None):
+        """
+        Seconds left to the current call: until its deadline, and until the timeout counted from start.
+
+        :return: (float) Seconds, negative when exceeded, or None when not limited
+        """
+        limits = []
+        if start:
+            limits.append(start + self.timeout)
+        deadline = self._deadline()
+        if deadline is not None:
+            limits.append(deadline)
+        if not limits:
+            return None
+        return min(limits) - time.time()
+
     def _timeout_exceeded(self, start=None, msg='Timeout exceeded!'):
-        if not start:
+        remaining = self._remaining(start)
+        if remaining is None:
             return False  # reference not specified, noth to compare => no error
-        if time.time() - start > self.timeout:
+        if remaining < 0:
             # it timeout exceeded, throw TimeoutError
             raise TimeoutError(msg, self)
         return False
 
-    def _lock_xml_agent(self, start=None):
-        while (not self._xml_agent_locker.acquire(False)
-            and not self._timeout_exceeded(start, 'Waiting to acquire the XML agent!')):
-                # will wait here till the XML agent is ready to receive new requests
-                # if stays too much, _timeout_exceeded will raise TimeoutError
-                pass  # do nothing, just wait
+    def _deadline_exceeded(self):
+        deadline = self._deadline()
+        return deadline is not None and time.time() > deadline
+
+    def _cancel_request(self):
+        """Give up on the request in flight: its reply will be discarded before sending the next request."""
+        self._xml_agent_dirty = True
+        # without dev: the XML agent is alive, only the reply of this request is given up
+        self._unlock_xml_agent()
+        raise TimeoutError('Deadline exceeded, request cancelled!')
+
+    def _discard_cancelled_reply(self, start, priority):
+        """
+        Read and drop the reply of a cancelled request, up to the XML prompt, so the next reply is read in sync.
+
+        Reconnects when the reply does not complete within the timeout.
+        """
+        output = ''
+        while not output.rstrip().endswith(self._XML_MODE_PROMPT):
+            remaining = self._remaining(start)
+            if remaining < 0:
+                if self._deadline_exceeded():
+                    self._unlock_xml_agent()  # still dirty, the next request drains the rest of the reply
+                    raise TimeoutError('Deadline exceeded, discarding the reply of a cancelled request!')
+                self._xml_agent_dirty = False
+                self._reconnect()  # releases the XML agent
+                self._lock_xml_agent(start, priority=priority)
+                return
+            data = self.device.read_channel()
+            if not data:
+                time.sleep(min(self._READ_DELAY, max(remaining, 0)))
+            output += data
+        self._xml_agent_dirty = False
+
+    def _lock_xml_agent(self, start=None, priority=PRIORITY_INTERACTIVE):
+        timeout = self._remaining(start)
+        if timeout is not None:
+            timeout = max(timeout, 0)
+        # will wait here till the XML agent is ready to receive new requests
+        # higher priority requests are served first
+        if not self._xml_agent_locker.acquire(timeout=timeout, priority=priority):
+            # without dev: the XML agent is held by the request in flight, which is still healthy
+            raise DeadlineError('Waiting to acquire the XML agent!')
         return True  # ready to go now
 
+    def lane_stats(self):
+        """
+        Return the time spent by requests waiting for the XML agent, per lane, summed over all sessions.
+
+        :return: dict {priority: {'requests': int, 'wait_total': float, 'wait_max': float, 'waiting': int}}
+        """
+        stats = {}
+        for session in [self] + self._read_sessions:
+            waiting = session._xml_agent_locker.waiting()
+            for lane, lane_stats in session._xml_agent_locker.stats().items():
+                total = stats.setdefault(lane, {'requests': 0, 'wait_total': 0.0, 'wait_max': 0.0, 'waiting': 0})
+                total['requests'] += lane_stats['requests']
+                total['wait_total'] += lane_stats['wait_total']
+                total['wait_max'] = max(total['wait_max'], lane_stats['wait_max'])
+                total['waiting'] += waiting.get(lane, 0)
+        return stats
+
+    def dedup_stats(self):
+        """
+        Return the counters of the read requests deduplication (see dedup_reads), empty when disabled.
+
+        :return: dict {'calls': int, 'shared': int, 'fresh': int}
+        """
+        if self._single_flight is None:
+            return {}
+        return self._single_flight.stats()
+
     def _unlock_xml_agent(self):
         if self._xml_agent_locker.locked():
             self._xml_agent_locker.release()
 
+    def _log(self, direction, payload, request_id=None):
+        if self.transcript is not None and payload:
+            self.transcript.record(self.hostname, direction, payload, request_id=request_id)
+
     def _send_command_timing(self, command):
 
-        return self.device.send_command_timing(command,
-                                               delay_factor=self._READ_DELAY,
-                                               max_loops=self._XML_MODE_DELAY/self._READ_DELAY,
-                                               strip_prompt=False,
-                                               strip_command=False)
+        self._log(DIRECTION_SENT, command)
+        output = self.device.send_command_timing(command,
+                                                 delay_factor=self._READ_DELAY,
+                                                 max_loops=self._XML_MODE_DELAY/self._READ_DELAY,
+                                                 strip_prompt=False,
+                                                 strip_command=False)
+        self._log(DIRECTION_RECEIVED, output)
+        return output
 
     def _in_cli_mode(self):
 
@@ -224,18 +664,93 @@ class IOSXR(object):
         self._unlock_xml_agent()
         # release - other commands should not have anyway access to the XML agent
         # when not in XML mode
-        self._lock_xml_agent()  # make sure it won't collide with other parallel requests
+        self._lock_xml_agent(priority=PRIORITY_CONFIG)  # make sure it won't collide with other parallel requests
 
-        out = self._send_command_timing(self._XML_SHELL)  # send xml shell command
+        if self.fast_connect:
+            # the config lock is pipelined only when lock() would send a single <Lock/>
+            out = self._enter_xml_mode_fast(pipeline_lock=self.lock_on_connect and not self.locked and
+                                            self.lock_queue is None)
+        else:
+            out = self._send_command_timing(self._XML_SHELL)  # send xml shell command
 
         if '0x24319600' in out:
             # XML agent is not enabled
             raise ConnectError('XML agent is not enabled. Please configure `xml agent tty iteration off`!', self)
+        if self._XML_MODE_PROMPT not in out and ('ERROR' in out or out.rstrip().endswith(self._cli_prompt)):
+            # still in CLI mode: the XML agent refused the session, e.g. too many sessions
+            raise ConnectError('The XML agent refused the session: %s' % out.strip(), self)
 
         self._unlock_xml_agent()
 
         if self.lock_on_connect:
-            self.lock()
+            self.lock()  # nothing to do if the pipelined <Lock/> was granted
+
+    def _enter_xml_mode_fast(self, pipeline_lock=False):
+        """
+        Send the xml command, and optionally <Lock/> right behind it, then read until the XML prompt is received.
+
+        The reply to the pipelined <Lock/> is awaited _PIPELINED_LOCK_WAIT seconds at most after the first XML prompt:
+        when late, locked stays False and lock_on_connect sends a plain lock(), once the late reply is drained.
+
+        :return: (str) Output read
+        """
+        commands = self._XML_SHELL + '\n'
+        if pipeline_lock:
+            commands += wrap_request('<Lock/>') + '\n'  # buffered by the terminal until the XML agent reads it
+        self._log(DIRECTION_SENT, commands)
+        self.device.write_channel(commands)
+
+        def _until_xml_prompts(count):
+            def _done(output):
+                if '0x24319600' in output or output.count(self._XML_MODE_PROMPT) >= count:
+                    return True
+                # refused, e.g. too many sessions: ERROR then back to the CLI prompt
+                return self._XML_MODE_PROMPT not in output and output.rstrip().endswith(self._cli_prompt.strip())
+            return _done
+
+        output = self._read_channel_until(_until_xml_prompts(1))
+        if pipeline_lock and self._XML_MODE_PROMPT in output:
+            output = self._read_channel_until(_until_xml_prompts(2), output=output,
+                                              timeout=self._PIPELINED_LOCK_WAIT)
+            self.locked = self._lock_granted(output)
+            if output.count(self._XML_MODE_PROMPT) < 2:
+                self._xml_agent_dirty = True  # the late reply is drained before the next request
+        self._log(DIRECTION_RECEIVED, output)
+        return output
+
+    def _read_channel_until(self, done, output='', timeout=None):
+        """
+        Read from the channel until done(output) or the timeout, polling every _FAST_POLL seconds.
+
+        :param output:  (str) Output already read, extended
+        :param timeout: (float) Seconds, shorter than the timeout of the device
+        """
+        start = time.time()
+        while not done(output):
+            data = self.device.read_channel()
+            if data:
+                output += data
+                continue
+            remaining = self._remaining(start)
+            if timeout is not None:
+                remaining = min(remaining, start + timeout - time.time())
+            if remaining <= 0:
+                break
+            time.sleep(min(self._FAST_POLL, remaining))
+        return output
+
+    @staticmethod
+    def _lock_granted(output):
+        """Check the reply to a pipelined <Lock/>."""
+        match = re.search(r'<Response.*?</Response>', output, re.DOTALL)
+        if match is None:
+            return False
+        try:
+            root = ET.fromstring(match.group(0).encode('utf-8'))
+        except ET.XMLSyntaxError:
+            return False
+        result_summary = root.find('ResultSummary')
+        return result_summary is not None and int(result_summary.get('ErrorCount', 0)) == 0
 
     def _send_command(self,
                       command,
@@ -243,7 +758,8 @@ class IOSXR(object):
                       start=None,
                       expect_string=None,
                       read_output=None,
-                      receive=False):
+                      receive=False,
+                      priority=PRIORITY_INTERACTIVE):
 
         if not expect_string:
             expect_string = self._XML_MODE_PROMPT
@@ -256,6 +772,7 @@ class IOSXR(object):
 
         if not start:
             start = time.time()
+        self._last_activity = start
 
         output = read_output
 
@@ -264,17 +781,24 @@ class IOSXR(object):
         if not read_output and not receive:
             # because the XML agent is able to process only one single request over the same SSH session at a time
             # first come first served
-            self._lock_xml_agent(start)
+            self._lock_xml_agent(start, priority=priority)
+            if self._xml_agent_dirty:
+                self._discard_cancelled_reply(start, priority)
+            request_id = next(self._request_ids)
+            self._log(DIRECTION_SENT, command, request_id)
             try:
-                max_loops = self.timeout / delay_factor
+                max_loops = max(self._remaining(start), delay_factor) / delay_factor
                 last_read = self.device.send_command_expect(command,
                                                             expect_string=expect_string,
                                                             strip_prompt=False,
                                                             strip_command=False,
                                                             delay_factor=delay_factor,
                                                             max_loops=max_loops)
+                self._log(DIRECTION_RECEIVED, last_read, request_id)
                 output += last_read
             except IOError as ioe:
+                if self._deadline_exceeded():
+                    self._cancel_request()
                 if ((not last_read and self._in_cli_mode()) or
                     (self._cli_prompt in output and "% Invalid input detected at '^' marker." in output)):
                     # something happened
@@ -303,9 +827,13 @@ class IOSXR(object):
                         # reiterate the command from the beginning
                         return self._send_command(command,
                                                   expect_string=expect_string,
-                                                  delay_factor=delay_factor)
+                                                  delay_factor=delay_factor,
+                                                  start=start,
+                                                  priority=priority)
         else:
-            output += self._netmiko_recv()  # try to read some more
+            last_read = self._netmiko_recv()  # try to read some more
+            self._log(DIRECTION_RECEIVED, last_read)
+            output += last_read
 
         if '0xa3679e00' in output or '0xa367da00' in output:
                 # when multiple parallel request are made, the device throws one of the the errors:
@@ -339,6 +867,8 @@ class IOSXR(object):
                 raise XMLCLIError('Could not properly execute the command. Re-entering XML mode...', self)
             if not output.strip():  # empty output, means that the device did not start delivering the output
                 # but for sure is still in XML mode as netmiko did not throw error
+                if self._deadline_exceeded():
+                    self._cancel_request()
                 if not self._timeout_exceeded(start=start):
                     return self._send_command(command, receive=True, start=start)  # let's try receiving more
 
@@ -357,12 +887,73 @@ class IOSXR(object):
         return output
 
     # previous module function __execute_rpc__
-    def _execute_rpc(self, command_xml, delay_factor=.1):
+    def _execute_rpc(self, command_xml, delay_factor=.1, priority=None, raw=False, dedup=True):
+
+        read_only = self._is_read_only_rpc(command_xml)
+        if priority is None:
+            priority = self._default_priority(command_xml)
+
+        def _call():
+            if self.rate_limiter is not None:
+                remaining = self._remaining()
+                if remaining is not None and self.rate_limiter.delay(
+                        self.hostname, site=self.site, request_class=self._request_class(command_xml)) > remaining:
+                    raise DeadlineError('The request would be throttled beyond its deadline!')
+                # waits here while over the limits
+                self.rate_limiter.acquire(self.hostname, site=self.site, request_class=self._request_class(command_xml))
+            return self._dispatch_rpc(command_xml, delay_factor=delay_factor, priority=priority, raw=raw)
+
+        if self._single_flight is not None and read_only and dedup:
+            # each caller gets its own copy of the shared reply, free to modify it
+            # only the call sent to the device goes through the circuit breaker: a failure counts once
+            return self._single_flight.do((command_xml, raw), lambda: self._guard(_call), timeout=self._remaining())
+        return self._guard(_call)
+
+    def _guard(self, function, *args, **kwargs):
+        """Call the function through the circuit breaker of the device, if any. Nested calls count as one."""
+        if self.breaker is None or getattr(self._guarded, 'value', False):
+            return function(*args, **kwargs)
+        self._guarded.value = True
+        try:
+            return self.breaker.call(self.hostname, function, *args, **kwargs)
+        finally:
+            self._guarded.value = False
+
+    @staticmethod
+    def _request_class(command_xml):
+        command_xml = command_xml.lstrip()
+        if command_xml.startswith('<CLI><Exec>'):
+            return CLASS_SHOW
+        if command_xml.startswith('<Get>'):
+            return CLASS_GET
+        return CLASS_CONFIG
+
+    def throttle_delay(self, request_class=None):
+        """
+        Return the number of seconds a new request to this device would currently be delayed by the rate limiter.
+
+        :param request_class: (str) 'show', 'get' or 'config'. When not specified, returns the longest delay.
+        """
+        if self.rate_limiter is None:
+            return 0.0
+        classes = [request_class] if request_class else [CLASS_SHOW, CLASS_GET, CLASS_CONFIG]
+        return max(self.rate_limiter.delay(self.hostname, site=self.site, request_class=cls) for cls in classes)
+
+    def _dispatch_rpc(self, command_xml, delay_factor=.1, priority=PRIORITY_INTERACTIVE, raw=False):
 
-        xml_rpc_command = '<?xml version="1.0" encoding="UTF-8"?><Request MajorVersion="1" MinorVersion="0">' \
-              + command_xml + '</Request>'
+        session = self._select_session(command_xml)
+        if session is not self:
+            with session._deadline_scope(self._deadline()):
+                if not session.is_alive():
+                    session.close()  # force close for safety
+                    session.open()  # reopen
+                return session._dispatch_rpc(command_xml, delay_factor=delay_factor, priority=priority, raw=raw)
 
-        response = self._send_command(xml_rpc_command, delay_factor=delay_factor)
+        xml_rpc_command = wrap_request(command_xml)
+
+        response = self._send_command(xml_rpc_command, delay_factor=delay_factor, priority=priority)
+        if raw:
+            return response
 
         try:
             root = ET.fromstring(str.encode(response))
@@ -394,23 +985,17 @@ class IOSXR(object):
                     # 'One or more commits have occurred from other configuration sessions since this session started
                     # or since the last commit was made from this session.'
                     # dumb.
-                    # in this case we need to re-open the connection with the XML agent
-                    _candidate_config = self.get_candidate_config(merge=True)
-                    self.discard_config()  # discard candidate config
-                    try:
-                        # exiting from the XML mode
-                        self._send_command('exit', expect_string=self._cli_prompt)
-                    except XMLCLIError:
-                        pass  # because does not end with `XML>`
-                    self._enter_xml_mode()  # re-entering XML mode
-                    self.load_candidate_config(config=_candidate_config)
-                    return self.commit_config()
+                    # the commit is retried in a new XML agent session, see _commit()
+                    raise CommitConflictError(error_msg, self)
                 elif error_code == '0x41864e00' or error_code == '0x43682c00':
                     # raises this error when the commit buffer is empty
                     raise CommitError('The target configuration buffer is empty.', self)
 
             else:
                 error_msg = root.get('ErrorMsg') or ''
+                if not error_msg:
+                    # errors of native operations (Get, Set, Delete) are reported on the offending element
+                    error_msg = '\n'.join(el.get('ErrorMsg') for el in root.xpath('.//*[@ErrorMsg]'))
 
             error_msg += '\nOriginal call was: %s' % xml_rpc_command
             raise XMLCLIError(error_msg, self)
@@ -429,26 +1014,26 @@ class IOSXR(object):
         return root
 
     # previous module function __execute_show__
-    def _execute_show(self, show_command):
+    def _execute_show(self, show_command, priority=None, dedup=True):
         """
         Executes an operational show-type command.
         """
         rpc_command = '<CLI><Exec>{show_command}</Exec></CLI>'.format(
             show_command=escape_xml(show_command)
         )
-        response = self._execute_rpc(rpc_command)
+        response = self._execute_rpc(rpc_command, priority=priority, dedup=dedup)
         raw_response = response.xpath('.//CLI/Exec')[0].text
         return raw_response.strip() if raw_response else ''
 
     # previous module function __execute_config_show__
-    def _execute_config_show(self, show_command, delay_factor=.1):
+    def _execute_config_show(self, show_command, delay_factor=.1, priority=None):
         """
         Executes a configuration show-type command.
         """
         rpc_command = '<CLI><Configuration>{show_command}</Configuration></CLI>'.format(
             show_command=escape_xml(show_command)
         )
-        response = self._execute_rpc(rpc_command, delay_factor=delay_factor)
+        response = self._execute_rpc(rpc_command, delay_factor=delay_factor, priority=priority)
         raw_response = response.xpath('.//CLI/Configuration')[0].text
         return raw_response.strip() if raw_response else ''
 
@@ -458,25 +1043,91 @@ class IOSXR(object):
 
         Clean up after you are done and explicitly close the router connection.
         """
+        self._stop_keepalive()
         if self.lock_on_connect or self.locked:
             self.unlock()  # this refers to the config DB
+        self._release_lock_queue()  # the lock of the session is gone with it anyway
         self._unlock_xml_agent()  # this refers to the XML agent
+        self._close_read_sessions()
         if hasattr(self.device, 'remote_conn'):
             self.device.remote_conn.close()  # close the underlying SSH session
+        if self.transcript is not None:
+            self.transcript.flush()
 
-    def lock(self):
+    def lock(self, wait=None):
         """
         Lock the config database.
 
         Use if Locking/Unlocking is not performaed automatically by lock=False
+
+        :param wait: (float) Seconds to keep retrying while another session holds the lock, with exponential
+                     backoff and jitter. Default: lock_wait of the device, None to try once.
+                     With lock_queue, includes the time waiting for the other local processes.
         """
-        if not self.locked:
-            rpc_command = '<Lock/>'
+        if self.locked:
+            return
+        if wait is None:
+            wait = self.lock_wait
+        with self.deadline(wait):
+            if self.lock_queue is not None and not self.lock_queue.locked():
+                if not self.lock_queue.acquire(timeout=self._remaining()):
+                    raise LockError('Waited for the local process {pid} to release {host}!'.format(
+                        pid=(self.lock_queue.holder() or {}).get('pid'), host=self.hostname))
             try:
-                self._execute_rpc(rpc_command)
+                locked = self._lock_config_db(retry=wait is not None)
+            except Exception:
+                self._release_lock_queue()
+                raise
+        if not locked:
+            self._release_lock_queue()
+            holder = None
+            try:
+                holder = self.lock_holder()
+            except Exception:
+                pass  # no time left or no session info, the error is the same
+            msg = 'Unable to enter in configure exclusive mode!'
+            if holder is not None:
+                msg += ' Locked by {user} on {line} since {since}.'.format(**holder)
+            err = LockError(msg, self)
+            err.holder = holder
+            raise err
+        self.locked = True
+
+    def _lock_config_db(self, retry=False):
+        """Send <Lock/>, retrying until the deadline when retry is set. Return False when locked by someone else."""
+        delays = backoff_delays(self._LOCK_BACKOFF, self._LOCK_BACKOFF_MAX)
+        while True:
+            try:
+                self._execute_rpc('<Lock/>')
+                return True
             except XMLCLIError:
-                raise LockError('Unable to enter in configure exclusive mode!', self)
-            self.locked = True
+                pass
+            except TimeoutError:
+                if not retry:
+                    raise
+                return False  # the deadline expired during the attempt
+            remaining = self._remaining()
+            if not retry or remaining is None or remaining <= 0:
+                return False
+            time.sleep(min(next(delays), remaining))
+
+    def _release_lock_queue(self):
+        if self.lock_queue is not None and self.lock_queue.locked():
+            self.lock_queue.release()
+
+    def lock_holder(self):
+        """
+        Return the configuration session holding the exclusive config lock, or None if the config is not locked.
+
+        :return: dict {'session': str, 'line': str, 'user': str, 'since': str}
+        """
+        output = self._execute_show('show configuration sessions')
+        for line in output.splitlines():
+            # 00000201-00070a9e-00000000     vty1       cisco    Mon Oct 14 12:28:10 2019  *
+            match = re.match(r'^\s*(\S+-\S+)\s+(\S+)\s+(\S+)\s+(.+?)\s+\*\s*$', line)
+            if match is not None:
+                return dict(zip(('session', 'line', 'user', 'since'), match.groups()))
+        return None
 
     def unlock(self):
         """
@@ -491,6 +1142,7 @@ class IOSXR(object):
             except XMLCLIError:
                 raise UnlockError('Unable to unlock the config!', self)
             self.locked = False
+            self._release_lock_queue()
 
     def load_candidate_config(self, filename=None, config=None):
         """
@@ -522,6 +1174,148 @@ class IOSXR(object):
         except InvalidInputError as e:
             self.discard_config()
             raise InvalidInputError(e.args[0], self)
+        self._candidate_changes.append(rpc_command)
+
+    def set_config(self, path, data):
+        """
+        Set configuration in the candidate config using a native XML <Set> operation.
+
+        Does not go through the CLI parser, thus preferred for small targeted changes.
+
+        :param path: (tuple) Element names from <Configuration> down to the subtree, e.g.
+                             ('InterfaceConfigurationTable', 'InterfaceConfiguration')
+        :param data: (dict) Naming and leaves to set under the path, e.g.
+                            {'Naming': {'Active': 'act', 'InterfaceName': 'GigabitEthernet0/0/0/0'},
+                             'Description': 'uplink'}
+        """
+        rpc_command = build_set_config(path, data)
+        self._execute_rpc(rpc_command)
+        self._candidate_changes.append(rpc_command)
+
+    def delete_config(self, path, data=None):
+        """
+        Delete configuration from the candidate config using a native XML <Delete> operation.
+
+        :param path: (tuple) Element names from <Configuration> down to the subtree
+        :param data: (dict) Naming and leaves under the path selecting what to delete
+        """
+        rpc_command = build_delete_config(path, data)
+        self._execute_rpc(rpc_command)
+        self._candidate_changes.append(rpc_command)
+
+    def get_config(self, path=(), data=None, source=None, priority=None):
+        """
+        Retrieve configuration using a native XML <Get> operation.
+
+        :param path:     (tuple) Element names from <Configuration> down to the subtree, e.g. ('NTP', )
+        :param data:     (dict) Optional filter under the path
+        :param source:   (str) CurrentConfig, ChangedConfig, MergedConfig or CommitChanges.
+                               Defaults to the merged config of the current session.
+        :param priority: (int) Lane of the request, e.g. IOSXR.PRIORITY_BULK. Default: interactive
+        :return: The <Configuration> element of the reply (lxml.etree._Element)
+        """
+        response = self._execute_rpc(build_get_config(path, data=data, source=source), priority=priority)
+        return response.find('Get/Configuration')
+
+    def _cached_config(self, key, fetch, refresh=False, dump=None, load=None):
+        now = time.time()
+        if not refresh:
+            with self._config_cache_locker:
+                cached = self._config_cache.get(key)
+            if cached is not None and (self.config_cache_ttl is None or now - cached[0] <= self.config_cache_ttl):
+                return cached[1]
+        if self.store is not None:
+            value = self._stored_config(key, fetch, refresh, dump, load)
+        else:
+            value = fetch()
+        with self._config_cache_locker:
+            self._config_cache[key] = (now, value)
+        return value
+
+    def _stored_config(self, key, fetch, refresh, dump, load):
+        commit_id = self.get_commit_id()
+        kind = '{0}:{1}'.format(*key)
+        if commit_id is not None and not refresh:
+            stored = self.store.get(self.hostname, commit_id, kind)
+            if stored is not None:
+                return load(stored) if load is not None else stored
+        value = fetch()
+        if commit_id is not None and self.get_commit_id(refresh=True) == commit_id:
+            # not stored when another session committed meanwhile: the value may be newer than commit_id
+            self.store.put(self.hostname, commit_id, kind, dump(value) if dump is not None else value)
+        return value
+
+    def get_commit_id(self, refresh=False):
+        """
+        Return the ID of the last commit on the device (its label, when it has one), or None if there is no commit.
+
+        :param refresh: (bool) Ask the device, even when dedup_reads has a recent reply
+        """
+        response = self._execute_show('show configuration commit list 1', dedup=not refresh)
+        match = re.search(r'^\s*1\s+(\S+)', response, re.MULTILINE)
+        return match.group(1) if match is not None else None
+
+    def invalidate_config_cache(self):
+        """
+        Drop the cached running config sections.
+
+        Called automatically after commit and rollback, call it explicitly when the config was changed by someone else.
+        """
+        with self._config_cache_locker:
+            self._config_cache.clear()
+        if self._single_flight is not None:
+            self._single_flight.forget()
+
+    def get_running_config(self, refresh=False, priority=None):
+        """
+        Retrieve the running config, as displayed by show running-config, cached until the next commit.
+
+        :param refresh:  (bool) Ignore the cache and retrieve the config from the device
+        :param priority: (int) Lane of the request, e.g. IOSXR.PRIORITY_BULK. Default: interactive
+        """
+        def _fetch():
+            return self._execute_config_show('show running-config', priority=priority)
+
+        return self._cached_config(('cli', ''), _fetch, refresh=refresh)
+
+    def get_running_config_section(self, section, refresh=False, priority=None):
+        """
+        Retrieve one section of the running config, cached until the next commit.
+
+        :param section:  (str) CLI section, e.g. 'ntp' or 'interface GigabitEthernet0/0/0/0'
+        :param refresh:  (bool) Ignore the cache and retrieve the section from the device
+        :param priority: (int) Lane of the request, e.g. IOSXR.PRIORITY_BULK. Default: interactive
+        :return: (str) the section of the running config
+        """
+        def _fetch():
+            response = self._execute_show('show running-config {section}'.format(section=section), priority=priority)
+            match = re.search(".*(!! IOS XR Configuration.*)$", response, re.DOTALL)
+            if match is not None:
+                response = match.group(1)
+            # drop the header lines
+            return '\n'.join(line for line in response.splitlines() if not line.startswith('!! ')).strip()
+
+        return self._cached_config(('cli', section.strip()), _fetch, refresh=refresh)
+
+    def get_running_config_subtree(self, path, data=None, refresh=False, priority=None):
+        """
+        Retrieve one subtree of the running config through the XML API, cached until the next commit.
+
+        :param path:     (tuple) Element names from <Configuration> down to the subtree, e.g. ('NTP', )
+        :param data:     (dict) Optional filter under the path
+        :param refresh:  (bool) Ignore the cache and retrieve the subtree from the device
+        :param priority: (int) Lane of the request, e.g. IOSXR.PRIORITY_BULK. Default: interactive
+        :return: A copy of the <Configuration> element of the reply (lxml.etree._Element)
+        """
+        rpc_command = build_get_config(path, data=data, source='CurrentConfig')
+
+        def _fetch():
+            return self._execute_rpc(rpc_command, priority=priority).find('Get/Configuration')
+
+        subtree = self._cached_config(('xml', rpc_command), _fetch, refresh=refresh,
+                                      dump=lambda element: ET.tostring(element, with_tail=False).decode('utf-8'),
+                                      load=lambda text: ET.fromstring(text.encode('utf-8')))
+        return copy.deepcopy(subtree)
 
     def get_candidate_config(self, merge=False, formal=False):
         """
@@ -557,8 +1351,23 @@ class IOSXR(object):
         _show_merge = self._execute_config_show('show configuration merge')
         _show_run = self._execute_config_show('show running-config')
 
-        diff = difflib.unified_diff(_show_run.splitlines(1)[2:-2], _show_merge.splitlines(1)[2:-2])
-        return ''.join([x.replace('\r', '') for x in diff])
+        return config_diff(_show_run, _show_merge)
+
+    def iter_compare_config(self, context=3):
+        """
+        Compare configuration to be merged with the one on the device, one hunk at a time.
+
+        Same diff as compare_config, computed section by section and generated as soon as each hunk is complete,
+        so large diffs can be rendered while they are computed. Hunks may be aligned slightly differently
+        than by compare_config when sections are moved around.
+
+        :param context: (int) Lines of context around the changes
+        :return: generator of str, the header '--- \\n+++ \\n' followed by the hunks
+        """
+        _show_merge = self._execute_config_show('show configuration merge')
+        _show_run = self._execute_config_show('show running-config')
+
+        return iter_config_diff(_show_run, _show_merge, context=context)
 
     def compare_replace_config(self):
         """
@@ -582,19 +1391,79 @@ class IOSXR(object):
         :param comment:   Commit label, displayed instead of the commit ID on the device. (Max 60 characters)
         :param confirmed: Commit with auto-rollback if new commit is not made in 30 to 300 sec
         """
-        rpc_command = '<Commit'
-        if label:
-            rpc_command += ' Label="%s"' % label
-        if comment:
-            rpc_command += ' Comment="%s"' % comment[:60]
-        if confirmed:
-            if 30 <= int(confirmed) <= 300:
-                rpc_command += ' Confirmed="%d"' % int(confirmed)
-            else:
-                raise InvalidInputError('confirmed needs to be between 30 and 300 seconds', self)
-        rpc_command += '/>'
+        rpc_command = build_commit(label=label, comment=comment[:60] if comment else comment, confirmed=confirmed)
+        self._commit(rpc_command)
 
-        self._execute_rpc(rpc_command)
+    def _commit(self, rpc_command):
+        """
+        Send the commit, recovering from ERROR 0x41866c00 up to commit_retries times.
+
+        The device refuses the commit when other sessions committed since this session started. The recovery opens
+        a new XML agent session and loads again only the changes loaded by this session, not the whole config.
+        """
+        delays = backoff_delays(self._COMMIT_BACKOFF, self._COMMIT_BACKOFF_MAX)
+        retries = 0
+        try:
+            while True:
+                try:
+                    self._execute_rpc(rpc_command)
+                    break
+                except CommitConflictError:
+                    self._commit_stats['conflicts'] += 1
+                    if retries >= self.commit_retries:
+                        self._commit_stats['failed'] += 1
+                        raise
+                    # the first retry is immediate, the next ones leave time to the other sessions
+                    self._recover_commit_conflict(delay=next(delays) if retries else 0)
+                    retries += 1
+                except CommitError:
+                    self._candidate_changes = []  # the buffer is empty: nothing left to replay
+                    raise
+            if retries:
+                self._commit_stats['recovered'] += 1
+            self._candidate_changes = []
+        finally:
+            self.invalidate_config_cache()
+
+    def _recover_commit_conflict(self, delay=0):
+        """Re-enter XML mode and replay the changes loaded by this session. Bounded by the current deadline."""
+        start = time.time()
+        remaining = self._remaining()
+        if remaining is not None and remaining <= delay:
+            self._commit_stats['failed'] += 1
+            raise DeadlineError('Deadline exceeded, not reloading the config after ERROR 0x41866c00!')
+        time.sleep(delay)
+        changes = self._candidate_changes
+        try:
+            self._execute_rpc('<Clear/>')  # discard candidate config
+            try:
+                # exiting from the XML mode, which also releases the config lock
+                self._send_command('exit', expect_string=self._cli_prompt, priority=PRIORITY_CONFIG)
+            except XMLCLIError:
+                pass  # because does not end with `XML>`
+            relock = self.locked and not self.lock_on_connect
+            self.locked = False
+            self._enter_xml_mode()  # re-entering XML mode, locks again with lock=True
+            if relock:
+                self.lock()
+            for rpc_command in changes:
+                self._execute_rpc(rpc_command)
+                self._commit_stats['replayed'] += 1
+                self._commit_stats['replayed_bytes'] += len(rpc_command)
+        except Exception:
+            self._commit_stats['failed'] += 1
+            raise
+        finally:
+            self._commit_stats['recovery_time'] += time.time() - start
+
+    def commit_stats(self):
+        """
+        Return the counters of the recoveries from ERROR 0x41866c00 (commits made by other sessions).
+
+        :return: dict {'conflicts': int, 'recovered': int, 'failed': int, 'replayed': requests loaded again,
+                       'replayed_bytes': int, 'recovery_time': seconds}
+        """
+        return dict(self._commit_stats)
 
     def commit_replace_config(self, label=None, comment=None, confirmed=None):
         """
@@ -604,18 +1473,8 @@ class IOSXR(object):
         :param label:     User label saved on this commit on the device
         :param confirmed: Commit with auto-rollback if new commit is not made in 30 to 300 sec
         """
-        rpc_command = '<Commit Replace="true"'
-        if label:
-            rpc_command += ' Label="%s"' % label
-        if comment:
-            rpc_command += ' Comment="%s"' % comment
-        if confirmed:
-            if 30 <= int(confirmed) <= 300:
-                rpc_command += ' Confirmed="%d"' % int(confirmed)
-            else:
-                raise InvalidInputError('confirmed needs to be between 30 and 300 seconds', self)
-        rpc_command += '/>'
-        self._execute_rpc(rpc_command)
+        rpc_command = build_commit(replace=True, label=label, comment=comment, confirmed=confirmed)
+        self._commit(rpc_command)
 
     def discard_config(self):
         """
@@ -625,6 +1484,7 @@ class IOSXR(object):
         """
         rpc_command = '<Clear/>'
         self._execute_rpc(rpc_command)
+        self._candidate_changes = []
 
     def rollback(self, rb_id=1):
         """
@@ -633,4 +1493,7 @@ class IOSXR(object):
         :param rb_id: Rollback a specific number of steps. Default: 1
         """
         rpc_command = '<Unlock/><Rollback><Previous>{rb_id}</Previous></Rollback><Lock/>'.format(rb_id=rb_id)
-        self._execute_rpc(rpc_command)
+        try:
+            self._execute_rpc(rpc_command)
+        finally:
+            self.invalidate_config_cache()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Locking primitives used to serialize the access to the XML agent and to the config of the devices."""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import os
+import re
+import time
+import random
+import tempfile
+import itertools
+from threading import Lock
+from threading import Condition
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+# request priorities, lower value is served first
+PRIORITY_CONFIG = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BULK = 2
+
+LANES = {
+    PRIORITY_CONFIG: 'config',
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_BULK: 'bulk',
+}
+
+
+class PriorityLock(object):
+
+    """
+    Lock handed over by priority, then by arrival order.
+
+    Exposes the same acquire / release / locked interface as threading.Lock, with an extra priority argument.
+    To protect the lower priority lanes against starvation, a waiter is promoted one lane
+    for every `aging` seconds spent in the queue.
+    """
+
+    def __init__(self, aging=5):
+        self.aging = aging
+        self._locked = False
+        self._waiters = []
+        self._counter = itertools.count()
+        self._condition = Condition(Lock())
+        self._stats = dict((lane, {'requests': 0, 'wait_total': 0.0, 'wait_max': 0.0}) for lane in LANES)
+
+    def _effective_priority(self, waiter, now):
+        priority, _, enqueued = waiter
+        if self.aging:
+            priority -= int((now - enqueued) / self.aging)
+        return priority
+
+    def _next_waiter(self):
+        now = time.time()
+        return min(self._waiters, key=lambda waiter: (self._effective_priority(waiter, now), waiter[1]))
+
+    def _record(self, priority, wait):
+        stats = self._stats.setdefault(priority, {'requests': 0, 'wait_total': 0.0, 'wait_max': 0.0})
+        stats['requests'] += 1
+        stats['wait_total'] += wait
+        stats['wait_max'] = max(stats['wait_max'], wait)
+
+    def acquire(self, blocking=True, timeout=None, priority=PRIORITY_INTERACTIVE):
+        """
+        Acquire the lock.
+
+        :param blocking: (bool) Wait for the lock to be released if already acquired (default: True)
+        :param timeout:  (float) Maximum number of seconds to wait, None to wait forever
+        :param priority: (int) Lane of the request, one of the PRIORITY_* constants
+        :return: True if acquired, False otherwise
+        """
+        start = time.time()
+        with self._condition:
+            if not self._locked and not self._waiters:
+                self._locked = True
+                self._record(priority, 0.0)
+                return True
+            if not blocking:
+                return False
+            waiter = (priority, next(self._counter), start)
+            self._waiters.append(waiter)
+            try:
+                while self._locked or self._next_waiter() is not waiter:
+                    if timeout is None:
+                        self._condition.wait()
+                        continue
+                    remaining = start + timeout - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self._locked = True
+                self._record(priority, time.time() - start)
+                return True
+            finally:
+                self._waiters.remove(waiter)
+                if not self._locked and self._waiters:
+                    self._condition.notify_all()  # giving up, let the others re-evaluate
+
+    __enter__ = acquire
+
+    def release(self):
+        """Release the lock and wake up the waiters."""
+        with self._condition:
+            if not self._locked:
+                raise RuntimeError('release unlocked lock')
+            self._locked = False
+            self._condition.notify_all()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def locked(self):
+        """Return True if the lock is acquired."""
+        return self._locked
+
+    def waiting(self):
+        """Return the number of requests waiting for the lock, per lane."""
+        with self._condition:
+            counts = dict((lane, 0) for lane in LANES)
+            for priority, _, _ in self._waiters:
+                counts[priority] = counts.get(priority, 0) + 1
+            return counts
+
+    def stats(self):
+        """
+        Return the wait time statistics per lane.
+
+        :return: dict {priority: {'requests': int, 'wait_total': float, 'wait_max': float}}
+        """
+        with self._condition:
+            return dict((lane, dict(stats)) for lane, stats in self._stats.items())
+
+
+def backoff_delays(initial=1, maximum=30):
+    """
+    Exponential backoff with jitter: the n-th delay is random, between half and all of min(initial * 2^n, maximum),
+    so that the clients retrying together spread out.
+    """
+    ceiling = initial
+    while True:
+        yield ceiling / 2.0 + random.uniform(0, ceiling / 2.0)
+        ceiling = min(ceiling * 2, maximum)
+
+
+class DeviceQueue(object):
+
+    """
+    Cross-process lock of one device, serializing the config jobs started from this host.
+
+    Based on a lock file per device: the waiting jobs sleep in the kernel until the holder releases the lock or exits,
+    instead of competing for the config lock of the device. The file records the process holding the lock.
+    POSIX only.
+    """
+
+    _POLL = 0.05  # seconds between attempts, when waiting with a timeout
+
+    def __init__(self, hostname, directory=None):
+        """
+        :param hostname:  (str) Device
+        :param directory: (str) Directory of the lock files, shared by the processes (default: <tmp>/pyiosxr-locks)
+        """
+        if fcntl is None:
+            raise NotImplementedError('The device queue requires fcntl.')
+        directory = directory or os.path.join(tempfile.gettempdir(), 'pyiosxr-locks')
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise  # not created by a concurrent process
+        self.path = os.path.join(directory, re.sub(r'[^\w.-]', '_', hostname) + '.lock')
+        self._file = None
+
+    def acquire(self, timeout=None):
+        """
+        Wait for the lock of the device.
+
+        :param timeout: (float) Maximum number of seconds to wait, None to wait forever
+        :return: True if acquired, False otherwise
+        """
+        if self._file is not None:
+            raise RuntimeError('DeviceQueue already acquired')
+        lock_file = open(self.path, 'a+')
+        try:
+            if timeout is None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                end = time.time() + timeout
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except (IOError, OSError):
+                        remaining = end - time.time()
+                        if remaining <= 0:
+                            lock_file.close()
+                            return False
+                        time.sleep(min(self._POLL, remaining))
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write('{pid} {since}\n'.format(pid=os.getpid(), since=time.time()))
+            lock_file.flush()
+        except Exception:
+            lock_file.close()
+            raise
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is None:
+            raise RuntimeError('release unlocked DeviceQueue')
+        lock_file, self._file = self._file, None
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.flush()
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    def locked(self):
+        """Return True if the lock is held by this object."""
+        return self._file is not None
+
+    def holder(self):
+        """
+        Return the process holding the lock, or None.
+
+        :return: dict {'pid': int, 'since': float}
+        """
+        try:
+            with open(self.path) as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    return None  # not held, the content may be left by a process which died
+                except (IOError, OSError):
+                    fields = lock_file.read().split()
+        except (IOError, OSError):
+            return None
+        if len(fields) != 2:
+            return None
+        return {'pid': int(fields[0]), 'since': float(fields[1])}
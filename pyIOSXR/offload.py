@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Offloads the parsing of XML replies and config diffs to a pool of worker processes.
+
+Meant for fleet collectors: the I/O threads fetch raw replies (make_rpc_call(..., raw=True)) and hand them over to the
+pool, which parses them, extracts the values of interest and returns compact results, using all the CPU cores.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import multiprocessing
+
+# third party lib
+from lxml import etree as ET
+from six import text_type
+from six import string_types
+
+# local modules
+from pyIOSXR.iosxr import config_diff
+
+
+def _compact(value):
+    """Convert an XPath result into plain values, cheap to send back to the parent process."""
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    if isinstance(value, string_types):
+        return text_type(value)  # drop the reference to the tree held by lxml smart strings
+    if isinstance(value, ET._Element):
+        return value.text
+    return value
+
+
+def extract(raw, xpaths):
+    """
+    Parse a raw XML reply and evaluate the XPath expressions against it.
+
+    :param raw:    (bytes) XML reply of the device
+    :param xpaths: (dict) name -> XPath expression, e.g. {'peers': '//PeerIPV4/Naming/AddressIPV4'}
+    :return: dict name -> list of values (text of the matching elements, attributes or strings),
+             or {'error': str} if the reply could not be parsed or reports errors
+    """
+    try:
+        root = ET.fromstring(raw)
+    except ET.XMLSyntaxError as xml_err:
+        return {'error': 'Unable to process the XML Response from the device: %s' % xml_err}
+    result_summary = root.find('ResultSummary')
+    if result_summary is not None and int(result_summary.get('ErrorCount', 0)) > 0:
+        messages = [el.get('ErrorMsg') for el in root.xpath('.//*[@ErrorMsg]')]
+        return {'error': '\n'.join(messages) or 'The device reported errors.'}
+    return dict((name, _compact(root.xpath(expression))) for name, expression in xpaths.items())
+
+
+def diff(running_config, merged_config):
+    """Compute the diff returned by compare_config, see pyIOSXR.iosxr.config_diff."""
+    return config_diff(running_config, merged_config)
+
+
+def _extract_star(args):
+    return extract(*args)
+
+
+class ResultProcessor(object):
+
+    """
+    Pool of worker processes parsing replies and computing diffs.
+
+    Usable as a context manager: on exit, waits for the scheduled work, or terminates the workers on error.
+    """
+
+    def __init__(self, processes=None):
+        """
+        :param processes: (int) Number of worker processes (default: number of CPUs)
+        """
+        self.processes = processes
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        return self._pool
+
+    def extract_async(self, raw, xpaths, callback=None):
+        """
+        Schedule extract(raw, xpaths) in a worker.
+
+        :param callback: (callable) Called in the parent process with the result, when ready
+        :return: multiprocessing.pool.AsyncResult
+        """
+        return self.pool.apply_async(extract, (raw, xpaths), callback=callback)
+
+    def extract(self, raw, xpaths):
+        """Execute extract(raw, xpaths) in a worker and wait for the result."""
+        return self.extract_async(raw, xpaths).get()
+
+    def imap_extract(self, raws, xpaths, chunksize=1):
+        """
+        Extract the same XPath expressions from many replies, yielding the results in order as they are ready.
+        """
+        return self.pool.imap(_extract_star, ((raw, xpaths) for raw in raws), chunksize)
+
+    def diff_async(self, running_config, merged_config, callback=None):
+        """Schedule diff(running_config, merged_config) in a worker."""
+        return self.pool.apply_async(diff, (running_config, merged_config), callback=callback)
+
+    def diff(self, running_config, merged_config):
+        """Execute diff(running_config, merged_config) in a worker and wait for the result."""
+        return self.diff_async(running_config, merged_config).get()
+
+    def close(self):
+        """Wait for the scheduled work and stop the workers."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Longest prefix match index of IPv4 prefixes, built from operational replies (IPV4Network, RIB) as they are parsed.
+
+Addresses are parsed into integers, and the prefixes hashed per length: lookups cost a few dict accesses whatever
+the size of the table, and iterating over the index yields the prefixes in address order, so two snapshots are
+compared in one pass.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+from bisect import bisect_left
+from bisect import bisect_right
+
+# third party lib
+from lxml import etree as ET
+from six import text_type
+from six import string_types
+from six import integer_types
+
+# local modules
+from pyIOSXR.exceptions import XMLCLIError
+from pyIOSXR.exceptions import InvalidXMLResponse
+
+
+# elements holding the address next to a <PrefixLength>, e.g. Detail/PrimaryAddress, Route/Prefix
+_ADDRESS_TAGS = ('Prefix', 'Address', 'PrimaryAddress', 'AddressIPV4', 'PrefixAddress', 'Network')
+
+_MISSING = object()
+
+
+def parse_address(address):
+    """
+    Convert a dotted quad IPv4 address into an integer.
+
+    :raise ValueError: if the address is not a valid IPv4 address
+    """
+    parts = address.split('.')
+    if len(parts) != 4 or not all(part.isdigit() and len(part) <= 3 for part in parts):
+        raise ValueError('Invalid IPv4 address: %r' % address)
+    a, b, c, d = [int(part) for part in parts]
+    if a > 255 or b > 255 or c > 255 or d > 255:
+        raise ValueError('Invalid IPv4 address: %r' % address)
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def format_address(value):
+    return '%d.%d.%d.%d' % (value >> 24, (value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+
+_MASKS = [(0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF for length in range(33)]  # netmask of each prefix length
+
+
+def parse_prefix(prefix):
+    """
+    Convert a prefix into (network, length), the host bits of the address being cleared.
+
+    :param prefix: 'a.b.c.d/len', 'a.b.c.d' (host route), or tuple (address, length)
+    """
+    if isinstance(prefix, tuple):
+        address, length = prefix
+    elif '/' in prefix:
+        address, length = prefix.split('/', 1)
+    else:
+        address, length = prefix, 32
+    if not isinstance(address, integer_types):
+        address = parse_address(address)
+    length = int(length)
+    if not 0 <= length <= 32:
+        raise ValueError('Invalid prefix length: %r' % (prefix, ))
+    return address & _MASKS[length], length
+
+
+def format_prefix(network, length):
+    return '%s/%d' % (format_address(network), length)
+
+
+def _key(network, length):
+    # sorts by network, then length: the prefixes within a prefix follow it
+    return (network << 6) | length
+
+
+class PrefixIndex(object):
+
+    """
+    IPv4 prefixes with a value each, indexed for longest prefix match.
+
+    Each prefix is stored once, in a dict keyed by its network and length packed into one integer. A longest prefix
+    match probes the prefix lengths present in the index, longest first: at most 33 lookups whatever the size of
+    the table. The keys are sorted once after the last change for the range queries (covered prefixes, iteration,
+    diff), the prefixes within a prefix being consecutive in that order.
+
+    Prefixes are passed as 'a.b.c.d/len' strings (or tuples (address, length)) and returned as 'a.b.c.d/len' strings.
+    """
+
+    def __init__(self, prefixes=()):
+        """
+        :param prefixes: Iterable of (prefix, value), e.g. another index
+        """
+        self._values = {}
+        self._counts = [0] * 33  # prefixes per length
+        self._lengths = []  # lengths present, longest first
+        self._sorted = None  # sorted keys, None after a change
+        for prefix, value in prefixes:
+            self.add(prefix, value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, prefix, value=None):
+        """Add the prefix, or replace its value."""
+        network, length = parse_prefix(prefix)
+        key = _key(network, length)
+        if key not in self._values:
+            self._sorted = None
+            self._counts[length] += 1
+            if self._counts[length] == 1:
+                self._lengths = [length for length in range(32, -1, -1) if self._counts[length]]
+        self._values[key] = value
+
+    def remove(self, prefix):
+        """Remove the prefix, KeyError if missing."""
+        network, length = parse_prefix(prefix)
+        del self._values[_key(network, length)]
+        self._sorted = None
+        self._counts[length] -= 1
+        if not self._counts[length]:
+            self._lengths.remove(length)
+
+    def get(self, prefix, default=None):
+        """Return the value of the prefix, exact match."""
+        return self._values.get(_key(*parse_prefix(prefix)), default)
+
+    def __contains__(self, prefix):
+        return _key(*parse_prefix(prefix)) in self._values
+
+    def lookup(self, address):
+        """
+        Longest prefix match.
+
+        :param address: IPv4 address, or prefix: the longest prefix covering it
+        :return: tuple (prefix, value), or None when no prefix covers the address
+        """
+        network, length = parse_prefix(address)
+        values = self._values
+        for candidate in self._lengths:
+            if candidate <= length:
+                value = values.get(((network & _MASKS[candidate]) << 6) | candidate, _MISSING)
+                if value is not _MISSING:
+                    return format_prefix(network & _MASKS[candidate], candidate), value
+        return None
+
+    def covering(self, prefix):
+        """Return the prefixes covering the prefix, itself included, shortest first, as (prefix, value) tuples."""
+        network, length = parse_prefix(prefix)
+        covering = []
+        for candidate in reversed(self._lengths):
+            if candidate > length:
+                break
+            value = self._values.get(_key(network & _MASKS[candidate], candidate), _MISSING)
+            if value is not _MISSING:
+                covering.append((format_prefix(network & _MASKS[candidate], candidate), value))
+        return covering
+
+    def _keys(self):
+        if self._sorted is None:
+            self._sorted = sorted(self._values)
+        return self._sorted
+
+    def covered(self, prefix):
+        """Yield the prefixes within the prefix, itself included, in address order, as (prefix, value) tuples."""
+        network, length = parse_prefix(prefix)
+        keys = self._keys()
+        last = network | (~_MASKS[length] & 0xFFFFFFFF)
+        for position in range(bisect_left(keys, _key(network, length)), bisect_right(keys, _key(last, 32))):
+            yield self._item(keys[position])
+
+    def _item(self, key):
+        return format_prefix(key >> 6, key & 63), self._values[key]
+
+    def __iter__(self):
+        """Yield all the (prefix, value) tuples in address order."""
+        for key in self._keys():
+            yield self._item(key)
+
+    def diff(self, other):
+        """
+        Compare with another snapshot, e.g. the same table retrieved later.
+
+        :return: dict {'added': [(prefix, value)], 'removed': [(prefix, value)],
+                       'changed': [(prefix, value, other value)]}, added meaning in the other index
+        """
+        result = {'added': [], 'removed': [], 'changed': []}
+        mine, theirs = self._keys(), other._keys()
+        position, other_position = 0, 0
+        while position < len(mine) or other_position < len(theirs):
+            key = mine[position] if position < len(mine) else None
+            other_key = theirs[other_position] if other_position < len(theirs) else None
+            if other_key is None or (key is not None and key < other_key):
+                result['removed'].append(self._item(key))
+                position += 1
+            elif key is None or other_key < key:
+                result['added'].append(other._item(other_key))
+                other_position += 1
+            else:
+                if self._values[key] != other._values[key]:
+                    result['changed'].append(self._item(key) + (other._values[key], ))
+                position += 1
+                other_position += 1
+        return result
+
+
+def _own_naming(element):
+    # Naming comes first: find() would also scan the table entries already parsed ahead
+    keys = element[0] if len(element[:1]) else None
+    if keys is None or keys.tag != 'Naming':
+        return None
+    return dict((key.tag, key.text) for key in keys if key.text is not None)
+
+
+class _Naming(object):
+
+    """Naming keys of an element and of its ancestors, e.g. {'InterfaceName': ..., 'VRFName': ...}"""
+
+    def __init__(self):
+        self._inherited = {}  # element -> naming keys of the element and its ancestors, the entries excluded
+
+    def __call__(self, element, cache=False):
+        parent = element.getparent()
+        inherited = self.inherited(parent) if parent is not None else {}
+        own = _own_naming(element)
+        if own:
+            naming = dict(inherited)
+            naming.update(own)  # the nearest key wins
+        else:
+            naming = inherited
+        if cache:
+            self._inherited[element] = naming
+        return naming
+
+    def inherited(self, element):
+        """Naming keys of the element and of its ancestors, cached: for the elements containing the entries."""
+        naming = self._inherited.get(element)
+        if naming is None:
+            naming = self(element, cache=True)
+        return naming
+
+    def forget(self, element):
+        self._inherited.pop(element, None)
+
+
+def index_reply(reply, value=None, vrf=None, index=None):
+    """
+    Index the IPv4 prefixes of an operational reply, parsing it incrementally.
+
+    Every element holding an address (Prefix, Address, PrimaryAddress...) and a PrefixLength is indexed,
+    e.g. the interface addresses of IPV4Network or the routes of RIB. The entries of the tables are dropped from
+    the parsed tree as soon as they are indexed, so memory depends on the number of prefixes, not on the reply size.
+
+    :param reply: Raw reply, as returned by make_rpc_call(..., raw=True), or iterable of chunks of it
+    :param value: (callable) value(element, address) -> value of the prefix, element being the entry holding the
+                  address and the PrefixLength, e.g. Route. Default: dict of the naming keys (e.g. InterfaceName,
+                  VRFName) and the address
+    :param vrf:   (str) Index only the prefixes of this VRF
+    :param index: (PrefixIndex) Add to this index, e.g. to merge several replies
+    :return: (PrefixIndex)
+    """
+    if index is None:
+        index = PrefixIndex()
+    naming = _Naming()
+    chunks = [reply] if isinstance(reply, (string_types, bytes)) else reply
+    parser = ET.XMLPullParser(events=('end', ), huge_tree=True)
+    entries = set()  # elements holding a PrefixLength, indexed once complete
+    errors = []
+    error_count = 0
+    try:
+        for chunk in chunks:
+            parser.feed(chunk.encode('utf-8') if isinstance(chunk, text_type) else chunk)
+            for _, element in parser.read_events():
+                if element.get('ErrorMsg'):
+                    errors.append(element.get('ErrorMsg'))
+                if element.tag == 'ResultSummary':
+                    error_count = int(element.get('ErrorCount', 0))
+                    continue
+                if element.tag == 'PrefixLength':
+                    entry = element.getparent()
+                    if entry.tag == 'Naming':
+                        entry = entry.getparent()  # keys of the entry, e.g. Route/Naming/Address
+                    entries.add(entry)
+                elif element in entries:
+                    entries.discard(element)
+                    _index_entry(index, element, value, vrf, naming)
+                parent = element.getparent()
+                if parent is not None and parent.tag.endswith('Table'):
+                    # table entry complete and indexed: drop it
+                    naming.forget(element)
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del parent[0]
+        parser.close()
+    except ET.XMLSyntaxError as xml_err:
+        raise InvalidXMLResponse('Unable to process the XML Response from the device: %s' % xml_err)
+    if error_count > 0:
+        raise XMLCLIError('\n'.join(errors) or 'The device reported errors.')
+    return index
+
+
+def _index_entry(index, element, value, vrf, naming):
+    candidates = [element]
+    if len(element[:1]) and element[0].tag == 'Naming':
+        candidates.append(element[0])
+    for keys in candidates:
+        texts = dict((child.tag, child.text) for child in keys)
+        length = texts.get('PrefixLength')
+        address = next((texts[tag] for tag in _ADDRESS_TAGS if texts.get(tag)), None)
+        if length is not None and address is not None:
+            break
+    else:
+        return
+    try:
+        prefix = parse_prefix((address, length))
+    except ValueError:
+        return  # e.g. IPv6
+    if vrf is not None and naming(element).get('VRFName', vrf) != vrf:
+        return
+    if value is None:
+        entry_value = dict(naming(element))
+        entry_value['address'] = address
+    else:
+        entry_value = value(element, address)
+    index.add(prefix, entry_value)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Token bucket rate limiting of the requests sent to the devices."""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import time
+from threading import Lock
+
+
+# request classes
+CLASS_SHOW = 'show'  # CLI show commands
+CLASS_GET = 'get'  # XML gets
+CLASS_CONFIG = 'config'  # everything else
+
+SCOPE_DEVICE = 'device'
+SCOPE_SITE = 'site'
+
+
+class TokenBucket(object):
+
+    """
+    Token bucket: allows `rate` requests per second on average, with bursts up to `burst` requests.
+
+    Requests exceeding the rate are not dropped: reserve() returns the time to wait before sending,
+    and the tokens are reserved right away so the waiting requests are served in order.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._locker = Lock()
+        self.requests = 0
+        self.wait_total = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """Take the tokens and return the number of seconds to wait before using them."""
+        with self._locker:
+            self._refill(time.time())
+            self._tokens -= tokens
+            wait = max(-self._tokens / self.rate, 0.0)
+            self.requests += 1
+            self.wait_total += wait
+            return wait
+
+    def delay(self):
+        """Return the number of seconds a new request would wait now."""
+        with self._locker:
+            self._refill(time.time())
+            return max((1 - self._tokens) / self.rate, 0.0)
+
+
+class RateLimiter(object):
+
+    """
+    Limits the requests per device, per site and per request class, queueing the requests over the limit.
+
+    One instance is meant to be shared by all the IOSXR objects of a fleet, so the site limits apply across devices.
+    """
+
+    def __init__(self, rates):
+        """
+        Rate limiter constructor.
+
+        :param rates: (dict) scope -> (requests per second, burst). Scopes are:
+                             - 'device': all the requests to one device
+                             - 'site': all the requests to the devices of one site
+                             - 'show', 'get', 'config': the requests of this class to one device
+                      e.g. {'device': (10, 20), 'site': (100, 100), 'show': (2, 5)}
+        """
+        self.rates = dict(rates)
+        self._buckets = {}
+        self._locker = Lock()
+
+    def _bucket(self, scope, key):
+        if scope not in self.rates:
+            return None
+        with self._locker:
+            bucket = self._buckets.get((scope, key))
+            if bucket is None:
+                rate, burst = self.rates[scope]
+                bucket = self._buckets[(scope, key)] = TokenBucket(rate, burst)
+            return bucket
+
+    def _buckets_for(self, hostname, site=None, request_class=CLASS_CONFIG):
+        buckets = [
+            self._bucket(SCOPE_DEVICE, hostname),
+            self._bucket(request_class, hostname),
+        ]
+        if site is not None:
+            buckets.append(self._bucket(SCOPE_SITE, site))
+        return [bucket for bucket in buckets if bucket is not None]
+
+    def acquire(self, hostname, site=None, request_class=CLASS_CONFIG):
+        """
+        Wait until the request is allowed by all the applicable limits.
+
+        :return: (float) Seconds waited
+        """
+        wait = max([bucket.reserve() for bucket in self._buckets_for(hostname, site, request_class)] or [0.0])
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def delay(self, hostname, site=None, request_class=CLASS_CONFIG):
+        """Return the number of seconds a new request would be throttled now."""
+        return max([bucket.delay() for bucket in self._buckets_for(hostname, site, request_class)] or [0.0])
+
+    def stats(self):
+        """
+        Return the state of the buckets.
+
+        :return: dict {(scope, key): {'rate': float, 'delay': float, 'requests': int, 'wait_total': float}}
+        """
+        with self._locker:
+            buckets = dict(self._buckets)
+        return dict(
+            (key, {'rate': bucket.rate, 'delay': bucket.delay(), 'requests': bucket.requests,
+                   'wait_total': bucket.wait_total})
+            for key, bucket in buckets.items()
+        )
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Deduplication of identical concurrent requests."""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import time
+from threading import Lock
+from threading import Event
+
+# local modules
+from pyIOSXR.exceptions import DeadlineError
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    """
+    Executes a function once for all the concurrent callers asking for the same key.
+
+    The first caller executes the function, the others wait for it and receive the same result, or the same exception.
+    With a freshness window, results are also reused by the callers arriving within `freshness` seconds after the call
+    completed.
+
+    The callers receive the same object: pass copy_result when it is mutable and the callers may modify it.
+    """
+
+    _MAX_RESULTS = 256  # expired results are pruned above this size
+
+    def __init__(self, freshness=0, copy_result=None):
+        """
+        :param freshness:   (float) Seconds a result is reused after the call completed, 0 to share only in-flight calls
+        :param copy_result: (callable) Returns the copy of the result given to each caller, None to share the result
+        """
+        self.freshness = freshness
+        self.copy_result = copy_result
+        self._calls = {}
+        self._results = {}
+        self._locker = Lock()
+        self._stats = {'calls': 0, 'shared': 0, 'fresh': 0}
+
+    def do(self, key, function, timeout=None):
+        """
+        Return the result of function(), shared with the callers of the same key.
+
+        :param key:      (hashable) Identifies identical requests
+        :param function: (callable) Executes the request, no arguments
+        :param timeout:  (float) Seconds to wait for the call of another caller, None to wait until it completes
+        """
+        with self._locker:
+            if self.freshness:
+                cached = self._results.get(key)
+                if cached is not None and time.time() - cached[0] <= self.freshness:
+                    self._stats['fresh'] += 1
+                    return self._copy(cached[1])
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['calls'] += 1
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            if not call.done.wait(max(timeout, 0) if timeout is not None else None):
+                raise DeadlineError('Waiting for the identical request in flight!')
+            if call.error is not None:
+                raise call.error
+            return self._copy(call.result)
+
+        try:
+            call.result = function()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._locker:
+                del self._calls[key]
+                if self.freshness and call.error is None:
+                    self._store(key, call.result)
+            call.done.set()
+        return self._copy(call.result)
+
+    def _copy(self, result):
+        return self.copy_result(result) if self.copy_result is not None else result
+
+    def _store(self, key, result):
+        now = time.time()
+        if len(self._results) >= self._MAX_RESULTS:
+            for stale in [k for k, (ts, _) in self._results.items() if now - ts > self.freshness]:
+                del self._results[stale]
+        self._results[key] = (now, result)
+
+    def forget(self):
+        """Drop the results kept for the freshness window."""
+        with self._locker:
+            self._results.clear()
+
+    def stats(self):
+        """
+        Return the deduplication counters.
+
+        :return: dict {'calls': executed, 'shared': joined an in-flight call, 'fresh': served from a recent result}
+        """
+        with self._locker:
+            return dict(self._stats)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Persistent store of the configs and snapshots retrieved from the devices, shared by the processes of the host.
+
+Contents are keyed by host, commit ID and kind, compressed, and deduplicated by content hash: a config which did
+not change between two commits is stored once.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+from threading import Lock
+
+# third party lib
+from six import text_type
+
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS blobs ('
+    ' hash TEXT PRIMARY KEY,'
+    ' data BLOB NOT NULL,'
+    ' size INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS snapshots ('
+    ' host TEXT NOT NULL,'
+    ' commit_id TEXT NOT NULL,'
+    ' kind TEXT NOT NULL,'
+    ' hash TEXT NOT NULL REFERENCES blobs (hash),'
+    ' created REAL NOT NULL,'
+    ' PRIMARY KEY (host, commit_id, kind))',
+    'CREATE INDEX IF NOT EXISTS snapshots_created ON snapshots (host, kind, created)',
+)
+
+
+def default_path():
+    """Location of the store: $PYIOSXR_STORE, or ~/.pyiosxr/store.sqlite"""
+    return os.environ.get('PYIOSXR_STORE') or os.path.join(os.path.expanduser('~'), '.pyiosxr', 'store.sqlite')
+
+
+class ConfigStore(object):
+
+    """
+    SQLite store of text contents, keyed by (host, commit ID, kind).
+
+    The kind tells what the content is, e.g. 'cli:' for the full running config, 'cli:ntp' for a section,
+    or any name chosen by the tools for operational snapshots. Several processes can use the same file.
+    """
+
+    def __init__(self, path=None, timeout=30):
+        """
+        Open the store, creating it if missing.
+
+        :param path:    (str) SQLite file (default: see default_path())
+        :param timeout: (int) Seconds to wait for the other processes writing to the store
+        """
+        self.path = path or default_path()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._locker = Lock()
+        self._db = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False)
+        with self._locker:
+            self._db.execute('PRAGMA journal_mode=WAL')  # readers do not block the writer
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+
+    @staticmethod
+    def content_hash(content):
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def put(self, host, commit_id, kind, content):
+        """
+        Save the content.
+
+        :return: (str) Content hash
+        """
+        if not isinstance(content, text_type):
+            content = content.decode('utf-8')
+        digest = self.content_hash(content)
+        with self._locker:
+            with self._db:
+                if self._db.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest, )).fetchone() is None:
+                    data = zlib.compress(content.encode('utf-8'))
+                    self._db.execute('INSERT OR IGNORE INTO blobs (hash, data, size) VALUES (?, ?, ?)',
+                                     (digest, sqlite3.Binary(data), len(content)))
+                self._db.execute('INSERT OR REPLACE INTO snapshots (host, commit_id, kind, hash, created) '
+                                 'VALUES (?, ?, ?, ?, ?)', (host, commit_id, kind, digest, time.time()))
+        return digest
+
+    def _load(self, query, args):
+        with self._locker:
+            row = self._db.execute(query, args).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(bytes(row[0])).decode('utf-8')
+
+    def get(self, host, commit_id, kind):
+        """Return the content saved for the commit, or None."""
+        return self._load('SELECT data FROM snapshots JOIN blobs USING (hash) '
+                          'WHERE host = ? AND commit_id = ? AND kind = ?', (host, commit_id, kind))
+
+    def latest(self, host, kind):
+        """Return the content saved last for the host, whatever the commit, or None."""
+        return self._load('SELECT data FROM snapshots JOIN blobs USING (hash) '
+                          'WHERE host = ? AND kind = ? ORDER BY created DESC LIMIT 1', (host, kind))
+
+    def history(self, host, kind):
+        """
+        Return the saved versions, most recent first.
+
+        :return: list of tuples (commit ID, content hash, created timestamp)
+        """
+        with self._locker:
+            return self._db.execute('SELECT commit_id, hash, created FROM snapshots '
+                                    'WHERE host = ? AND kind = ? ORDER BY created DESC', (host, kind)).fetchall()
+
+    def prune(self, keep=10):
+        """
+        Keep only the `keep` most recent versions of each host and kind, and drop the unreferenced contents.
+
+        :return: (int) Number of versions removed
+        """
+        with self._locker:
+            with self._db:
+                removed = self._db.execute(
+                    'DELETE FROM snapshots WHERE rowid IN ('
+                    ' SELECT s.rowid FROM snapshots s WHERE'
+                    '  (SELECT COUNT(*) FROM snapshots n'
+                    '   WHERE n.host = s.host AND n.kind = s.kind AND n.created > s.created) >= ?)', (keep, )
+                ).rowcount
+                self._db.execute('DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM snapshots)')
+        return removed
+
+    def stats(self):
+        """
+        Return the size of the store.
+
+        :return: dict {'snapshots': int, 'blobs': int, 'size': uncompressed bytes, 'stored': compressed bytes}
+        """
+        with self._locker:
+            snapshots = self._db.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0]
+            blobs, size, stored = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM blobs'
+            ).fetchone()
+        return {'snapshots': snapshots, 'blobs': blobs, 'size': size, 'stored': stored}
+
+    def close(self):
+        with self._locker:
+            self._db.close()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Transcript of the communication with the devices, written in the background.
+
+The I/O path only queues one record per exchange; a writer thread serializes the records as JSON lines,
+rotates and compresses the files. When the writer cannot keep up, records are dropped and counted
+instead of slowing down the requests.
+"""
+
+# Copyright 2015 Netflix. All rights reserved.
+# Copyright 2016 BigWaveIT. All rights reserved.
+#
+# The contents of this file are licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the
+# License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# stdlib
+import os
+import gzip
+import json
+import time
+import atexit
+import shutil
+from threading import Lock
+from threading import Thread
+
+# third party lib
+from six import text_type
+from six import string_types
+from six.moves import queue
+
+
+DIRECTION_SENT = 'sent'
+DIRECTION_RECEIVED = 'received'
+
+_STOP = object()  # tells the writer to exit
+
+_transcripts = {}  # target -> Transcript, see for_target()
+_transcripts_locker = Lock()
+
+
+def _size(payload):
+    return len(payload.encode('utf-8')) if isinstance(payload, text_type) else len(payload)
+
+
+class Transcript(object):
+
+    """
+    Asynchronous JSON Lines transcript.
+
+    Each line is a record {"ts": float, "host": str, "direction": "sent" or "received", "request_id": int or null,
+    "bytes": int, "payload": str}.
+    """
+
+    def __init__(self, target, max_pending=10000, max_bytes=None, backup_count=5, compress=False):
+        """
+        :param target:       File path, or file-like object (e.g. sys.stdout, never rotated nor closed)
+        :param max_pending:  (int) Records buffered for the writer, the newer records are dropped above
+        :param max_bytes:    (int) Rotate the file when it reaches this size, None to never rotate
+        :param backup_count: (int) Rotated files kept: <path>.1 (the most recent) to <path>.<backup_count>
+        :param compress:     (bool) Compress the rotated files with gzip: <path>.1.gz etc.
+        """
+        self.path = target if isinstance(target, string_types) else None
+        self.max_bytes = max_bytes if self.path else None
+        self.backup_count = backup_count
+        self.compress = compress
+        self._file = open(self.path, 'a') if self.path else target
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._stats = {'written': 0, 'dropped': 0, 'rotated': 0, 'errors': 0}
+        self._dropped_locker = Lock()
+        self._writer = Thread(target=self._write_loop, name='pyIOSXR-transcript')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def record(self, host, direction, payload, request_id=None):
+        """Queue one record, without waiting: dropped if the buffer is full."""
+        try:
+            self._pending.put_nowait((time.time(), host, direction, request_id, payload))
+        except queue.Full:
+            with self._dropped_locker:
+                self._stats['dropped'] += 1
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            try:
+                if item is _STOP:
+                    self._file.flush()
+                    return
+                self._write(item)
+                if self._pending.empty():
+                    self._file.flush()
+            except Exception:  # e.g. disk full: keep draining the queue, the I/O path must not block
+                self._stats['errors'] += 1
+            finally:
+                self._pending.task_done()
+
+    def _write(self, item):
+        ts, host, direction, request_id, payload = item
+        self._file.write(json.dumps({'ts': ts, 'host': host, 'direction': direction, 'request_id': request_id,
+                                     'bytes': _size(payload), 'payload': payload}, sort_keys=True) + '\n')
+        self._stats['written'] += 1
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotated_name(self, index):
+        return '{path}.{index}{ext}'.format(path=self.path, index=index, ext='.gz' if self.compress else '')
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(self._rotated_name(index)):
+                os.rename(self._rotated_name(index), self._rotated_name(index + 1))
+        if self.backup_count < 1:
+            os.remove(self.path)
+        elif self.compress:
+            with open(self.path, 'rb') as source:
+                with gzip.open(self._rotated_name(1), 'wb') as destination:
+                    shutil.copyfileobj(source, destination)
+            os.remove(self.path)
+        else:
+            os.rename(self.path, self._rotated_name(1))
+        self._file = open(self.path, 'a')
+        self._stats['rotated'] += 1
+
+    def flush(self):
+        """Wait until the queued records are written, or the writer stopped."""
+        with self._pending.all_tasks_done:
+            # join() would wait forever for the records queued once the writer stopped, e.g. at exit
+            while self._pending.unfinished_tasks and self._writer.is_alive():
+                self._pending.all_tasks_done.wait(.1)
+        if not getattr(self._file, 'closed', False):
+            self._file.flush()
+
+    def close(self):
+        """Write the queued records and stop the writer. Closes the file when opened by the transcript."""
+        if not self._writer.is_alive():
+            return
+        self._pending.put(_STOP)
+        self._writer.join()
+        if self.path:
+            self._file.close()
+
+    def stats(self):
+        """
+        Return the transcript counters.
+
+        :return: dict {'written': int, 'dropped': int, 'rotated': int, 'errors': int, 'pending': int}
+        """
+        stats = dict(self._stats)
+        stats['pending'] = self._pending.qsize()
+        return stats
+
+
+def for_target(target):
+    """
+    Return the transcript writing to the target, shared by all the devices logging to the same file.
+
+    :param target: File path, file-like object, or Transcript (returned as is)
+    """
+    if target is None or isinstance(target, Transcript):
+        return target
+    key = os.path.abspath(target) if isinstance(target, string_types) else id(target)
+    with _transcripts_locker:
+        transcript = _transcripts.get(key)
+        if transcript is None:
+            transcript = _transcripts[key] = Transcript(target)
+        return transcript
+
+
+@atexit.register
+def _close_all():
+    with _transcripts_locker:
+        for transcript in _transcripts.values():
+            transcript.close()
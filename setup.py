@@ -38,5 +38,10 @@ setup(
     url='https://github.com/fooelisa/pyiosxr/',
     download_url='https://github.com/fooelisa/pyiosxr/tarball/%s' % version,
     keywords=['IOS-XR', 'IOSXR', 'Cisco', 'networking'],
+    entry_points={
+        'console_scripts': [
+            'pyiosxr=pyIOSXR.cli:main',
+        ],
+    },
     classifiers=[],
 )
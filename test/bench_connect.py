@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Benchmark of the connect sequence: open() with and without fast_connect.
+
+Against a simulated device, with configurable latencies (default):
+
+    python test/bench_connect.py --rtt 0.05 --rounds 20
+
+Against a real device:
+
+    python test/bench_connect.py --host edge01.bjm01 --username admin --rounds 5
+"""
+
+# stdlib
+import os
+import sys
+import time
+import getpass
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# local modules
+from pyIOSXR import IOSXR  # noqa
+
+
+class _SimulatedNetMikoDevice(object):
+
+    """
+    Simulates the timing of netmiko against a device answering after `rtt` seconds.
+
+    Like netmiko, send_command_timing returns only after the output stayed quiet for `quiet` seconds.
+    """
+
+    PROMPT = 'RP/0/RSP0/CPU0:edge01.yyz01#'
+
+    def __init__(self, rtt, quiet):
+        self.rtt = rtt
+        self.quiet = quiet
+        self._ready = []  # (time available, data)
+
+        class _Transport(object):
+            def close(self):
+                pass
+
+            def is_active(self):
+                return True
+        self.remote_conn = _Transport()
+
+    def _reply(self, command):
+        if command == 'xml':
+            return self.PROMPT + 'xml\nXML> '
+        return ('<?xml version="1.0" encoding="UTF-8"?><Response MajorVersion="1" MinorVersion="0">'
+                '<Lock/><ResultSummary ErrorCount="0"/></Response>\nXML> ')
+
+    def find_prompt(self):
+        time.sleep(self.rtt + self.quiet)
+        return self.PROMPT
+
+    def send_command_timing(self, command_string, **kwargs):
+        time.sleep(self.rtt + self.quiet)
+        return self._reply(command_string.strip())
+
+    def send_command_expect(self, command_string, **kwargs):
+        time.sleep(self.rtt)
+        return self._reply(command_string.strip())
+
+    def write_channel(self, out_data):
+        available = time.time() + self.rtt
+        for command in out_data.splitlines():
+            self._ready.append((available, self._reply(command)))
+
+    def read_channel(self):
+        now = time.time()
+        output = ''
+        while self._ready and self._ready[0][0] <= now:
+            output += self._ready.pop(0)[1]
+        return output
+
+
+def _simulated_device_class(rtt, quiet):
+
+    class _SimulatedIOSXR(IOSXR):
+        def _connect(self):
+            time.sleep(rtt * 3)  # SSH handshake and authentication
+            self.device = _SimulatedNetMikoDevice(rtt, quiet)
+            self._xml_agent_alive = True
+            self._cli_prompt = self._find_prompt()
+            self._enter_xml_mode()
+
+    return _SimulatedIOSXR
+
+
+def measure(device_class, rounds, **kwargs):
+    latencies = []
+    for _ in range(rounds):
+        device = device_class(**kwargs)
+        start = time.time()
+        device.open()
+        latencies.append(time.time() - start)
+        device.close()
+    latencies.sort()
+    return {
+        'mean': sum(latencies) / len(latencies),
+        'p50': latencies[len(latencies) // 2],
+        'max': latencies[-1],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the latency of open(), with and without fast_connect.')
+    parser.add_argument('--host', help='real device, simulated if not specified')
+    parser.add_argument('--username', default=getpass.getuser())
+    parser.add_argument('--port', type=int, default=22)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--rtt', type=float, default=0.05, help='simulated round trip time, in seconds')
+    parser.add_argument('--quiet', type=float, default=0.5,
+                        help='simulated idle time netmiko waits for with send_command_timing, in seconds')
+    args = parser.parse_args(argv)
+
+    if args.host:
+        device_class = IOSXR
+        kwargs = {'hostname': args.host, 'username': args.username, 'port': args.port,
+                  'password': os.environ.get('PYIOSXR_PASSWORD') or getpass.getpass('Password: ')}
+    else:
+        device_class = _simulated_device_class(args.rtt, args.quiet)
+        kwargs = {'hostname': 'simulated', 'username': 'admin', 'password': 'admin'}
+
+    for label, options in (('default', {'fast_connect': False}), ('fast_connect', {'fast_connect': True})):
+        options.update(kwargs)
+        result = measure(device_class, args.rounds, lock=True, **options)
+        print('{label:>13}: mean {mean:.3f}s  p50 {p50:.3f}s  max {max:.3f}s'.format(label=label, **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,16 @@
 """Unit tests for pyiosxr, a module to interact with Cisco devices running IOS-XR."""
 
 import os
-import sys
+import gzip
+import json
 import time
+import shutil
+import tempfile
 import unittest
+import threading
+from collections import OrderedDict
 from lxml import etree as ET
+from six import StringIO
 from six import binary_type
 
 # ~~~ import pyIOSXR modules ~~~
@@ -17,13 +23,56 @@ from pyIOSXR.exceptions import LockError
 from pyIOSXR.exceptions import UnlockError
 from pyIOSXR.exceptions import XMLCLIError
 from pyIOSXR.exceptions import CommitError
+from pyIOSXR.exceptions import CommitConflictError
+from pyIOSXR.exceptions import CircuitOpenError
 from pyIOSXR.exceptions import ConnectError
 from pyIOSXR.exceptions import TimeoutError
+from pyIOSXR.exceptions import DeadlineError
 from pyIOSXR.exceptions import IteratorIDError
 from pyIOSXR.exceptions import InvalidInputError
 from pyIOSXR.exceptions import CompareConfigError
 from pyIOSXR.exceptions import InvalidXMLResponse
 
+from pyIOSXR.builder import wrap_request
+from pyIOSXR.builder import build_commit
+from pyIOSXR.builder import build_get_config
+from pyIOSXR.builder import build_set_config
+from pyIOSXR.builder import build_delete_config
+from pyIOSXR.breaker import CircuitBreaker
+from pyIOSXR.broker import Broker
+from pyIOSXR.broker import BrokerClient
+from pyIOSXR.cli import execute
+from pyIOSXR.cli import build_parser
+from pyIOSXR.cli import parse_inventory
+from pyIOSXR.singleflight import SingleFlight
+from pyIOSXR.offload import ResultProcessor
+from pyIOSXR.ratelimit import TokenBucket
+from pyIOSXR.ratelimit import RateLimiter
+from pyIOSXR.audit import Rule
+from pyIOSXR.audit import AuditEngine
+from pyIOSXR.audit import audit
+from pyIOSXR.store import ConfigStore
+from pyIOSXR.transcript import Transcript
+from pyIOSXR.commitqueue import CommitQueue
+from pyIOSXR.config import ConfigTree
+from pyIOSXR.corpus import ConfigCorpus
+from pyIOSXR.config import merge_config
+from pyIOSXR.config import simulate_compare_config
+from pyIOSXR.diff import iter_config_diff
+from pyIOSXR.columnar import Field
+from pyIOSXR.columnar import TableSchema
+from pyIOSXR.columnar import ARP_TABLE
+from pyIOSXR.columnar import ROUTE_TABLE
+from pyIOSXR.columnar import decode_table
+from pyIOSXR.prefixindex import PrefixIndex
+from pyIOSXR.prefixindex import index_reply
+from pyIOSXR.iosxr import config_diff
+from pyIOSXR.locking import DeviceQueue
+from pyIOSXR.locking import PriorityLock
+from pyIOSXR.locking import PRIORITY_BULK
+from pyIOSXR.locking import PRIORITY_CONFIG
+from pyIOSXR.locking import PRIORITY_INTERACTIVE
+
 
 class _MockedNetMikoDevice(object):
 
@@ -37,6 +86,19 @@ class _MockedNetMikoDevice(object):
             def close(self):
                 pass
         self.remote_conn = _MockedParamikoTransport()
+        self._channel = ''
+        self._xml_sessions = 0
+        self._conflicts = {}  # commit -> XML session which got ERROR 0x41866c00
+
+    def _reply(self, command):
+        if command.strip() == 'xml':
+            self._xml_sessions += 1
+        reply = self.get_mock_file(command)
+        if '0x41866c00' in reply:
+            # the other commits are seen by the next XML session, where the commit succeeds
+            if self._conflicts.setdefault(command, self._xml_sessions) != self._xml_sessions:
+                reply = self.get_mock_file('<Commit/>')
+        return reply
 
     @staticmethod
     def get_mock_file(command, format='xml'):
@@ -72,10 +134,18 @@ class _MockedNetMikoDevice(object):
                      max_loops=150,
                      strip_prompt=True,
                      strip_command=True):
-        return self.get_mock_file(command_string)
+        return self._reply(command_string)
 
     def send_command_timing(self, command_string, **kvargs):
-        return self.get_mock_file(command_string)
+        return self._reply(command_string)
+
+    def write_channel(self, out_data):
+        for command in out_data.splitlines():
+            self._channel += self._reply(command)
+
+    def read_channel(self):
+        output, self._channel = self._channel, ''
+        return output
 
     def receive_data_generator(self):
         return ['', '']  # to have an iteration inside private method _netmiko_recv
@@ -99,9 +169,11 @@ class _MockedIOSXRDevice(IOSXR):
     Overrides only the very basic methods from the main device driver, that cannot be mocked.
     """
 
-    def open(self):
+    def _connect(self):
         self.device = _MockedNetMikoDevice()
-        self._cli_prompt = self.device.find_prompt()
+        self._xml_agent_alive = True
+        self._xml_agent_dirty = False
+        self._cli_prompt = self._find_prompt()
         self._enter_xml_mode()
 
     def is_alive(self):
@@ -120,7 +192,7 @@ class TestIOSXRDevice(unittest.TestCase):
     PORT = 12205
     TIMEOUT = .1  # for tests, smaller values are prefferred
     LOCK = False
-    LOG = sys.stdout
+    LOG = StringIO()  # transcript, use sys.stdout to watch it
     MOCK = True
 
     def __repr__(self):
@@ -278,7 +350,7 @@ class TestIOSXRDevice(unittest.TestCase):
 
     def test_acquired_xml_agent(self):
 
-        """Testing if raises TimeoutError if the XML agent is alredy acquired and released when exception thrown"""
+        """Testing if raises TimeoutError if the XML agent is alredy acquired, leaving it to its owner"""
 
         self.device._lock_xml_agent(time.time())  # acquiring the XML agent
 
@@ -288,7 +360,8 @@ class TestIOSXRDevice(unittest.TestCase):
             '<Get><Operational><SystemTime/><PlatformInventory/></Operational></Get>'
         )
 
-        self.assertFalse(self.device._xml_agent_locker.locked())  # Exception raised => xml agent released
+        self.assertTrue(self.device._xml_agent_locker.locked())  # still held by the request in flight
+        self.device._unlock_xml_agent()
 
     def test_try_to_read_till_timeout(self):
 
@@ -468,6 +541,30 @@ class TestIOSXRDevice(unittest.TestCase):
 
             same_device.close()
 
+    def test_lock_wait_retries_and_reports_holder(self):
+
+        """Testing if lock(wait) retries with backoff until the deadline, then reports the lock holder"""
+
+        if not self.MOCK:
+            return
+        attempts = []
+        execute_rpc = self.device._execute_rpc
+        self.device._execute_rpc = lambda rpc, **kwargs: attempts.append(rpc) or execute_rpc(rpc, **kwargs)
+        self.device._LOCK_BACKOFF = .05
+        start = time.time()
+        try:
+            with self.assertRaises(LockError) as context:
+                self.device.lock(wait=.5)
+        finally:
+            del self.device._execute_rpc
+            del self.device._LOCK_BACKOFF
+        self.assertGreaterEqual(time.time() - start, .5)
+        self.assertLess(time.time() - start, 5)
+        self.assertGreater(attempts.count('<Lock/>'), 2)
+        self.assertFalse(self.device.locked)
+        self.assertEqual(context.exception.holder['user'], 'cisco')
+        self.assertIn('Locked by cisco on vty1', str(context.exception))
+
     def test_unlock(self):
 
         """Testing unlock feature"""
@@ -687,6 +784,56 @@ class TestIOSXRDevice(unittest.TestCase):
             self.device.close()
             self.device.open()
 
+    def test_commit_conflict_replays_session_changes(self):
+
+        """Testing if the recovery from ERROR 0x41866c00 loads again only the changes of the session"""
+
+        if not self.MOCK:
+            return
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        device.load_candidate_config(config='ntp peer 172.17.17.1')
+        sent = []
+        send_command = device._send_command
+        device._send_command = lambda command, **kwargs: sent.append(command) or send_command(command, **kwargs)
+        device.commit_config(comment='parallel')
+        requests = [wrap_request(rpc) for rpc in ('<Commit Comment="parallel"/>', '<Clear/>')]
+        self.assertEqual(sent[:3], requests + ['exit'])
+        self.assertEqual(sent[3:], [wrap_request('<CLI><Configuration>ntp peer 172.17.17.1</Configuration></CLI>'),
+                                    requests[0]])
+        stats = device.commit_stats()
+        self.assertEqual((stats['conflicts'], stats['recovered'], stats['failed'], stats['replayed']), (1, 1, 0, 1))
+        self.assertEqual(device._candidate_changes, [])
+        device.close()
+
+    def test_commit_conflict_without_retries(self):
+
+        """Testing if ERROR 0x41866c00 is raised when the commit retries are disabled"""
+
+        if not self.MOCK:
+            return
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, commit_retries=0)
+        device.open()
+        self.assertRaises(CommitConflictError, device.commit_config, comment='parallel')
+        self.assertEqual(device.commit_stats()['failed'], 1)
+        device.close()
+
+    def test_session_changes_dropped_with_candidate_config(self):
+
+        """Testing if the recorded changes are dropped when the candidate config is gone"""
+
+        if not self.MOCK:
+            return
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        device._candidate_changes = ['<Set>old</Set>']
+        self.assertRaises(CommitError, device.commit_config, comment='empty')
+        self.assertEqual(device._candidate_changes, [])
+        device._candidate_changes = ['<Set>old</Set>']
+        device._reconnect()
+        self.assertEqual(device._candidate_changes, [])
+        device.close()
+
     def _prefetch_running_config_and_append(self):
 
         """Helper method to be used in the config-replace tests below"""
@@ -745,5 +892,1931 @@ class TestIOSXRDevice(unittest.TestCase):
             confirmed=500
         )
 
+    def test_set_config(self):
+
+        """Testing native XML Set operation"""
+
+        peer = OrderedDict([('Naming', {'AddressIPV4': '172.17.17.1'}),
+                            ('PeerTypeIPV4', OrderedDict([('Naming', {'PeerType': 'Peer'}), ('Enable', None)]))])
+        self.assertIsNone(self.device.set_config(
+            ('NTP', ),
+            {'PeerVRFTable': {'PeerVRF': OrderedDict([('Naming', {'VRFName': 'default'}),
+                                                      ('PeerIPV4Table', {'PeerIPV4': peer})])}}
+        ))
+        self.device.discard_config()
+
+    def test_set_invalid_config_raises_XMLCLIError(self):
+
+        """Testing if a native XML Set operation with an unknown element raises XMLCLIError"""
+
+        self.assertRaises(
+            XMLCLIError,
+            self.device.set_config,
+            'NTP',
+            {'Fake': True}
+        )
+
+    def test_delete_config(self):
+
+        """Testing native XML Delete operation"""
+
+        self.assertIsNone(self.device.delete_config(('NTP', ), {'UpdateCalendar': None}))
+        self.device.discard_config()
+
+    def test_get_config(self):
+
+        """Testing native XML Get operation"""
+
+        config = self.device.get_config(('NTP', ))
+        self.assertEqual(config.tag, 'Configuration')
+        self.assertEqual(config.find('NTP/UpdateCalendar').text, 'true')
+
+    def test_get_running_config_section(self):
+
+        """Testing retrieval of a running config section"""
+
+        self.device.invalidate_config_cache()
+        section = self.device.get_running_config_section('ntp')
+        self.assertTrue(section.startswith('ntp\n server 172.17.17.1'))
+
+    def test_running_config_section_cached_until_commit(self):
+
+        """Testing if running config sections are cached until the next commit"""
+
+        self.device.invalidate_config_cache()
+        calls = []
+        execute_show = self.device._execute_show
+        self.device._execute_show = lambda *args, **kwargs: calls.append(args) or execute_show(*args, **kwargs)
+        try:
+            self.device.get_running_config_section('ntp')
+            self.device.get_running_config_section('ntp')
+            self.assertEqual(len(calls), 1)
+            self._load_dummy_config()
+            self.device.commit_config()
+            self.device.get_running_config_section('ntp')
+            self.assertEqual(len(calls), 2)
+            self.device.get_running_config_section('ntp', refresh=True)
+            self.assertEqual(len(calls), 3)
+        finally:
+            del self.device._execute_show
+        self.device.rollback()
+
+    def test_get_running_config_subtree(self):
+
+        """Testing retrieval of a running config subtree through the XML API"""
+
+        self.device.invalidate_config_cache()
+        subtree = self.device.get_running_config_subtree(('NTP', ))
+        self.assertEqual(subtree.find('NTP/UpdateCalendar').text, 'true')
+        subtree.remove(subtree.find('NTP'))  # changing the copy does not change the cache
+        self.assertIsNotNone(self.device.get_running_config_subtree(('NTP', )).find('NTP'))
+
+
+class TestRequestBuilder(unittest.TestCase):
+
+    """
+    Tests the XML request builder.
+    """
+
+    def test_build_get_config(self):
+
+        """Testing the Get requests"""
+
+        self.assertEqual(build_get_config(('NTP', )), '<Get><Configuration><NTP></NTP></Configuration></Get>')
+        self.assertEqual(
+            build_get_config(('InterfaceConfigurationTable', ), {'InterfaceConfiguration': None}, 'CurrentConfig'),
+            '<Get><Configuration Source="CurrentConfig"><InterfaceConfigurationTable><InterfaceConfiguration/>'
+            '</InterfaceConfigurationTable></Configuration></Get>'
+        )
+
+    def test_build_set_config_escapes_values(self):
+
+        """Testing if the values are escaped"""
+
+        self.assertEqual(
+            build_set_config(('InterfaceConfigurationTable', 'InterfaceConfiguration'),
+                             OrderedDict([('Description', 'R&D <core>'), ('Shutdown', False), ('MTU', [1500, 9000])])),
+            '<Set><Configuration><InterfaceConfigurationTable><InterfaceConfiguration>'
+            '<Description>R&amp;D &lt;core&gt;</Description><Shutdown>false</Shutdown><MTU>1500</MTU><MTU>9000</MTU>'
+            '</InterfaceConfiguration></InterfaceConfigurationTable></Configuration></Set>'
+        )
+
+    def test_build_invalid_requests_raise_InvalidInputError(self):
+
+        """Testing if invalid requests raise InvalidInputError"""
+
+        self.assertRaises(InvalidInputError, build_set_config, ('NTP', ), {})
+        self.assertRaises(InvalidInputError, build_set_config, ('NTP><Fake', ), {'A': 1})
+        self.assertRaises(InvalidInputError, build_delete_config, ())
+        self.assertRaises(InvalidInputError, build_get_config, ('NTP', ), source='Fake')
+
+    def test_build_commit_escapes_attributes(self):
+
+        """Testing if commit label and comment are escaped"""
+
+        self.assertEqual(build_commit(replace=True, label='test', comment='a "quoted" <comment>', confirmed=60),
+                         '<Commit Replace="true" Label="test" Comment="a &quot;quoted&quot; &lt;comment&gt;" '
+                         'Confirmed="60"/>')
+        self.assertEqual(build_commit(label=1234, comment=u'change to caf\xe9 <uplink>'),
+                         u'<Commit Label="1234" Comment="change to caf\xe9 &lt;uplink&gt;"/>')
+
+
+class TestIOSXRReadSessions(unittest.TestCase):
+
+    """
+    Tests spreading read-only requests across multiple XML agent sessions.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, sessions=3)
+        cls.device.open()
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.device.close()
+
+    def test_read_sessions_opened(self):
+
+        """Testing if the additional sessions are opened"""
+
+        self.assertEqual(len(self.device._read_sessions), 2)
+
+    def test_config_requests_pinned_to_main_session(self):
+
+        """Testing if config requests are executed on the main session"""
+
+        for rpc in ('<Lock/>',
+                    '<Commit/>',
+                    '<CLI><Configuration>show configuration merge</Configuration></CLI>',
+                    '<Get><Configuration><NTP></NTP></Configuration></Get>',
+                    '<CLI><Exec>show run</Exec></CLI><CLI><Configuration>ntp</Configuration></CLI>'):
+            self.assertIs(self.device._select_session(rpc), self.device)
+
+    def test_read_requests_spread_across_sessions(self):
+
+        """Testing if read-only requests are spread across the read sessions"""
+
+        rpc = '<Get><Operational><SystemTime/></Operational></Get>'
+        first = self.device._select_session(rpc)
+        second = self.device._select_session(rpc)
+        self.assertIn(first, self.device._read_sessions)
+        self.assertIn(second, self.device._read_sessions)
+        self.assertIsNot(first, second)
+
+    def _limited_device_class(self, fail):
+        """Device class whose sessions after the second one fail to enter XML mode with `fail(netmiko_device)`"""
+        opened = []
+        closed = []
+
+        class _LimitedIOSXRDevice(_MockedIOSXRDevice):
+            def _connect(self):
+                opened.append(self)
+                if len(opened) <= 2:
+                    super(_LimitedIOSXRDevice, self)._connect()
+                else:
+                    self._refused_connect()
+
+            def _refused_connect(self):
+                self.device = _MockedNetMikoDevice()
+                self.device.remote_conn.close = lambda: closed.append(self)
+                self._cli_prompt = self._find_prompt()
+                self.device.send_command_timing = lambda command_string, **kwargs: fail(self)
+                self._enter_xml_mode()
+
+        return _LimitedIOSXRDevice, closed
+
+    def test_refused_session_stops_opening(self):
+
+        """Testing if the sessions refused by the XML agent are closed and not used"""
+
+        def _refused(session):
+            return 'ERROR: 0xa367a600 maximum number of sessions reached\n' + session._cli_prompt
+
+        device_class, closed = self._limited_device_class(_refused)
+        device = device_class('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, sessions=4)
+        device.open()
+        self.assertEqual(len(device._read_sessions), 1)
+        self.assertEqual(len(closed), 1)
+        device.close()
+
+    def test_failed_session_closes_the_others(self):
+
+        """Testing if an unexpected error while opening the sessions closes the sessions already opened"""
+
+        def _broken(session):
+            raise IOError('Socket is closed')
+
+        device_class, closed = self._limited_device_class(_broken)
+        device = device_class('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, sessions=4)
+        self.assertRaises(IOError, device.open)
+        self.assertEqual(len(closed), 1)
+        self.assertEqual(device._read_sessions, [])
+
+    def test_busy_read_session_skipped(self):
+
+        """Testing if a busy read session is skipped"""
+
+        busy, idle = self.device._read_sessions
+        busy._lock_xml_agent()
+        try:
+            for _ in range(2):
+                self.assertIs(self.device._select_session('<CLI><Exec>show ntp ass</Exec></CLI>'), idle)
+        finally:
+            busy._unlock_xml_agent()
+
+    def test_show_on_read_session(self):
+
+        """Testing show commands through the read sessions"""
+
+        self.assertIsInstance(self.device.show_ntp_ass(), str)
+
+
+class TestPriorityLock(unittest.TestCase):
+
+    """
+    Tests the priority lanes in front of the XML agent.
+    """
+
+    def _queue(self, lock, priorities, served):
+
+        """Helper that queues one waiter per priority, in order, while the lock is held."""
+
+        threads = []
+        for priority in priorities:
+            def _wait(priority=priority):
+                lock.acquire(priority=priority)
+                served.append(priority)
+                lock.release()
+            thread = threading.Thread(target=_wait)
+            thread.start()
+            while sum(lock.waiting().values()) < len(threads) + 1:
+                time.sleep(.001)
+            threads.append(thread)
+        return threads
+
+    def test_config_lane_served_first(self):
+
+        """Testing if config requests jump ahead of bulk requests"""
+
+        lock = PriorityLock(aging=None)
+        served = []
+        lock.acquire()
+        threads = self._queue(lock, [PRIORITY_BULK, PRIORITY_BULK, PRIORITY_CONFIG], served)
+        lock.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(served, [PRIORITY_CONFIG, PRIORITY_BULK, PRIORITY_BULK])
+
+    def test_aging_prevents_starvation(self):
+
+        """Testing if a long waiting bulk request is promoted"""
+
+        lock = PriorityLock(aging=.05)
+        served = []
+        lock.acquire()
+        threads = self._queue(lock, [PRIORITY_BULK], served)
+        time.sleep(.15)
+        threads += self._queue(lock, [PRIORITY_CONFIG], served)
+        lock.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(served, [PRIORITY_BULK, PRIORITY_CONFIG])
+
+    def test_timeout(self):
+
+        """Testing if acquire gives up after timeout"""
+
+        lock = PriorityLock()
+        lock.acquire()
+        self.assertFalse(lock.acquire(timeout=.01, priority=PRIORITY_CONFIG))
+        self.assertFalse(lock.acquire(False))
+        lock.release()
+        self.assertFalse(lock.locked())
+
+    def test_lane_stats(self):
+
+        """Testing the wait time statistics per lane"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        device.show_ntp_ass(priority=PRIORITY_BULK)
+        stats = device.lane_stats()
+        self.assertEqual(stats[PRIORITY_BULK]['requests'], 1)
+        self.assertGreaterEqual(stats[PRIORITY_CONFIG]['requests'], 1)  # entering XML mode
+        device.close()
+
+    def test_default_lane_by_operation(self):
+
+        """Testing if the reads use the interactive lane by default, config show commands included"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        self.assertEqual(device._default_priority('<CLI><Configuration>show running-config</Configuration></CLI>'),
+                         PRIORITY_INTERACTIVE)
+        self.assertEqual(device._default_priority('<Get><Configuration><NTP/></Configuration></Get>'),
+                         PRIORITY_INTERACTIVE)
+        self.assertEqual(device._default_priority('<CLI><Configuration>ntp peer 1.1.1.1</Configuration></CLI>'),
+                         PRIORITY_CONFIG)
+        self.assertEqual(device._default_priority('<Commit/>'), PRIORITY_CONFIG)
+        device.open()
+        device.get_running_config(priority=PRIORITY_BULK)
+        self.assertEqual(device.lane_stats()[PRIORITY_BULK]['requests'], 1)
+        device.close()
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    """
+    Tests the deduplication of identical concurrent reads.
+    """
+
+    def _concurrent(self, function, count):
+
+        """Helper running function in count threads at once."""
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(function())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_shared(self):
+
+        """Testing if concurrent identical calls execute once"""
+
+        group = SingleFlight()
+        executed = []
+
+        def _slow():
+            executed.append(True)
+            time.sleep(.1)
+            return 'reply'
+
+        results = self._concurrent(lambda: group.do('key', _slow), 5)
+        self.assertEqual(results, ['reply'] * 5)
+        self.assertEqual(len(executed), 1)
+        self.assertEqual(group.stats(), {'calls': 1, 'shared': 4, 'fresh': 0})
+
+    def test_errors_shared(self):
+
+        """Testing if the waiting callers receive the exception"""
+
+        group = SingleFlight()
+        errors = []
+
+        def _fail():
+            time.sleep(.05)
+            raise XMLCLIError('failed')
+
+        def _call():
+            try:
+                group.do('key', _fail)
+            except XMLCLIError as err:
+                errors.append(err)
+
+        self._concurrent(_call, 3)
+        self.assertEqual(len(errors), 3)
+
+    def test_freshness_window(self):
+
+        """Testing if recent results are reused within the freshness window only"""
+
+        group = SingleFlight(freshness=.05)
+        counter = []
+        group.do('key', lambda: counter.append(1))
+        group.do('key', lambda: counter.append(1))
+        self.assertEqual(len(counter), 1)
+        time.sleep(.06)
+        group.do('key', lambda: counter.append(1))
+        self.assertEqual(len(counter), 2)
+
+    def test_device_dedups_reads_only(self):
+
+        """Testing if the device deduplicates read requests but never config requests"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, dedup_reads=10)
+        device.open()
+        device.show_ntp_ass()
+        device.show_ntp_ass()
+        device._execute_config_show('show run ntp')
+        device._execute_config_show('show run ntp')
+        self.assertEqual(device.dedup_stats(), {'calls': 1, 'shared': 0, 'fresh': 1})
+        device.close()
+
+    def test_shared_replies_are_copies(self):
+
+        """Testing if each caller of a deduplicated read gets its own copy of the XML reply"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, dedup_reads=10)
+        device.open()
+        rpc = '<CLI><Exec>show ntp ass</Exec></CLI>'
+        first = device._execute_rpc(rpc)
+        first.clear()
+        second = device._execute_rpc(rpc)
+        self.assertEqual(device.dedup_stats()['fresh'], 1)
+        self.assertIsNot(first, second)
+        self.assertTrue(len(second))
+        device.close()
+
+
+class TestResultProcessor(unittest.TestCase):
+
+    """
+    Tests offloading the processing of the replies to worker processes.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        cls.device.open()
+        cls.processor = ResultProcessor(processes=2)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.processor.close()
+        cls.device.close()
+
+    def test_raw_rpc_call(self):
+
+        """Testing if make_rpc_call returns the raw reply"""
+
+        raw = self.device.make_rpc_call('<Get><Configuration><NTP></NTP></Configuration></Get>', raw=True)
+        self.assertIsInstance(raw, binary_type)
+        self.assertTrue(raw.startswith(b'<?xml'))
+
+    def test_extract(self):
+
+        """Testing XPath extraction in the workers"""
+
+        raw = self.device.make_rpc_call('<Get><Configuration><NTP></NTP></Configuration></Get>', raw=True)
+        result = self.processor.extract(raw, {'peers': '//PeerIPV4/Naming/AddressIPV4',
+                                              'count': 'count(//PeerIPV4)',
+                                              'source': '//SourceInterface/text()'})
+        self.assertEqual(result, {'peers': ['172.17.17.1', '172.17.17.2', '192.168.0.1', '192.168.0.2'],
+                                  'count': 4.0,
+                                  'source': ['Loopback0']})
+
+    def test_imap_extract_reports_errors(self):
+
+        """Testing if invalid replies are reported in the results"""
+
+        results = list(self.processor.imap_extract([b'<Response><Truncated', b'<Response/>'], {'all': '/*'}))
+        self.assertIn('error', results[0])
+        self.assertEqual(results[1], {'all': [None]})
+
+    def test_diff(self):
+
+        """Testing config diff in the workers"""
+
+        running = self.device._execute_config_show('show running-config')
+        merged = self.device._execute_config_show('show configuration merge')
+        self.assertEqual(self.processor.diff(running, merged), self.device.compare_config())
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    """
+    Tests the rate limiting of the requests.
+    """
+
+    def test_token_bucket_burst_then_rate(self):
+
+        """Testing if the bucket allows the burst then queues at the configured rate"""
+
+        bucket = TokenBucket(rate=100, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), .01, places=2)
+        self.assertAlmostEqual(bucket.reserve(), .02, places=2)  # queued behind the previous one
+        self.assertGreater(bucket.delay(), .02)
+
+    def test_limits_per_scope(self):
+
+        """Testing if the device, site and class limits are combined"""
+
+        limiter = RateLimiter({'site': (10, 1), 'show': (1000, 1)})
+        limiter.acquire('edge01.bjm01', site='bjm01', request_class='show')
+        self.assertGreater(limiter.delay('edge02.bjm01', site='bjm01', request_class='get'), .05)  # same site
+        self.assertEqual(limiter.delay('edge01.yyz01', site='yyz01', request_class='show'), 0)  # other site
+
+    def test_device_requests_queued(self):
+
+        """Testing if the requests over the limit are delayed, not dropped"""
+
+        limiter = RateLimiter({'device': (20, 1)})
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=1, lock=False, rate_limiter=limiter)
+        device.open()
+        start = time.time()
+        for _ in range(3):
+            device.show_ntp_ass()
+        self.assertGreaterEqual(time.time() - start, .09)
+        self.assertGreater(device.throttle_delay(), 0)
+        self.assertEqual(limiter.stats()[('device', 'localhost')]['requests'], 3)
+        device.close()
+
+
+class TestMergeSimulation(unittest.TestCase):
+
+    """
+    Tests the offline simulation of config merges.
+    """
+
+    RUNNING_CONFIG = '''Building configuration...
+!! IOS XR Configuration version = 6.2.1.08I
+!! Last configuration change at Wed Aug 17 16:49:00 2016 by vagrant
+!
+hostname edge01.yyz01
+interface GigabitEthernet0/0/0/0
+ description old
+ mtu 1514
+ shutdown
+!
+interface GigabitEthernet0/0/0/1
+ shutdown
+!
+route-policy PASS
+  pass
+end-policy
+!
+ntp
+ peer 172.17.17.1
+!
+ssh server v2
+end'''
+
+    def test_unchanged_config(self):
+
+        """Testing if merging nothing renders the running config back"""
+
+        self.assertEqual(merge_config(self.RUNNING_CONFIG, ''), self.RUNNING_CONFIG)
+        self.assertEqual(simulate_compare_config(self.RUNNING_CONFIG, ''), '')
+
+    def test_merge_semantics(self):
+
+        """Testing no commands, single-value replacement, flat commands and RPL replacement"""
+
+        merged = merge_config(self.RUNNING_CONFIG, '''
+no hostname edge01.yyz01
+hostname edge01.bjm01
+interface GigabitEthernet0/0/0/0
+ description new
+ no shutdown
+!
+no interface GigabitEthernet0/0/0/1
+ntp peer 172.17.17.2
+no ntp peer 172.17.17.1
+route-policy PASS
+  drop
+end-policy
+!
+''')
+        # the removed hostname is added back after the last block
+        self.assertEqual(merged.splitlines()[4:], '''interface GigabitEthernet0/0/0/0
+ description new
+ mtu 1514
+!
+route-policy PASS
+  drop
+end-policy
+!
+ntp
+ peer 172.17.17.2
+!
+hostname edge01.bjm01
+ssh server v2
+end'''.splitlines())
+
+    def test_single_value_replaced_in_place(self):
+
+        """Testing if a single-value command is replaced at its place, and only leaf attributes are replaced"""
+
+        diff = simulate_compare_config(self.RUNNING_CONFIG, '''interface GigabitEthernet0/0/0/0
+ description new
+!
+''')
+        self.assertEqual(diff.splitlines()[5:], [' interface GigabitEthernet0/0/0/0', '- description old',
+                                                 '+ description new', '  mtu 1514', '  shutdown', ' !'])
+        running_config = self.RUNNING_CONFIG.replace('ssh server v2', 'vrf BLUE\nssh server v2')
+        merged = merge_config(running_config, 'vrf RED')
+        self.assertIn('vrf BLUE', merged)
+        self.assertIn('vrf RED', merged)
+
+    def test_diff_format_as_compare_config(self):
+
+        """Testing if the simulated diff has the same format as compare_config"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        running_config = device._execute_config_show('show running-config')
+        self.assertEqual(
+            simulate_compare_config(running_config, 'ntp peer 172.17.17.1').splitlines()[-4:],
+            ['+ntp', '+ peer 172.17.17.1', '+!', ' ssh server v2']
+        )
+        device.close()
+
+
+class TestStreamingDiff(unittest.TestCase):
+
+    """
+    Tests the streaming config diff.
+    """
+
+    RUNNING_CONFIG = TestMergeSimulation.RUNNING_CONFIG + '\n'
+
+    def _merged(self, *replacements):
+        merged = self.RUNNING_CONFIG
+        for old, new in replacements:
+            merged = merged.replace(old, new)
+        return merged
+
+    def test_same_diff_as_compare_config(self):
+
+        """Testing if changes within sections give the same diff as config_diff"""
+
+        for replacements in ((('description old', 'description new'), ),
+                             ((' mtu 1514\n', ''), ('peer 172.17.17.1', 'peer 172.17.17.2')),
+                             (('hostname edge01.yyz01', 'hostname edge01.bjm01'), ),
+                             (('  pass\n', '  pass\n  done\n'), )):
+            merged = self._merged(*replacements)
+            self.assertEqual(''.join(iter_config_diff(self.RUNNING_CONFIG, merged)),
+                             config_diff(self.RUNNING_CONFIG, merged))
+
+    def test_identical_configs(self):
+
+        """Testing if nothing is generated for identical configs"""
+
+        self.assertEqual(list(iter_config_diff(self.RUNNING_CONFIG, self.RUNNING_CONFIG)), [])
+
+    def test_hunks_generated_one_at_a_time(self):
+
+        """Testing if each hunk is generated before the rest of the configs is read"""
+
+        consumed = []
+
+        def lines(config):
+            for line in config.splitlines(True):
+                consumed.append(line)
+                yield line
+
+        merged = self._merged(('description old', 'description new'),
+                              (' peer 172.17.17.1', ' peer 172.17.17.1\n server 10.0.0.1'))
+        diff = iter_config_diff(lines(self.RUNNING_CONFIG), lines(merged), context=1)
+        self.assertEqual(next(diff), '--- \n+++ \n')
+        self.assertEqual(next(diff), '@@ -4,3 +4,3 @@\n interface GigabitEthernet0/0/0/0\n-' +
+                         ' description old\n+ description new\n  mtu 1514\n')
+        self.assertLess(len(consumed), 2 * len(self.RUNNING_CONFIG.splitlines()))
+        self.assertEqual(list(diff), ['@@ -17,2 +17,3 @@\n  peer 172.17.17.1\n+ server 10.0.0.1\n !\n'])
+
+    def test_new_and_removed_sections(self):
+
+        """Testing if added and removed sections are diffed as whole sections"""
+
+        merged = self._merged(('interface GigabitEthernet0/0/0/1\n shutdown\n!\n', ''),
+                              ('ssh server v2', 'snmp-server community public RO\nssh server v2'))
+        diff = ''.join(iter_config_diff(self.RUNNING_CONFIG, merged)).splitlines()
+        self.assertEqual([line for line in diff if line[:1] in '+-' and line[:3] not in ('---', '+++')], [
+            '-interface GigabitEthernet0/0/0/1', '- shutdown', '-!', '+snmp-server community public RO'
+        ])
+
+    def test_iter_compare_config(self):
+
+        """Testing if the device diff is generated hunk by hunk"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        diff = list(device.iter_compare_config())
+        self.assertEqual(diff[0], '--- \n+++ \n')
+        self.assertEqual([line for line in ''.join(diff[1:]).splitlines() if line[:1] in '+-'],
+                         ['+ntp', '+ peer 172.17.17.1', '+!'])
+        device.close()
+
+
+class TestConfigTree(unittest.TestCase):
+
+    """
+    Tests the indexed config tree.
+    """
+
+    CONFIG = '''Building configuration...\r
+!! IOS XR Configuration version = 6.2.1.08I
+!
+hostname edge01.yyz01
+interface GigabitEthernet0/0/0/0
+ service-policy input QOS-IN
+ shutdown
+!
+interface GigabitEthernet0/0/0/1
+ shutdown
+!
+route-policy PASS
+  pass
+end-policy
+!
+router bgp 13335
+ neighbor 172.17.17.1
+  remote-as 13335
+  address-family ipv4 unicast
+   route-policy PASS in
+  !
+ !
+!
+end
+'''
+
+    def setUp(self):
+        self.tree = ConfigTree(self.CONFIG)
+
+    def test_lossless_serialization(self):
+
+        """Testing if the tree serializes back to the original config"""
+
+        self.assertEqual(str(self.tree), self.CONFIG)
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        running_config = device._execute_config_show('show running-config')
+        self.assertEqual(ConfigTree(running_config).serialize(), running_config)
+        device.close()
+
+    def test_lookups(self):
+
+        """Testing lookups by section path and keyword"""
+
+        node = self.tree.get(('router bgp 13335', 'neighbor 172.17.17.1', 'address-family ipv4 unicast'))
+        self.assertEqual([child.text for child in node.children], ['route-policy PASS in'])
+        self.assertEqual(self.tree.path(node)[0], 'router bgp 13335')
+        self.assertIsNone(self.tree.get(('router bgp 13335', 'neighbor 172.17.17.2')))
+        self.assertEqual([section.text for section in self.tree.keyword('interface')],
+                         ['interface GigabitEthernet0/0/0/0', 'interface GigabitEthernet0/0/0/1'])
+        self.assertEqual(self.tree.keyword('route-policy')[0].body, ['  pass\n', 'end-policy\n'])
+        self.assertEqual(len(self.tree.keyword('route-policy', top_level=False)), 2)
+        self.assertEqual(len(self.tree.command('shutdown')), 2)
+        self.assertEqual([section.text for section in self.tree.sections_with('interface', 'service-policy input')],
+                         ['interface GigabitEthernet0/0/0/0'])
+        self.assertEqual(self.tree.sections_with('router', 'service-policy input'), [])
+
+
+class TestConfigCorpus(unittest.TestCase):
+
+    """
+    Tests the deduplicated in-memory corpus of configs.
+    """
+
+    _CONFIG = ('hostname {host}\nntp\n server 172.17.17.1\n!\ninterface Bundle-Ether1\n description {host}\n'
+               ' shutdown\n!\ninterface Bundle-Ether2\n description core\n!\nend')
+
+    def setUp(self):
+
+        self.corpus = ConfigCorpus()
+        for host in ('edge01', 'edge02', 'edge03'):
+            self.corpus.add(host, self._CONFIG.format(host=host))
+
+    def test_lines_stored_once(self):
+
+        """Testing if the lines shared by the configs are stored once and the configs rebuilt as added"""
+
+        self.assertEqual(self.corpus.get('edge02'), self._CONFIG.format(host='edge02'))
+        self.assertIsNone(self.corpus.get('edge04'))
+        stats = self.corpus.stats()
+        self.assertEqual((stats['hosts'], stats['lines'], stats['distinct_lines']), (3, 36, 14))
+        self.assertEqual(self.corpus.hosts(), ['edge01', 'edge02', 'edge03'])
+
+    def test_hosts_with_line(self):
+
+        """Testing the lookup of the hosts having a line, optionally in a section"""
+
+        self.assertEqual(self.corpus.hosts_with(' server 172.17.17.1'), ['edge01', 'edge02', 'edge03'])
+        self.assertEqual(self.corpus.hosts_with('hostname edge02'), ['edge02'])
+        self.assertEqual(self.corpus.hosts_with('server 172.17.17.1'), [])
+        self.corpus.add('edge02', self._CONFIG.format(host='edge02').replace(' shutdown\n', ''))
+        self.assertEqual(self.corpus.hosts_with(' shutdown', section='interface Bundle-Ether1'), ['edge01', 'edge03'])
+        self.assertEqual(self.corpus.hosts_with(' shutdown', section='interface Bundle-Ether2'), [])
+        self.assertEqual(self.corpus.count(' description core'), 3)
+        self.assertEqual(self.corpus.search(r'^ description edge0[12]$'),
+                         {' description edge01': ['edge01'], ' description edge02': ['edge02']})
+
+    def test_replace_and_remove(self):
+
+        """Testing if the lines no host has anymore are dropped"""
+
+        self.corpus.add('edge03', self._CONFIG.format(host='edge01'))
+        self.assertEqual(self.corpus.hosts_with('hostname edge01'), ['edge01', 'edge03'])
+        self.assertEqual(self.corpus.hosts_with('hostname edge03'), [])
+        self.corpus.remove('edge01')
+        self.corpus.remove('edge02')
+        self.assertEqual(self.corpus.stats()['distinct_lines'], 10)
+        self.corpus.add('edge04', self._CONFIG.format(host='edge04'))
+        self.assertEqual(self.corpus.hosts_with('hostname edge04'), ['edge04'])
+        self.assertEqual(self.corpus.get('edge03'), self._CONFIG.format(host='edge01'))
+        self.assertRaises(KeyError, self.corpus.remove, 'edge01')
+        self.assertNotIn('edge01', self.corpus)
+
+    def test_add_devices(self):
+
+        """Testing if the running configs of the devices are added"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        corpus = ConfigCorpus()
+        corpus.add_devices([device])
+        self.assertEqual(corpus.get('localhost'), device.get_running_config())
+        device.close()
+
+
+class TestConfigStore(unittest.TestCase):
+
+    """
+    Tests the persistent config store.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = ConfigStore(os.path.join(self.directory, 'store.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_deduplication(self):
+
+        """Testing if identical contents are stored once and versions can be pruned"""
+
+        self.store.put('edge01', '1000000001', 'cli:', u'hostname edge01\n' * 100)
+        self.store.put('edge01', '1000000002', 'cli:', u'hostname edge01\n' * 100)
+        self.store.put('edge01', '1000000003', 'cli:', u'hostname edge02\n' * 100)
+        stats = self.store.stats()
+        self.assertEqual((stats['snapshots'], stats['blobs']), (3, 2))
+        self.assertLess(stats['stored'], stats['size'])
+        self.assertEqual(self.store.get('edge01', '1000000002', 'cli:'), u'hostname edge01\n' * 100)
+        self.assertIsNone(self.store.get('edge01', '1000000004', 'cli:'))
+        self.assertEqual(self.store.latest('edge01', 'cli:'), u'hostname edge02\n' * 100)
+        self.assertEqual(self.store.prune(keep=1), 2)
+        self.assertEqual(self.store.stats()['blobs'], 1)
+
+    def test_shared_across_devices(self):
+
+        """Testing if the configs are retrieved from the store while the commit ID did not change"""
+
+        first = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, store=self.store)
+        first.open()
+        running_config = first.get_running_config()
+        subtree = first.get_running_config_subtree(('NTP', ))
+        first.close()
+        self.assertEqual(self.store.history('localhost', 'cli:')[0][0], '1000000125')
+
+        second = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False,
+                                    store=ConfigStore(self.store.path))
+        second.open()
+        calls = []
+        second._execute_config_show = lambda *args, **kwargs: calls.append(args)
+        self.assertEqual(second.get_running_config(), running_config)
+        self.assertEqual(ET.tostring(second.get_running_config_subtree(('NTP', ))), ET.tostring(subtree))
+        self.assertEqual(calls, [])
+        second.store.close()
+        second.close()
+
+    def test_not_stored_when_committed_meanwhile(self):
+
+        """Testing if a config retrieved while another session committed is not stored under the previous commit"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, store=self.store,
+                                    dedup_reads=10)
+        device.open()
+        device.get_commit_id()
+        stats = device.dedup_stats()
+        self.assertEqual(device.get_commit_id(refresh=True), '1000000125')
+        self.assertEqual(device.dedup_stats(), stats)  # asked the device again
+        commit_ids = ['1000000125', '1000000126']
+        device.get_commit_id = lambda refresh=False: commit_ids.pop(0)
+        self.assertTrue(device.get_running_config())
+        self.assertEqual(commit_ids, [])
+        self.assertEqual(self.store.history('localhost', 'cli:'), [])
+        device.close()
+
+
+class TestAudit(unittest.TestCase):
+
+    """
+    Tests the compliance audit engine.
+    """
+
+    RULES = [
+        Rule('ntp-server', r'^server ', section=r'^ntp$'),
+        Rule('interface-description', r'^description ', section=r'^interface ', unless=r'^shutdown$'),
+        Rule('no-telnet', r'^telnet ', present=False),
+        Rule('ssh-v2', r'^ssh server v2$'),
+    ]
+
+    def test_audit(self):
+
+        """Testing the evaluation of the rules against one config"""
+
+        config = '''hostname edge01.yyz01
+interface GigabitEthernet0/0/0/0
+ description uplink
+!
+interface GigabitEthernet0/0/0/1
+ ipv4 address 10.0.0.1 255.255.255.0
+!
+interface GigabitEthernet0/0/0/2
+ shutdown
+!
+telnet vrf default ipv4 server max-servers 10
+ntp
+ peer 172.17.17.1
+!
+end
+'''
+        self.assertEqual(sorted((v['rule'], v['section'], v['command']) for v in audit(self.RULES, config)), [
+            ('interface-description', 'interface GigabitEthernet0/0/0/1', None),
+            ('no-telnet', None, 'telnet vrf default ipv4 server max-servers 10'),
+            ('ntp-server', 'ntp', None),
+            ('ssh-v2', None, None),
+        ])
+
+    def test_audit_devices(self):
+
+        """Testing if the results stream per device and unchanged configs are not evaluated again"""
+
+        devices = []
+        for _ in range(2):
+            device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+            device.open()
+            devices.append(device)
+        devices[1].hostname = 'localhost2'
+        with AuditEngine(self.RULES, processes=2) as engine:
+            results = sorted(engine.audit_devices(devices), key=lambda result: result['host'])
+            self.assertEqual([result['host'] for result in results], ['localhost', 'localhost2'])
+            self.assertTrue(all(result['changed'] and result['error'] is None for result in results))
+            self.assertEqual([v['rule'] for v in results[0]['violations']], ['no-telnet'])
+            results = list(engine.audit_devices(devices))
+            self.assertFalse(any(result['changed'] for result in results))
+            engine.forget('localhost')
+            self.assertEqual(sum(result['changed'] for result in engine.audit_devices(devices)), 1)
+        for device in devices:
+            device.close()
+
+    def test_bounded_submissions(self):
+
+        """Testing if the configs are consumed as the results come, max_pending at a time"""
+
+        consumed = []
+
+        def _configs():
+            for index in range(6):
+                consumed.append(index)
+                yield 'edge%d' % index, 'hostname edge%d\ntelnet vrf default ipv4 server max-servers 1' % index
+
+        results = []
+        with AuditEngine(self.RULES, processes=1, max_pending=2) as engine:
+            for result in engine.run(_configs()):
+                results.append(result)
+                self.assertLessEqual(len(consumed) - len(results), 2)
+        self.assertEqual(sorted(result['host'] for result in results), ['edge%d' % index for index in range(6)])
+
+    def test_lost_task_reported(self):
+
+        """Testing if a config never audited, e.g. its worker died, is reported after task_timeout"""
+
+        with AuditEngine(self.RULES, processes=1, task_timeout=.2) as engine:
+            engine._submit = lambda *args: None  # lost
+            results = list(engine.run([('edge01', 'hostname edge01')]))
+        self.assertEqual(len(results), 1)
+        self.assertIn('not completed', results[0]['error'])
+
+
+class TestFastConnect(unittest.TestCase):
+
+    """
+    Tests the fast XML mode entry.
+    """
+
+    def tearDown(self):
+        IOSXR._prompts.pop('fast.localhost', None)
+
+    def test_cached_prompt(self):
+
+        """Testing if the CLI prompt is reused by the next fast connections to the same host"""
+
+        device = _MockedIOSXRDevice('fast.localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, fast_connect=True)
+        device.open()
+        self.assertEqual(IOSXR._prompts['fast.localhost'], device._cli_prompt)
+        prompt = device._cli_prompt
+        device.close()
+
+        find_prompt = _MockedNetMikoDevice.find_prompt
+        _MockedNetMikoDevice.find_prompt = lambda self: self.fail('find_prompt should not be called')
+        try:
+            device = _MockedIOSXRDevice('fast.localhost', 'vagrant', 'vagrant', timeout=.1, lock=False,
+                                        fast_connect=True)
+            device.open()
+        finally:
+            _MockedNetMikoDevice.find_prompt = find_prompt
+        self.assertEqual(device._cli_prompt, prompt)
+        device.show_ntp_ass()
+        device.close()
+
+    def test_pipelined_lock(self):
+
+        """Testing if the reply to the pipelined <Lock/> is read together with the XML prompt"""
+
+        device = _MockedIOSXRDevice('fast.localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, fast_connect=True)
+        device.open()
+        writes = []
+        device.device.write_channel = writes.append
+        device.device.read_channel = lambda: (
+            'xml\r\nXML> <?xml version="1.0" encoding="UTF-8"?><Response MajorVersion="1" MinorVersion="0">'
+            '<Lock/><ResultSummary ErrorCount="0"/></Response>\nXML> '
+        )
+        device.lock_on_connect = True
+        device._enter_xml_mode()
+        self.assertTrue(device.locked)
+        self.assertEqual(len(writes), 1)
+        self.assertIn('<Lock/>', writes[0])
+        self.assertFalse(device._lock_granted(_MockedNetMikoDevice.get_mock_file(wrap_request('<Lock/>'))))
+
+    def test_pipelined_lock_without_reply(self):
+
+        """Testing if a plain lock() is sent when the reply to the pipelined <Lock/> does not come shortly"""
+
+        device = _MockedIOSXRDevice('fast.localhost', 'vagrant', 'vagrant', timeout=60, lock=False, fast_connect=True)
+        device.open()
+        replies = ['xml\r\nXML> ']
+        device.device.write_channel = lambda commands: None
+        device.device.read_channel = lambda: replies.pop() if replies else ''
+        locks = []
+        device.lock = lambda: locks.append(device.locked)
+        device.lock_on_connect = True
+        device._PIPELINED_LOCK_WAIT = .05
+        start = time.time()
+        device._enter_xml_mode()
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(locks, [False])
+
+    def test_late_pipelined_lock_reply_drained(self):
+
+        """Testing if the late reply to the pipelined <Lock/> is dropped before the next request"""
+
+        device = _MockedIOSXRDevice('fast.localhost', 'vagrant', 'vagrant', timeout=60, lock=False, fast_connect=True)
+        device.open()
+        expected = device.show_ntp_ass()
+        write_channel, read_channel = device.device.write_channel, device.device.read_channel
+        replies = ['xml\r\nXML> ']
+        device.device.write_channel = lambda commands: None
+        device.device.read_channel = lambda: replies.pop() if replies else ''
+        device._PIPELINED_LOCK_WAIT = .05
+        device._enter_xml_mode_fast(pipeline_lock=True)
+        self.assertFalse(device.locked)
+        replies.append('<?xml version="1.0" encoding="UTF-8"?><Response MajorVersion="1" MinorVersion="0">'
+                       '<Lock/><ResultSummary ErrorCount="0"/></Response>\nXML> ')
+        self.assertEqual(device.show_ntp_ass(), expected)
+        self.assertEqual(replies, [])
+        device.device.write_channel, device.device.read_channel = write_channel, read_channel
+        device.close()
+
+    def test_refused_session_fails_fast(self):
+
+        """Testing if a session refused by the XML agent does not wait for the timeout"""
+
+        device = _MockedIOSXRDevice('fast.localhost', 'vagrant', 'vagrant', timeout=60, lock=False, fast_connect=True)
+        device.open()
+        replies = ['xml\r\nERROR: 0x4368c000 Maximum number of sessions reached\r\n' + device._cli_prompt]
+        device.device.write_channel = lambda commands: None
+        device.device.read_channel = lambda: replies.pop() if replies else ''
+        start = time.time()
+        self.assertRaises(ConnectError, device._enter_xml_mode)
+        self.assertLess(time.time() - start, 5)
+
+
+class TestDeadline(unittest.TestCase):
+
+    """
+    Tests the per call deadlines.
+    """
+
+    RPC = '<Get><Configuration><NTP></NTP></Configuration></Get>'
+
+    def setUp(self):
+        self.device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=60, lock=False)
+        self.device.open()
+
+    def tearDown(self):
+        self.device.close()
+
+    def test_nested_deadlines(self):
+
+        """Testing if nested deadlines cannot extend the outer one"""
+
+        with self.device.deadline(10):
+            outer = self.device._deadline()
+            with self.device.deadline(None):
+                self.assertEqual(self.device._deadline(), outer)
+            with self.device.deadline(1):
+                self.assertLess(self.device._deadline(), outer)
+            self.assertEqual(self.device._deadline(), outer)
+        self.assertIsNone(self.device._deadline())
+
+    def test_deadline_waiting_for_xml_agent(self):
+
+        """Testing if the deadline bounds the wait for the XML agent, instead of the timeout"""
+
+        acquired = threading.Event()
+        done = threading.Event()
+
+        def _busy():
+            # another request in flight
+            self.device._xml_agent_locker.acquire()
+            acquired.set()
+            done.wait(5)
+            self.device._xml_agent_locker.release()
+
+        thread = threading.Thread(target=_busy)
+        thread.start()
+        acquired.wait(5)
+        start = time.time()
+        self.assertRaises(TimeoutError, self.device.make_rpc_call, self.RPC, timeout=.2)
+        self.assertLess(time.time() - start, 5)
+        # the request in flight keeps the XML agent, and the session stays usable
+        self.assertTrue(self.device._xml_agent_locker.locked())
+        self.assertTrue(self.device._xml_agent_alive)
+        done.set()
+        thread.join()
+        self.assertTrue(self.device.make_rpc_call(self.RPC, timeout=5).startswith(b'<Response'))
+
+    def test_cancelled_request_leaves_session_usable(self):
+
+        """Testing if the reply of a request cancelled by its deadline is discarded before the next request"""
+
+        netmiko_device = self.device.device
+        send_command_expect = netmiko_device.send_command_expect
+
+        def _slow_reply(*args, **kwargs):
+            time.sleep(.3)
+            raise IOError('Search pattern never detected in send_command_expect: XML>')
+
+        netmiko_device.send_command_expect = _slow_reply
+        self.assertRaises(TimeoutError, self.device.show_ntp_ass, timeout=.2)
+        self.assertTrue(self.device._xml_agent_dirty)
+        self.assertFalse(self.device._xml_agent_locker.locked())
+        self.assertTrue(self.device._xml_agent_alive)  # no reconnection
+
+        netmiko_device.send_command_expect = send_command_expect
+        stale = ['</Exec></CLI><ResultSummary ErrorCount="0"/></Response>\nXML>', '']
+        netmiko_device.read_channel = lambda: stale.pop(0)
+        self.assertTrue(self.device.make_rpc_call(self.RPC, timeout=5).startswith(b'<Response'))
+        self.assertFalse(self.device._xml_agent_dirty)
+        self.assertEqual(stale, [''])
+
+    def test_new_session_has_no_cancelled_reply(self):
+
+        """Testing if the reply of a cancelled request is not awaited on a new session"""
+
+        self.device._xml_agent_dirty = True
+        self.device._reconnect()
+        self.assertFalse(self.device._xml_agent_dirty)
+        start = time.time()
+        self.assertTrue(self.device.make_rpc_call(self.RPC, timeout=5).startswith(b'<Response'))
+        self.assertLess(time.time() - start, 1)
+
+
+class TestCommitQueue(unittest.TestCase):
+
+    """
+    Tests the coalescing of the config fragments into one commit.
+    """
+
+    def setUp(self):
+
+        self.device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        self.device.open()
+        self.commits = []
+        commit_config = self.device.commit_config
+        self.device.commit_config = lambda **kwargs: self.commits.append(kwargs) or commit_config(**kwargs)
+
+    def tearDown(self):
+
+        self.device.close()
+
+    def test_fragments_committed_together(self):
+
+        """Testing if the fragments submitted within the window are committed at once"""
+
+        with CommitQueue(self.device, window=.2, lock=False) as queue:
+            tickets = []
+            threads = [threading.Thread(target=lambda: tickets.append(queue.submit('ntp peer 172.17.17.1')))
+                       for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual([ticket.result(timeout=5) for ticket in tickets], ['1000000125'] * 3)
+            self.assertEqual([ticket.batch for ticket in tickets], [3] * 3)
+            self.assertEqual(len(self.commits), 1)
+            self.assertEqual(queue.stats()['committed'], 3)
+
+    def test_invalid_fragment_rejected_alone(self):
+
+        """Testing if only the submitter of an invalid fragment gets the error"""
+
+        with CommitQueue(self.device, window=.1, lock=False) as queue:
+            good = queue.submit('ntp peer 172.17.17.1')
+            bad = queue.submit('ntp beer 256.257.258.259')
+            self.assertRaises(InvalidInputError, bad.result, 5)
+            self.assertEqual(good.result(timeout=5), '1000000125')
+            self.assertEqual(good.batch, 1)
+        self.assertEqual(queue.stats()['rejected'], 1)
+
+    def test_accepted_fragments_reloaded_one_by_one(self):
+
+        """Testing if the fragments accepted before an invalid one are loaded again separately"""
+
+        loads = []
+        load_candidate_config = self.device.load_candidate_config
+        self.device.load_candidate_config = lambda config: loads.append(config) or load_candidate_config(config=config)
+        with CommitQueue(self.device, window=.1, lock=False) as queue:
+            good = [queue.submit('ntp peer 172.17.17.1') for _ in range(2)]
+            bad = queue.submit('ntp beer 256.257.258.259')
+            self.assertRaises(InvalidInputError, bad.result, 5)
+            for ticket in good:
+                self.assertEqual(ticket.result(timeout=5), '1000000125')
+        self.assertEqual(loads, ['ntp peer 172.17.17.1'] * 2 + ['ntp beer 256.257.258.259'] +
+                         ['ntp peer 172.17.17.1'] * 2)
+
+    def test_commit_errors_reported_to_each_submitter(self):
+
+        """Testing if the fragments are committed one by one when the batch commit fails"""
+
+        with CommitQueue(self.device, window=.1, comment='empty', lock=False) as queue:
+            tickets = [queue.submit('ntp peer 172.17.17.1') for _ in range(2)]
+            for ticket in tickets:
+                self.assertRaises(CommitError, ticket.result, 5)
+        self.assertEqual(len(self.commits), 3)  # the batch, then each fragment
+
+    def test_close_commits_pending_fragments(self):
+
+        """Testing if closing the queue commits the pending fragments first"""
+
+        queue = CommitQueue(self.device, window=10, lock=False)
+        ticket = queue.submit('ntp peer 172.17.17.1')
+        queue.close()
+        self.assertTrue(ticket.done())
+        self.assertRaises(CommitError, queue.submit, 'ntp peer 172.17.17.1')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    """
+    Tests the per device circuit breaker.
+    """
+
+    def _fail(self, error):
+        raise error
+
+    def test_opens_after_failures_and_fails_fast(self):
+
+        """Testing if the circuit opens after the failures in a row and rejects the next calls"""
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        calls = []
+
+        def _unreachable():
+            calls.append(1)
+            raise ConnectError('unreachable')
+
+        for _ in range(2):
+            self.assertRaises(ConnectError, breaker.call, 'edge01', _unreachable)
+        self.assertEqual(breaker.state('edge01'), 'open')
+        self.assertRaises(CircuitOpenError, breaker.call, 'edge01', calls.append, 1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(breaker.state('edge02'), 'closed')
+        stats = breaker.stats()['edge01']
+        self.assertEqual((stats['trips'], stats['rejected']), (1, 1))
+        self.assertIn('unreachable', stats['last_error'])
+
+    def test_half_open_probe(self):
+
+        """Testing if one probe is let through after the reset timeout, and closes the circuit on success"""
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=.1)
+        self.assertRaises(TimeoutError, breaker.call, 'edge01', self._fail, TimeoutError('no answer'))
+        self.assertRaises(CircuitOpenError, breaker.before_call, 'edge01')
+        time.sleep(.15)
+        self.assertEqual(breaker.state('edge01'), 'half-open')
+        self.assertTrue(breaker.before_call('edge01'))  # the probe
+        self.assertRaises(CircuitOpenError, breaker.before_call, 'edge01')  # while the probe is in flight
+        breaker.record_failure('edge01', TimeoutError('no answer'))
+        self.assertEqual(breaker.state('edge01'), 'open')
+        time.sleep(.15)
+        self.assertEqual(breaker.call('edge01', lambda: 'ok'), 'ok')
+        self.assertEqual(breaker.state('edge01'), 'closed')
+
+    def test_interrupted_probe(self):
+
+        """Testing if an interrupted probe lets the next request probe the device"""
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        self.assertRaises(TimeoutError, breaker.call, 'edge01', self._fail, TimeoutError('no answer'))
+        self.assertRaises(KeyboardInterrupt, breaker.call, 'edge01', self._fail, KeyboardInterrupt())
+        self.assertEqual(breaker.state('edge01'), 'half-open')
+        self.assertEqual(breaker.call('edge01', lambda: 'ok'), 'ok')
+        self.assertEqual(breaker.state('edge01'), 'closed')
+
+    def test_request_errors_do_not_trip(self):
+
+        """Testing if the errors caused by the request do not open the circuit"""
+
+        breaker = CircuitBreaker(failure_threshold=1, xml_error_threshold=2)
+        for _ in range(3):
+            self.assertRaises(InvalidInputError, breaker.call, 'edge01', self._fail, InvalidInputError('typo'))
+        self.assertEqual(breaker.state('edge01'), 'closed')
+        for _ in range(2):
+            self.assertRaises(XMLCLIError, breaker.call, 'edge01', self._fail, XMLCLIError('agent error'))
+        self.assertEqual(breaker.state('edge01'), 'open')
+
+    def test_device_fails_fast(self):
+
+        """Testing if open() fails fast on a device which failed to connect, and healthy devices are unaffected"""
+
+        class _UnreachableDevice(_MockedIOSXRDevice):
+            def _connect(self):
+                time.sleep(.05)
+                raise ConnectError('unreachable')
+
+        breaker = CircuitBreaker(failure_threshold=2)
+        device = _UnreachableDevice('edge01', 'vagrant', 'vagrant', timeout=.1, lock=False, breaker=breaker)
+        for _ in range(2):
+            self.assertRaises(ConnectError, device.open)
+        start = time.time()
+        self.assertRaises(CircuitOpenError, device.open)
+        self.assertLess(time.time() - start, .05)
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, breaker=breaker)
+        device.open()
+        self.assertIsInstance(device.show_ntp_ass(), str)
+        self.assertEqual(breaker.state('localhost'), 'closed')
+        device.close()
+
+    def test_local_deadlines_do_not_trip(self):
+
+        """Testing if the deadlines expiring before the request is sent do not count as failures"""
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        self.assertRaises(DeadlineError, breaker.call, 'edge01', self._fail, DeadlineError('waiting'))
+        self.assertEqual(breaker.state('edge01'), 'closed')
+        self.assertRaises(TimeoutError, breaker.call, 'edge01', self._fail, TimeoutError('no answer'))
+        self.assertRaises(DeadlineError, breaker.call, 'edge01', self._fail, DeadlineError('waiting'))
+        self.assertEqual(breaker.state('edge01'), 'half-open')  # the next request is the probe
+        self.assertEqual(breaker.call('edge01', lambda: 'ok'), 'ok')
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, breaker=breaker)
+        device.open()
+        device._xml_agent_locker.acquire()
+        try:
+            self.assertRaises(DeadlineError, device.show_ntp_ass, timeout=.05)
+        finally:
+            device._xml_agent_locker.release()
+        self.assertEqual(breaker.state('localhost'), 'closed')
+        device.close()
+
+    def test_shared_failure_counts_once(self):
+
+        """Testing if a failure shared by deduplicated reads counts once"""
+
+        breaker = CircuitBreaker(failure_threshold=2)
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=1, lock=False, breaker=breaker,
+                                    dedup_reads=0)
+        device.open()
+
+        def _unreachable(*args, **kwargs):
+            time.sleep(.2)
+            raise ConnectError('unreachable')
+
+        device._dispatch_rpc = _unreachable
+        errors = []
+
+        def _read():
+            try:
+                device.show_ntp_ass()
+            except ConnectError as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=_read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(device.dedup_stats()['calls'], 1)
+        self.assertEqual(breaker.state('localhost'), 'closed')
+        self.assertEqual(breaker.stats()['localhost']['failures'], 1)
+        del device._dispatch_rpc
+        device.close()
+
+    def test_command_line_shares_the_breaker(self):
+
+        """Testing if the command line tool reports the hosts failing fast"""
+
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record_failure('router1', ConnectError('unreachable'))
+        args = build_parser().parse_args(['-i', 'hosts', '-t', '1', 'show', 'show', 'ntp', 'ass'])
+        args.password = 'vagrant'
+        output = StringIO()
+        summary = execute(parse_inventory(['router1', 'router2']), args, output,
+                          device_class=_MockedIOSXRDevice, breaker=breaker)
+        self.assertEqual(summary['failed'], 1)
+        records = dict((record['host'], record) for record in map(json.loads, output.getvalue().splitlines()))
+        self.assertEqual(records['router1']['error_type'], 'CircuitOpenError')
+        self.assertTrue(records['router2']['ok'])
+
+
+class TestPrefixIndex(unittest.TestCase):
+
+    """
+    Tests the longest prefix match index and the decoding of the operational replies.
+    """
+
+    _RIB = ('<?xml version="1.0"?><Response MajorVersion="1" MinorVersion="0"><Get><Operational><RIB><VRFTable>'
+            '<VRF><Naming><VRFName>{vrf}</VRFName></Naming><RouteTable>{routes}</RouteTable></VRF>'
+            '</VRFTable></RIB></Operational></Get><ResultSummary ErrorCount="0"/></Response>')
+    _ROUTE = ('<Route><Naming><Address>{0}</Address><PrefixLength>{1}</PrefixLength></Naming>'
+              '<Protocol>{2}</Protocol></Route>')
+
+    def setUp(self):
+
+        self.index = PrefixIndex([('0.0.0.0/0', 'default'), ('10.0.0.0/8', 'a'), ('10.1.0.0/16', 'b'),
+                                  ('10.1.2.0/24', 'c'), ('192.168.0.1/32', 'd')])
+
+    def test_lookup(self):
+
+        """Testing if the longest prefix covering an address is returned"""
+
+        self.assertEqual(self.index.lookup('10.1.2.3'), ('10.1.2.0/24', 'c'))
+        self.assertEqual(self.index.lookup('10.1.3.3'), ('10.1.0.0/16', 'b'))
+        self.assertEqual(self.index.lookup('192.168.0.1'), ('192.168.0.1/32', 'd'))
+        self.assertEqual(self.index.lookup('172.16.0.1'), ('0.0.0.0/0', 'default'))
+        self.index.remove('0.0.0.0/0')
+        self.assertIsNone(self.index.lookup('172.16.0.1'))
+        self.assertEqual(self.index.get('10.1.255.255/16'), 'b')
+        self.assertIn('10.0.0.0/8', self.index)
+        self.assertRaises(ValueError, self.index.lookup, '10.1.2.256')
+        self.assertRaises(ValueError, self.index.add, '10.0.0.0/33')
+
+    def test_covering_and_covered(self):
+
+        """Testing the prefixes covering and within a prefix"""
+
+        self.assertEqual([prefix for prefix, _ in self.index.covering('10.1.2.0/25')],
+                         ['0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24'])
+        self.assertEqual([prefix for prefix, _ in self.index.covered('10.0.0.0/8')],
+                         ['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24'])
+        self.assertEqual(list(self.index.covered('10.1.3.0/24')), [])
+        self.assertEqual(len(list(self.index)), 5)
+
+    def test_diff(self):
+
+        """Testing the comparison of two snapshots"""
+
+        later = PrefixIndex(self.index)
+        later.remove('10.1.2.0/24')
+        later.add('10.2.0.0/16', 'e')
+        later.add('10.1.0.0/16', 'f')
+        self.assertEqual(self.index.diff(later), {'added': [('10.2.0.0/16', 'e')],
+                                                  'removed': [('10.1.2.0/24', 'c')],
+                                                  'changed': [('10.1.0.0/16', 'b', 'f')]})
+        self.assertEqual(later.diff(PrefixIndex(later)), {'added': [], 'removed': [], 'changed': []})
+
+    def test_index_interface_addresses(self):
+
+        """Testing if the interface addresses of IPV4Network are indexed"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        raw = device.make_rpc_call('<Get><Operational><IPV4Network></IPV4Network></Operational></Get>', raw=True)
+        device.close()
+        addresses = index_reply(raw)
+        self.assertEqual(addresses.lookup('10.0.2.100'), ('10.0.2.0/24', {
+            'InterfaceName': 'MgmtEth0/RP0/CPU0/0', 'VRFName': 'default', 'address': '10.0.2.15'}))
+        self.assertEqual(len(index_reply(raw, vrf='other')), 0)
+
+    def test_index_routes_in_chunks(self):
+
+        """Testing if the routes are indexed from a reply received in chunks"""
+
+        routes = ''.join(self._ROUTE.format('10.%d.0.0' % octet, 16, 'bgp') for octet in range(100))
+        raw = self._RIB.format(vrf='default', routes=routes + self._ROUTE.format('2001:db8::', 32, 'static'))
+        chunks = [raw[start:start + 7] for start in range(0, len(raw), 7)]
+        routes = index_reply(chunks, value=lambda element, address: element.findtext('Protocol'))
+        self.assertEqual(len(routes), 100)  # IPv6 skipped
+        self.assertEqual(routes.lookup('10.42.1.1'), ('10.42.0.0/16', 'bgp'))
+        merged = index_reply(self._RIB.format(vrf='blue', routes=self._ROUTE.format('10.42.1.0', 24, 'static')),
+                             vrf='default', index=routes)
+        self.assertEqual(len(merged), 100)
+        self.assertRaises(InvalidXMLResponse, index_reply, raw[:-20] + '<broken')
+        self.assertRaises(XMLCLIError, index_reply, raw.replace('ErrorCount="0"', 'ErrorCount="1"'))
+
+
+class TestColumnarExport(unittest.TestCase):
+
+    """
+    Tests the decoding of the operational tables into columns.
+    """
+
+    _ARP = ('<?xml version="1.0"?><Response MajorVersion="1" MinorVersion="0"><Get><Operational><ARP><NodeTable>'
+            '<Node><Naming><NodeName>0/RSP0/CPU0</NodeName></Naming><EntryTable>{entries}</EntryTable></Node>'
+            '</NodeTable></ARP></Operational></Get><ResultSummary ErrorCount="0"/></Response>')
+    _ENTRY = ('<Entry><Naming><InterfaceName>{0}</InterfaceName><Address>{1}</Address></Naming>'
+              '<HardwareAddress>{2}</HardwareAddress><State>Dynamic</State><Age>{3}</Age></Entry>')
+
+    def _arp(self, count=3):
+        return self._ARP.format(entries=''.join(
+            self._ENTRY.format('Bundle-Ether%d' % (index % 2), '172.17.17.%d' % index, '0011.2233.44%02x' % index,
+                               index * 10) for index in range(count)))
+
+    def test_decode_arp_table(self):
+
+        """Testing if the rows are decoded into typed columns"""
+
+        table = decode_table(self._arp(), ARP_TABLE)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.names(), ['node', 'interface', 'address', 'mac', 'state', 'age'])
+        self.assertEqual(table['age'].values.tolist(), [0, 10, 20])
+        self.assertEqual(table['interface'].values.tolist(), [0, 1, 0])  # dictionary encoded
+        self.assertEqual(table['interface'].categories, ['Bundle-Ether0', 'Bundle-Ether1'])
+        self.assertEqual(list(table['address']), ['172.17.17.0', '172.17.17.1', '172.17.17.2'])
+        self.assertEqual(next(table.rows()), {'node': '0/RSP0/CPU0', 'interface': 'Bundle-Ether0',
+                                              'address': '172.17.17.0', 'mac': '0011.2233.4400',
+                                              'state': 'Dynamic', 'age': 0})
+        self.assertEqual(table['interface'].value_counts(), {'Bundle-Ether0': 2, 'Bundle-Ether1': 1})
+        self.assertEqual(list(table.filter('interface', lambda name: name.endswith('1'))['age']), [10])
+
+    def test_gather_fleet_tables(self):
+
+        """Testing if the replies of several devices, received in chunks, are appended to one table"""
+
+        table = None
+        for host in ('edge01', 'edge02'):
+            raw = self._arp(100).encode('utf-8')
+            table = decode_table([raw[start:start + 64] for start in range(0, len(raw), 64)], ARP_TABLE,
+                                 table=table, constants={'host': host})
+        self.assertEqual(len(table), 200)
+        self.assertEqual(table['host'].value_counts(), {'edge01': 100, 'edge02': 100})
+        other = decode_table(self._arp(1), ARP_TABLE, constants={'host': 'edge03'})
+        table.extend(other)
+        self.assertEqual(table['host'][200], 'edge03')
+        self.assertRaises(ValueError, table.extend, decode_table(self._arp(1), ARP_TABLE))
+        # a failed reply leaves the table as it was
+        self.assertRaises(XMLCLIError, decode_table, self._arp(5).replace('ErrorCount="0"', 'ErrorCount="1"'),
+                          ARP_TABLE, table=table, constants={'host': 'edge04'})
+        self.assertEqual(set(len(column) for column in table.columns.values()), {201})
+
+    def test_missing_and_invalid_values(self):
+
+        """Testing if the missing and invalid values are stored as defaults"""
+
+        reply = ('<Response><Get><Operational><RIB><VRF><Naming><VRFName>blue</VRFName></Naming><RouteTable>'
+                 '<Route><Naming><Address>2001:db8::</Address><PrefixLength>32</PrefixLength></Naming></Route>'
+                 '</RouteTable></VRF></RIB></Operational></Get></Response>')
+        row = next(decode_table(reply, ROUTE_TABLE).rows())
+        self.assertEqual((row['vrf'], row['prefix'], row['length'], row['protocol'], row['next_hop']),
+                         ('blue', '0.0.0.0', 32, '', '0.0.0.0'))
+        self.assertRaises(ValueError, Field, 'address', './/Address')
+        self.assertRaises(ValueError, Field, 'address', 'Address', 'ipv6')
+        schema = TableSchema('brief', '<Get/>', 'Route', [Field('up', 'Up', 'bool'), Field('load', 'Load', 'float')])
+        table = decode_table('<Response><Route><Up>true</Up><Load>0.5</Load></Route><Route/></Response>', schema)
+        self.assertEqual(list(table['up']), [True, False])
+        self.assertEqual(table['load'][0], .5)
+
+    def test_export_table(self):
+
+        """Testing if a partial reply is refused"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        self.assertRaises(IteratorIDError, device.export_table, 'mac')
+        device.close()
+
+
+class TestDeviceQueue(unittest.TestCase):
+
+    """
+    Tests the cross-process queue of the config jobs per device.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_queue(self):
+
+        """Testing if the jobs wait for the holder of the device lock file"""
+
+        first = DeviceQueue('edge01.bjm01', directory=self.directory)
+        second = DeviceQueue('edge01.bjm01', directory=self.directory)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire(timeout=.1))
+        self.assertEqual(second.holder()['pid'], os.getpid())
+        threading.Timer(.2, first.release).start()
+        self.assertTrue(second.acquire(timeout=5))
+        second.release()
+        self.assertIsNone(first.holder())
+
+    def test_queue_released_when_lock_fails(self):
+
+        """Testing if the device queue is released when the config cannot be locked"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False,
+                                    lock_queue=self.directory)
+        device.open()
+        self.assertRaises(LockError, device.lock)
+        self.assertFalse(device.lock_queue.locked())
+        self.assertIsNone(device.lock_queue.holder())
+        device.close()
+
+
+class TestTranscript(unittest.TestCase):
+
+    """
+    Tests the session transcripts.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'transcript.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_device_transcript(self):
+
+        """Testing if the requests and replies are logged with their request ID"""
+
+        transcript = Transcript(self.path)
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, logfile=transcript)
+        device.open()
+        device.show_ntp_ass()
+        device.close()
+        transcript.close()
+        with open(self.path) as transcript_file:
+            records = [json.loads(line) for line in transcript_file]
+        request_id = [record for record in records if 'show ntp ass' in record['payload']][0]['request_id']
+        exchange = [record for record in records if record['request_id'] == request_id]
+        self.assertEqual([record['direction'] for record in exchange], ['sent', 'received'])
+        self.assertEqual(exchange[0]['request_id'], exchange[1]['request_id'])
+        self.assertEqual(exchange[1]['host'], 'localhost')
+        self.assertEqual(exchange[1]['bytes'], len(exchange[1]['payload'].encode('utf-8')))
+        self.assertEqual(transcript.stats()['dropped'], 0)
+
+    def test_flush_after_close(self):
+
+        """Testing if flush returns once the writer stopped, and if the size counts the encoded bytes"""
+
+        transcript = Transcript(self.path)
+        transcript.record('localhost', 'sent', u'description caf\xe9')
+        transcript.close()
+        transcript.record('localhost', 'sent', 'show version')  # never written
+        transcript.flush()
+        with open(self.path) as transcript_file:
+            records = [json.loads(line) for line in transcript_file]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['bytes'], 17)
+
+    def test_rotation(self):
+
+        """Testing if the transcript files are rotated and compressed"""
+
+        transcript = Transcript(self.path, max_bytes=500, backup_count=2, compress=True)
+        for index in range(30):
+            transcript.record('localhost', 'sent', 'x' * 100, request_id=index)
+        transcript.close()
+        self.assertEqual(transcript.stats()['rotated'], 10)  # 3 records per file
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['transcript.jsonl', 'transcript.jsonl.1.gz', 'transcript.jsonl.2.gz'])
+        with gzip.open(self.path + '.1.gz', 'rb') as rotated:
+            self.assertEqual(json.loads(rotated.readline().decode('utf-8'))['request_id'], 27)
+
+    def test_drop_when_full(self):
+
+        """Testing if records are dropped instead of blocking when the writer cannot keep up"""
+
+        released = threading.Event()
+
+        class _SlowFile(object):
+            def write(self, data):
+                released.wait()
+
+            def flush(self):
+                pass
+
+        transcript = Transcript(_SlowFile(), max_pending=2)
+        for _ in range(10):
+            transcript.record('localhost', 'sent', '<Get/>')
+        self.assertGreaterEqual(transcript.stats()['dropped'], 7)
+        released.set()
+        transcript.close()
+
+
+class TestKeepalive(unittest.TestCase):
+
+    """
+    Tests the background keepalive of the XML agent.
+    """
+
+    def setUp(self):
+
+        self.device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False, keepalive=.02)
+        self.device.open()
+
+    def tearDown(self):
+
+        self.device.close()
+
+    def test_keepalive_thread_lifecycle(self):
+
+        """Testing if the keepalive thread is started on open and stopped on close"""
+
+        thread = self.device._keepalive_thread
+        self.assertTrue(thread.is_alive())
+        self.device.close()
+        self.assertFalse(thread.is_alive())
+
+    def test_keepalive_probes_idle_agent(self):
+
+        """Testing if the XML agent is probed when idle"""
+
+        probes = []
+        execute_rpc = self.device._execute_rpc
+        self.device._execute_rpc = lambda rpc, **kwargs: probes.append(rpc) or execute_rpc(rpc, **kwargs)
+        time.sleep(.2)
+        self.device.close()
+        self.assertIn('<GetVersion/>', probes)
+
+    def test_keepalive_reconnects_unresponsive_agent(self):
+
+        """Testing if the session is re-established when the XML agent does not answer"""
+
+        def _timeout(*args, **kwargs):
+            raise TimeoutError('no answer', self.device)
+        reconnects = []
+        connect = self.device._connect
+        self.device._execute_rpc = _timeout
+        self.device._connect = lambda: reconnects.append(True) or connect()
+        self.device._keepalive_probe()
+        self.assertEqual(reconnects, [True])
+
+
+class TestBroker(unittest.TestCase):
+
+    """
+    Tests the connection broker keeping the session open between processes.
+    """
+
+    def setUp(self):
+
+        self.socket_dir = tempfile.mkdtemp()
+        self.client = BrokerClient('localhost', 'vagrant', 'vagrant', timeout=1, socket_dir=self.socket_dir)
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        device.lock = lambda: None  # the mock data for <Lock/> is an error
+        self.broker = Broker(device, self.client.path, idle_timeout=.5)
+        self.thread = threading.Thread(target=self.broker.serve)
+        self.thread.start()
+        while not os.path.exists(self.client.path):
+            time.sleep(.01)
+        self.client.open()
+
+    def tearDown(self):
+
+        self.client.close()
+        self.thread.join()
+        shutil.rmtree(self.socket_dir)
+
+    def test_compare_config_from_cached_running_config(self):
+
+        """Testing if the merge diff is computed against the cached running config"""
+
+        self.client.load_candidate_config(config='ntp peer 172.17.17.1')
+        self.assertGreater(len(self.client.compare_config()), 0)
+        self.assertIsNotNone(self.broker._running_config)
+        self.client.discard_config()
+
+    def test_commit_invalidates_running_config(self):
+
+        """Testing if committing drops the cached running config"""
+
+        self.client.get_running_config()
+        self.client.commit_config(comment='good')
+        self.assertIsNone(self.broker._running_config)
+
+    def test_commit_from_other_session_refreshes_running_config(self):
+
+        """Testing if the cached running config is dropped when another session committed"""
+
+        self.client.get_running_config()
+        self.broker._running_config = 'stale'
+        self.assertEqual(self.client.get_running_config(), 'stale')
+        self.broker._running_commit_id = '1000000124'  # the device reports another last commit
+        self.assertNotEqual(self.client.get_running_config(), 'stale')
+
+    def test_failed_load_unlocks(self):
+
+        """Testing if the config DB is not left locked when the candidate config is refused"""
+
+        unlocked = []
+        unlock = self.broker.device.unlock
+        self.broker.device.unlock = lambda: unlocked.append(True) or unlock()
+        self.assertRaises(InvalidInputError, self.client.load_candidate_config, config='ntp beer 256.257.258.259')
+        self.assertEqual(unlocked, [True])
+
+    def test_disconnect_discards_candidate_config(self):
+
+        """Testing if the candidate config of a client which went away is not left to the next client"""
+
+        discarded = []
+        discard_config = self.broker.device.discard_config
+        self.broker.device.discard_config = lambda: discarded.append(True) or discard_config()
+        self.client.load_candidate_config(config='ntp peer 172.17.17.1')
+        self.client.close()
+        self.client.open()
+        self.assertTrue(self.client.call('ping'))  # served once the previous client is done
+        self.assertEqual(discarded, [True])
+        self.assertFalse(self.broker._pending)
+
+    def test_second_broker_exits(self):
+
+        """Testing if a broker spawned while another one serves the device exits without touching its socket"""
+
+        device = _MockedIOSXRDevice('localhost', 'vagrant', 'vagrant', timeout=.1, lock=False)
+        device.open()
+        Broker(device, self.client.path, idle_timeout=.5).serve()
+        self.assertTrue(os.path.exists(self.client.path))
+        self.assertTrue(self.client.call('ping'))
+
+    def test_errors_raised_on_client(self):
+
+        """Testing if errors on the broker side are raised with the same type"""
+
+        self.assertRaises(
+            InvalidInputError,
+            self.client.load_candidate_config,
+            config='ntp beer 256.257.258.259'
+        )
+        self.assertRaises(
+            CommitError,
+            self.client.commit_config,
+            comment='empty'
+        )
+
+
+class TestCommandLine(unittest.TestCase):
+
+    """
+    Tests the pyiosxr command line tool.
+    """
+
+    def test_parse_inventory(self):
+
+        """Testing the inventory parser"""
+
+        hosts = list(parse_inventory(['# comment', '', 'edge01.bjm01', 'edge01.yyz01 port=830 username=admin']))
+        self.assertEqual(hosts, [{'hostname': 'edge01.bjm01'},
+                                 {'hostname': 'edge01.yyz01', 'port': '830', 'username': 'admin'}])
+
+    def test_execute_streams_json_lines(self):
+
+        """Testing if one JSON line is written per host"""
+
+        args = build_parser().parse_args(['-i', 'hosts', '-c', '3', '-t', '1', 'show', 'show', 'ntp', 'ass'])
+        args.password = 'vagrant'
+        output = StringIO()
+        hosts = parse_inventory('router%d\n' % index for index in range(10))
+        summary = execute(hosts, args, output, device_class=_MockedIOSXRDevice)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(summary['hosts'], 10)
+        self.assertEqual(summary['failed'], 0)
+        self.assertEqual(sorted(record['host'] for record in records), sorted('router%d' % i for i in range(10)))
+        for record in records:
+            self.assertTrue(record['ok'])
+            self.assertIn('latency', record)
+
+    def test_execute_reports_failures(self):
+
+        """Testing if a failing host is reported and does not stop the others"""
+
+        args = build_parser().parse_args(['-i', 'hosts', '-t', '1', 'show', 'sh', 'fake'])
+        args.password = 'vagrant'
+        output = StringIO()
+        summary = execute(parse_inventory(['router1', 'router2']), args, output, device_class=_MockedIOSXRDevice)
+        self.assertEqual(summary['failed'], 2)
+        record = json.loads(output.getvalue().splitlines()[0])
+        self.assertEqual(record['error_type'], 'InvalidInputError')
+
+
 if __name__ == '__main__':
     unittest.main()